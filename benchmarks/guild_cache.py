@@ -0,0 +1,143 @@
+"""Memory and guild processing time of the full and the lean cache mode
+
+Synthetic GUILD_CREATE and MESSAGE_CREATE payloads are fed into the connection
+state of a discord.py client with the cache options of each mode, without a
+gateway connection. Memory is what the caches retain (traced with tracemalloc)
+per 1000 guilds and the total RSS growth of the process. The time spent in
+GUILD_CREATE is measured in a separate untraced pass and is a proxy for the
+ready time: without member chunking, parsing the guilds is the work the client
+does before it becomes ready. Each mode runs in its own process.
+
+    python benchmarks/guild_cache.py --guilds 5000 --messages 20000
+"""
+import argparse
+import gc
+import subprocess
+import sys
+import time
+import tracemalloc
+from os import path
+
+SRC = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src')
+TIMESTAMP = '2024-01-01T00:00:00+00:00'
+
+
+def user(user_id):
+    return {
+        'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0',
+        'global_name': None, 'avatar': None,
+    }
+
+
+def member(user_id):
+    return {
+        'user': user(user_id), 'roles': [], 'joined_at': TIMESTAMP, 'deaf': False,
+        'mute': False, 'flags': 0,
+    }
+
+
+def guild_payload(guild_id, channels, roles, emojis, members):
+    first = guild_id * 1000
+    return {
+        'id': str(guild_id), 'name': f'guild {guild_id}', 'owner_id': '1',
+        'member_count': 500, 'large': False, 'features': [], 'unavailable': False,
+        'premium_tier': 0, 'verification_level': 0, 'stickers': [], 'voice_states': [],
+        'presences': [], 'threads': [], 'stage_instances': [],
+        'guild_scheduled_events': [],
+        'roles': [
+            {'id': str(guild_id if i == 0 else first + i), 'name': f'role {i}',
+             'permissions': '0', 'position': i, 'color': 0, 'hoist': False,
+             'managed': False, 'mentionable': False, 'flags': 0}
+            for i in range(roles)
+        ],
+        'channels': [
+            {'id': str(first + 100 + i), 'type': 0, 'name': f'channel-{i}', 'position': i,
+             'permission_overwrites': [], 'nsfw': False, 'parent_id': None, 'topic': None,
+             'rate_limit_per_user': 0}
+            for i in range(channels)
+        ],
+        'emojis': [
+            {'id': str(first + 200 + i), 'name': f'emoji{i}', 'roles': [],
+             'require_colons': True, 'managed': False, 'animated': False,
+             'available': True}
+            for i in range(emojis)
+        ],
+        # Without the members intent GUILD_CREATE only has a few members (e.g. in voice)
+        'members': [member(first + 300 + i) for i in range(members)],
+    }
+
+
+def message_payload(message_id, guild_id, author_id):
+    return {
+        'id': str(message_id), 'channel_id': str(guild_id * 1000 + 100),
+        'guild_id': str(guild_id), 'author': user(author_id), 'member': member(author_id),
+        'content': 'some message content ' * 4, 'timestamp': TIMESTAMP,
+        'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+        'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+    }
+
+
+def measure(mode, args):
+    sys.path.insert(0, SRC)
+    import discord
+    from cogs.utils.cacheoptions import get_cache_options
+    from cogs.utils.memory import get_rss
+
+    options = get_cache_options({'lean_cache': mode == 'lean'})
+    payloads = [
+        guild_payload(i + 1, args.channels, args.roles, args.emojis, args.members)
+        for i in range(args.guilds)
+    ]
+
+    state = discord.Client(**options)._connection
+    started = time.perf_counter()
+    for payload in payloads:
+        state._get_create_guild(payload)
+    guild_time = time.perf_counter() - started
+    del state
+    gc.collect()
+
+    client = discord.Client(**options)
+    state = client._connection
+    rss_before = get_rss()
+    tracemalloc.start()
+    for payload in payloads:
+        state._get_create_guild(payload)
+    gc.collect()
+    guild_bytes = tracemalloc.get_traced_memory()[0]
+    for i in range(args.messages):
+        guild_id = i % args.guilds + 1
+        state.parse_message_create(message_payload(10**12 + i, guild_id, 10**9 + i))
+    gc.collect()
+    message_bytes = tracemalloc.get_traced_memory()[0] - guild_bytes
+    tracemalloc.stop()
+    rss_growth = get_rss() - rss_before
+    per_1000 = 1000 / args.guilds
+    print(
+        f'{mode:<5} | guild caches {guild_bytes / 2**20 * per_1000:5.1f} MB per 1000 | '
+        f'message cache {message_bytes / 2**20:5.1f} MB ({len(state._messages or ())} '
+        f'messages) | RSS growth {rss_growth / 2**20:5.1f} MB | '
+        f'GUILD_CREATE {guild_time * 1000 * per_1000:4.0f} ms per 1000 | members cached '
+        f'{sum(len(guild.members) for guild in client.guilds)}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--mode', choices=['full', 'lean'])
+    parser.add_argument('--guilds', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--channels', type=int, default=20)
+    parser.add_argument('--roles', type=int, default=15)
+    parser.add_argument('--emojis', type=int, default=10)
+    parser.add_argument('--members', type=int, default=5)
+    args = parser.parse_args()
+    if args.mode:
+        measure(args.mode, args)
+        return
+    for mode in ('full', 'lean'):
+        subprocess.run([sys.executable, *sys.argv, '--mode', mode], check=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Latency of the run path against a stubbed piston API and stubbed discord calls
+
+Every discord and piston call sleeps for a fixed simulated latency, so the numbers
+show how much of the latency of a run is spent waiting for calls one after another.
+Use --src to benchmark another checkout of the bot (e.g. a git worktree of an older
+commit):
+
+    python benchmarks/run_path.py
+    python benchmarks/run_path.py --src /tmp/before/src
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from os import path
+from statistics import median
+
+sys.path.insert(0, path.join(path.dirname(path.dirname(path.abspath(__file__))), 'tests'))
+from stubs import (  # pylint: disable=C0413
+    SRC, FakeAttachment, FakeClient, FakeContext, Latency, StubSession, bot_directory,
+    import_src, start_run_cog
+)
+
+CODEBLOCK = '/run py\n```py\nprint("hello world")\n```'
+ATTACHMENT = '/run'
+
+
+def quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def benchmark(runs, latency):
+    client = FakeClient(StubSession(latency))
+    cog = await start_run_cog(client)
+    results = dict()
+    scenarios = {
+        'codeblock': lambda user_id: FakeContext(client, user_id, CODEBLOCK, guild_id=1),
+        'attachment': lambda user_id: FakeContext(
+            client, user_id, ATTACHMENT, guild_id=1,
+            attachments=[FakeAttachment('main.py', 'print("hello world")', latency.download)]
+        ),
+    }
+    user_ids = iter(range(1, 10**6))
+    for name, make_context in scenarios.items():
+        command, output = [], []
+        for _ in range(runs):
+            ctx = make_context(next(user_ids))
+            started = time.perf_counter()
+            await cog.get_run_output(ctx)
+            output.append(time.perf_counter() - started)
+            ctx = make_context(next(user_ids))
+            started = time.perf_counter()
+            await cog.run.callback(cog, ctx, source=ctx.message.content)
+            command.append(time.perf_counter() - started)
+            assert ctx.sent and 'hello world' in ctx.sent[-1].content, ctx.sent
+        results[name] = (output, command)
+    await asyncio.sleep(latency.log)  # Let background log requests finish
+    cog.cog_unload()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--src', default=SRC, help='src directory of the bot')
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--execute', type=float, default=0.25, help='seconds per execute')
+    parser.add_argument('--log', type=float, default=0.1, help='seconds per log request')
+    parser.add_argument('--typing', type=float, default=0.12, help='seconds per typing call')
+    parser.add_argument('--send', type=float, default=0.1, help='seconds per message send')
+    parser.add_argument('--download', type=float, default=0.08,
+                        help='seconds per attachment download')
+    args = parser.parse_args()
+    import_src(path.abspath(args.src))
+    latency = Latency(args.execute, args.log, args.typing, args.send, args.download)
+    with tempfile.TemporaryDirectory() as root, bot_directory(root):
+        results = asyncio.run(benchmark(args.runs, latency))
+    print(f'{args.src} | {args.runs} runs per scenario | simulated latencies {latency}')
+    for name, (output, command) in results.items():
+        for label, values in (('get_run_output', output), ('run command', command)):
+            print(
+                f'{name:<11} {label:<15} median {median(values) * 1000:>6.1f} ms | '
+                f'p95 {quantile(values, 95) * 1000:>6.1f} ms'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,24 +1,48 @@
 """PistonBot
 
 """
+import time
+STARTED = time.perf_counter()  # Start of the process for the startup report
+# pylint: disable=C0413
+import asyncio
 import json
 import sys
 import traceback
 from datetime import datetime, timezone
 from os import path, listdir
 from discord.ext.commands import AutoShardedBot, Context
-from discord import Activity, AllowedMentions, Intents
+from discord import Activity, AllowedMentions
 from aiohttp import ClientSession, ClientTimeout
-from discord.ext.commands.bot import when_mentioned_or
+from cogs.utils.cacheoptions import get_cache_options
+from cogs.utils.guildsettings import GuildSettingsStore
+from cogs.utils.jsoncodec import get_codec
+from cogs.utils.memory import get_rss
+from cogs.utils.quota import Blocklist
+from cogs.utils.startup import StartupReport
+IMPORTED = time.perf_counter()
 
 
 class PistonBot(AutoShardedBot):
     def __init__(self, *args, **options):
-        super().__init__(*args, **options)
+        startup_report = StartupReport(STARTED)
+        startup_report.record('imports', STARTED, IMPORTED)
+        with startup_report.phase('config'):
+            with open('../state/config.json') as conffile:
+                config = json.load(conffile)
+        cache_options = get_cache_options(config)
+        super().__init__(*args, **cache_options, **options)
+        self.message_cache_size = cache_options['max_messages']
         self.session = None
-        with open('../state/config.json') as conffile:
-            self.config = json.load(conffile)
+        self.startup_report = startup_report
+        self.config = config
+        self.json = get_codec(config.get('json_codec', 'json'))
+        self.connect_started = None
+        with self.startup_report.phase('state'):
+            self.blocklist = Blocklist('../state/blocklist.json', initial=[501851143203454986])
+            self.guild_settings = GuildSettingsStore('../state/guild_settings.json')
+        self.cog_state = dict()  # cog name -> state handed over on reload (utils/handoff.py)
         self.last_errors = []
+        self.max_errors = config.get('max_errors', 100)  # Older errors are dropped
         self.recent_guilds_joined = []
         self.recent_guilds_left = []
         self.default_activity = Activity(name='emkc.org/run | ./run', type=0)
@@ -28,7 +52,10 @@ class PistonBot(AutoShardedBot):
         self.maintenance_mode = False
 
     async def start(self, *args, **kwargs):
-        self.session = ClientSession(timeout=ClientTimeout(total=15))
+        self.session = ClientSession(
+            timeout=ClientTimeout(total=15), json_serialize=self.json.dumps
+        )
+        self.connect_started = time.perf_counter()
         await super().start(*args, **kwargs)
 
     async def close(self):
@@ -36,22 +63,43 @@ class PistonBot(AutoShardedBot):
         await super().close()
 
     async def setup_hook(self):
+        self.startup_report.record('login', self.connect_started)
+        self.guild_settings.set_bot_id(self.user.id)
         print('Loading Extensions:')
+        lazy_extensions = self.config.get('lazy_extensions', [])
         STARTUP_EXTENSIONS = []
         for file in listdir(path.join(path.dirname(__file__), 'cogs/')):
             filename, ext = path.splitext(file)
-            if '.py' in ext:
+            if '.py' in ext and f'cogs.{filename}' not in lazy_extensions:
                 STARTUP_EXTENSIONS.append(f'cogs.{filename}')
 
-        for extension in reversed(STARTUP_EXTENSIONS):
-            try:
-                print('loading', extension)
-                await self.load_extension(f'{extension}')
-            except Exception as e:
-                await self.log_error(e, 'Cog INIT')
-                exc = f'{type(e).__name__}: {e}'
-                print(f'Failed to load extension {extension}\n{exc}')
-
+        # One after another in a fixed order - setup() runs synchronously anyway and the
+        # order of the log (and of imports like cogs.slash -> cogs.run) stays the same
+        with self.startup_report.phase('extensions'):
+            for extension in reversed(STARTUP_EXTENSIONS):
+                await self.load_startup_extension(extension)
+        self.connect_started = time.perf_counter()
+
+    async def load_startup_extension(self, extension):
+        start = time.perf_counter()
+        try:
+            print('loading', extension)
+            await self.load_extension(f'{extension}')
+        except Exception as e:
+            await self.log_error(e, 'Cog INIT')
+            exc = f'{type(e).__name__}: {e}'
+            print(f'Failed to load extension {extension}\n{exc}')
+        finally:
+            self.startup_report.record(f'load {extension}', start)
+
+    async def load_lazy_extensions(self):
+        """Load extensions that are not needed to answer the first commands"""
+        for extension in self.config.get('lazy_extensions', []):
+            if extension not in self.extensions:
+                await self.load_startup_extension(extension)
+
+    def resolve_settings(self, msg):
+        return self.guild_settings.resolve(msg.guild.id if msg.guild else None)
 
     def user_is_admin(self, user):
         return user.id in self.config['admins']
@@ -66,35 +114,54 @@ class PistonBot(AutoShardedBot):
             error_source.message.content if is_context else None,
             error_source.message.attachments[0] if has_attachment else None,
         ))
+        del self.last_errors[:-self.max_errors]
         await self.change_presence(activity=self.error_activity)
 
 
-intents = Intents.default()
-intents.message_content = True
+def get_prefix(bot, msg):
+    return bot.resolve_settings(msg).prefixes
+
 
 client = PistonBot(
-    command_prefix=when_mentioned_or('./', '/'),
+    command_prefix=get_prefix,
     description='Hello, I can run code!',
-    max_messages=15000,
     allowed_mentions=AllowedMentions(everyone=False, users=True, roles=False),
-    intents=intents
 )
 client.remove_command('help')
 
 
+@client.event
+async def on_shard_ready(shard_id):
+    if not client.startup_report.has(f'shard {shard_id} ready'):
+        client.startup_report.record(f'shard {shard_id} ready', client.connect_started)
+
+
 @client.event
 async def on_ready():
+    if not client.startup_report.has('gateway connect'):
+        client.startup_report.record('gateway connect', client.connect_started)
+        rss = get_rss() / 2**20
+        guilds = len(client.guilds)
+        client.startup_report.note(
+            f'cache mode {"lean" if client.config.get("lean_cache") else "full"} | '
+            f'{guilds} servers | RSS {rss:.0f} MB | '
+            f'{rss * 1000 / max(guilds, 1):.1f} MB per 1000 servers'
+        )
+        client.startup_report.note(
+            f'event loop {type(asyncio.get_running_loop()).__module__} | '
+            f'json codec {client.json.name}'
+        )
+        print(f'Startup report:\n{client.startup_report}')
+        await client.load_lazy_extensions()
     print('PistonBot started successfully')
     return True
 
 
 @client.event
 async def on_message(msg):
-    prefixes = await client.get_prefix(msg)
-    for prefix in prefixes:
-        if msg.content.lower().startswith(f'{prefix}run'):
-            msg.content = msg.content.replace(f'{prefix}run', f'/run', 1)
-            break
+    match = client.resolve_settings(msg).run_regex.match(msg.content)
+    if match:
+        msg.content = '/run' + msg.content[match.end():]
     await client.process_commands(msg)
 
 
@@ -115,5 +182,19 @@ async def on_error(event_method, *args, **kwargs):
     await client.log_error(sys.exc_info()[1], 'DEFAULT HANDLER:' + event_method)
 
 
+def install_event_loop(name):
+    """Use uvloop instead of the default asyncio event loop if it is configured and
+    installed"""
+    if name != 'uvloop':
+        return
+    try:
+        import uvloop
+    except ImportError:
+        print('uvloop is not installed - using the default event loop')
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
+install_event_loop(client.config.get('event_loop', 'asyncio'))
 client.run(client.config["bot_key"])
 print('PistonBot has exited')
@@ -0,0 +1,124 @@
+"""This is a cog for a discord.py bot.
+It will record every code execution in a local database and add commands to query it
+
+Commands:
+    stats               show the most used languages
+      - top             show the top [n] languages of the last [days] days
+      - latency         show latency percentiles per language
+      - shadow          compare the shadow piston backend with the primary one
+
+"""
+# pylint: disable=E0402
+import hashlib
+import time
+from discord.ext import commands, tasks
+from .utils.analytics import AnalyticsStore, get_salt
+
+
+class Analytics(commands.Cog, name='Analytics'):
+    def __init__(self, client):
+        self.client = client
+        self.store = AnalyticsStore('../state/analytics.sqlite3')
+        self.salt = get_salt(self.client.config.get('analytics_salt', ''))
+        self.flush_store.start()
+        self.expire_store.start()
+
+    def cog_unload(self):
+        self.flush_store.cancel()
+        self.expire_store.cancel()
+        self.store.close()
+
+    async def cog_check(self, ctx):
+        return self.client.user_is_admin(ctx.author)
+
+    @tasks.loop(seconds=10)
+    async def flush_store(self):
+        await self.store.flush()
+
+    @tasks.loop(hours=1)
+    async def expire_store(self):
+        await self.store.expire()
+
+    def hash(self, value):
+        return hashlib.blake2b(value, key=self.salt, digest_size=16).hexdigest()
+
+    @commands.Cog.listener()
+    async def on_code_executed(self, ctx, language, version, source, output, timings):
+        parse_time, execute_time = timings
+        self.store.add((
+            time.time(),
+            language,
+            version,
+            ctx.guild.id if ctx.guild else 0,
+            self.hash(str(ctx.author.id).encode()),
+            self.hash(source.encode()),
+            len(source),
+            len(output),
+            parse_time * 1000,
+            execute_time * 1000,
+        ))
+
+    @commands.group(
+        name='stats',
+        hidden=True,
+        invoke_without_command=True,
+    )
+    async def stats(self, ctx):
+        """Show the most used languages of the last 7 days"""
+        await ctx.invoke(self.stats_top)
+
+    @stats.command(
+        name='top',
+    )
+    async def stats_top(self, ctx, n: int = 10, days: float = 7, guild_id: int = None):
+        """Show the top [n] languages of the last [days] days (optionally for one server)"""
+        started = time.perf_counter()
+        rows = await self.store.top_languages(n, days, guild_id)
+        duration = (time.perf_counter() - started) * 1000
+        response = [f'[Top {n} languages | {days} days | server {guild_id or "all"}]']
+        response += [
+            f'{language:<15} {count:>8} runs | avg {avg_ms:>7.0f} ms'
+            for language, count, avg_ms in rows
+        ]
+        response.append(f'Query took {duration:.1f} ms')
+        response = '\n'.join(response)
+        await ctx.send(f'```css\n{response[:1900]}```')
+
+    @stats.command(
+        name='latency',
+        aliases=['slow'],
+    )
+    async def stats_latency(self, ctx, days: float = 7, guild_id: int = None, n: int = 15):
+        """Show the [n] slowest languages by p95 latency (optionally for one server)"""
+        started = time.perf_counter()
+        percentiles = await self.store.latency_percentiles(days, guild_id)
+        duration = (time.perf_counter() - started) * 1000
+        rows = sorted(percentiles.items(), key=lambda item: item[1][2], reverse=True)[:n]
+        response = [f'[Latency | {days} days | server {guild_id or "all"}]']
+        response += [
+            f'{language:<15} {count:>7} runs | p50 {p50:>6.0f} | p95 {p95:>6.0f} | '
+            f'p99 {p99:>6.0f} ms'
+            for language, (count, p50, p95, p99) in rows
+        ]
+        response.append(f'Query took {duration:.1f} ms')
+        response = '\n'.join(response)
+        await ctx.send(f'```css\n{response[:1900]}```')
+
+    @stats.command(
+        name='shadow',
+    )
+    async def stats_shadow(self, ctx, n: int = 15):
+        """Show latency deltas and output mismatches of mirrored requests per language"""
+        run_cog = self.client.get_cog('CodeExecution')
+        if run_cog is None or not run_cog.shadow_url:
+            await ctx.send('No shadow backend configured')
+            return
+        response = (
+            f'[Shadow {run_cog.shadow_url} | rate {run_cog.shadow_rate:.1%}]\n'
+            + run_cog.shadow_stats.report(n)
+        )
+        await ctx.send(f'```css\n{response[:1900]}```')
+
+
+async def setup(client):
+    await client.add_cog(Analytics(client))
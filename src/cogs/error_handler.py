@@ -4,6 +4,9 @@ It will add error handling and inspecting commands
 Commands:
     error               List unhandled errors
       - traceback       print traceback of stored error
+      - lag             show event loop lag and gateway latency
+      - stalls          list callbacks that blocked the event loop / print their stack
+      - memory          show the RSS and the sizes of caches and stores vs. their bounds
 
 """
 # pylint: disable=E0402
@@ -12,13 +15,53 @@ import typing
 from datetime import datetime, timezone
 from asyncio import TimeoutError as AsyncTimeoutError
 from discord import Embed, DMChannel, errors as discord_errors
-from discord.ext import commands
+from discord.ext import commands, tasks
 from .utils.errors import PistonError
+from .utils.loopmonitor import LoopMonitor
+from .utils.memory import MemoryBoundExceeded, MemoryWatchdog
 
 
 class ErrorHandler(commands.Cog, name='ErrorHandler'):
     def __init__(self, client):
         self.client = client
+        self.loop_monitor = LoopMonitor(client)
+        self.loop_monitor.start()
+        memory = self.client.config.get('memory', {})
+        self.memory_watchdog = MemoryWatchdog(
+            max_rss=memory.get('max_rss_mb', 1024) * 2**20,
+            max_growth=memory.get('max_growth_mb', 256) * 2**20,
+            window=memory.get('window', 3600),
+        )
+        self.check_memory.start()
+
+    def cog_unload(self):
+        self.loop_monitor.stop()
+        self.check_memory.cancel()
+
+    def get_structure_sizes(self):
+        """name -> (size, bound or None) of the long lived structures of the bot"""
+        client = self.client
+        structures = {
+            'last_errors': (len(client.last_errors), client.max_errors),
+            'recent_guilds_joined': (len(client.recent_guilds_joined), 10),
+            'recent_guilds_left': (len(client.recent_guilds_left), 10),
+            'message cache': (len(client.cached_messages), client.message_cache_size),
+            'guild settings cache': (len(client.guild_settings.cache), None),
+            'blocklist': (len(client.blocklist), None),
+        }
+        run_cog = client.get_cog('CodeExecution')
+        if run_cog is not None:
+            structures.update(run_cog.get_structure_sizes())
+        return structures
+
+    @tasks.loop(minutes=1)
+    async def check_memory(self):
+        for message in self.memory_watchdog.sample(self.get_structure_sizes()):
+            await self.client.log_error(MemoryBoundExceeded(message), 'Memory watchdog')
+
+    @check_memory.before_loop
+    async def before_check_memory(self):
+        await self.client.wait_until_ready()
 
     # ----------------------------------------------
     # Error handler
@@ -29,7 +72,7 @@ class ErrorHandler(commands.Cog, name='ErrorHandler'):
             return
 
         if not isinstance(ctx.channel, DMChannel):
-            perms = ctx.channel.permissions_for(ctx.guild.get_member(self.client.user.id))
+            perms = ctx.channel.permissions_for(ctx.guild.me)
             try:
                 if not perms.send_messages:
                     await ctx.author.send("I don't have permission to write in this channel.")
@@ -183,6 +226,56 @@ class ErrorHandler(commands.Cog, name='ErrorHandler'):
         """Print the traceback of error [n] from the error log"""
         await self.print_traceback(ctx, n)
 
+    @error.command(
+        name='lag',
+    )
+    async def error_lag(self, ctx, seconds: int = 300):
+        """Show event loop lag and gateway latency of the last [seconds] seconds"""
+        await ctx.send(f'```css\n{self.loop_monitor.summary(seconds)}```')
+
+    @error.command(
+        name='stalls',
+        aliases=['stall'],
+    )
+    async def error_stalls(self, ctx, n: int = None):
+        """List callbacks that blocked the event loop or print the stack of stall [n]"""
+        stalls = self.loop_monitor.stalls
+        if not stalls:
+            await ctx.send('No stalls recorded')
+            return
+        if n is None:
+            response = [f'```css\nNumber of stored stalls: {len(stalls)}']
+            for i, stall in enumerate(stalls):
+                slowest = stall.slowest_shard()
+                response.append(
+                    f'{i}: [{stall.date.isoformat().split(".")[0]}] - '
+                    f'[{stall.duration * 1000:.0f} ms] - task [{stall.task_name}] - '
+                    + (
+                        f'gateway latency {slowest[1] * 1000:.0f} ms (shard {slowest[0]})'
+                        if slowest else 'no gateway latency'
+                    )
+                )
+            to_send = '\n'.join(response)
+            await ctx.send(to_send[:1990] + '```')
+            return
+        if n >= len(stalls) or n < 0:
+            await ctx.send('Stall index does not exist')
+            return
+        stall = stalls[n]
+        await ctx.send(
+            f'`Loop blocked for {stall.duration * 1000:.0f} ms in task {stall.task_name}`'
+            f'\n```python\n{stall.stack[-1800:]}\n```'
+        )
+
+    @error.command(
+        name='memory',
+        aliases=['mem'],
+    )
+    async def error_memory(self, ctx):
+        """Show the RSS and the sizes of caches and stores compared with their bounds"""
+        summary = self.memory_watchdog.summary(self.get_structure_sizes())
+        await ctx.send(f'```css\n{summary[-1900:]}```')
+
     async def print_traceback(self, ctx, n):
         error_log = self.client.last_errors
 
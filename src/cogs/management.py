@@ -7,29 +7,79 @@ Commands:
     reload          reload an extension / cog
     cogs            show currently active extensions / cogs
     error           print the traceback of the last unhandled error to chat
+    blocklist       show / add / remove users that are banned from running code
+    quota           show the users and servers with the highest resource usage
+    profile         sample the stacks of the bot process and upload them as a file
+    startup         show how long each phase of the startup took
+    sync            register the application commands with discord
 """
+import asyncio
 import json
+import time
 import typing
-import subprocess
 import re
+import gzip
+from dataclasses import dataclass
 from io import BytesIO
 from datetime import datetime, timezone
 from os import path, listdir
-from discord import File, errors as discord_errors
+from discord import File, Object, errors as discord_errors
 from discord.ext import commands
+from .utils.profiler import MAX_DURATION, SamplingProfiler
 
+GIT_TIMEOUT = 60  # Seconds after which a git command is killed
+REPORT_CHUNK_SIZE = 1000  # Number of guilds processed before yielding to the event loop
+MAX_MESSAGE_LENGTH = 2000
+
+
+def fit_lines(lines, max_chars):
+    """Join as many whole lines as fit into [max_chars] characters - a last line counts the
+    lines that were left out"""
+    kept = []
+    length = 0
+    for i, line in enumerate(lines):
+        # Leave room for the note about the omitted lines
+        note = f'... {len(lines) - i - 1} more' if i < len(lines) - 1 else ''
+        if length + len(line) + 1 + len(note) > max_chars:
+            kept.append(f'... {len(lines) - i} more')
+            break
+        kept.append(line)
+        length += len(line) + 1
+    return '\n'.join(kept)
+
+
+@dataclass
+class ShardStats:
+    guilds: int = 0
+    members: int = 0
+    joined: int = 0
+    left: int = 0
 
 class Management(commands.Cog, name='Management'):
     def __init__(self, client):
         self.client = client
         self.reload_config()
         self.cog_re = re.compile(r'\s*src\/cogs\/(.+)\.py\s*\|\s*\d+\s*[+-]+')
+        self.shard_stats = dict()  # shard_id -> ShardStats, maintained from guild events
+        self.profiler = SamplingProfiler()
+        if self.client.is_ready():
+            self.count_guilds()
 
     async def cog_check(self, ctx):
         return self.client.user_is_admin(ctx.author)
 
+    def count_guilds(self):
+        """Recount guilds and members per shard - join and leave counters are kept"""
+        for stats in self.shard_stats.values():
+            stats.guilds = stats.members = 0
+        for guild in self.client.guilds:
+            stats = self.shard_stats.setdefault(guild.shard_id, ShardStats())
+            stats.guilds += 1
+            stats.members += guild.member_count or 0
+
     @commands.Cog.listener()
     async def on_ready(self):
+        self.count_guilds()
         loaded = self.client.extensions
         unloaded = [x for x in self.crawl_cogs() if x not in loaded and 'extra.' not in x]
         activity = self.client.error_activity if unloaded else self.client.default_activity
@@ -41,6 +91,10 @@ class Management(commands.Cog, name='Management'):
             (datetime.now(tz=timezone.utc).isoformat()[:19], guild)
         )
         self.client.recent_guilds_joined = self.client.recent_guilds_joined[-10:]
+        stats = self.shard_stats.setdefault(guild.shard_id, ShardStats())
+        stats.guilds += 1
+        stats.members += guild.member_count or 0
+        stats.joined += 1
 
     @commands.Cog.listener()
     async def on_guild_remove(self, guild):
@@ -48,6 +102,10 @@ class Management(commands.Cog, name='Management'):
             (datetime.now(tz=timezone.utc).isoformat()[:19], guild)
         )
         self.client.recent_guilds_left = self.client.recent_guilds_left[-10:]
+        stats = self.shard_stats.setdefault(guild.shard_id, ShardStats())
+        stats.guilds -= 1
+        stats.members -= guild.member_count or 0
+        stats.left += 1
 
     def reload_config(self):
         with open("../state/config.json") as conffile:
@@ -138,18 +196,33 @@ class Management(commands.Cog, name='Management'):
                     break
         if not target_extensions:
             return
+        await self.reload_extensions(ctx, target_extensions)
+
+    async def reload_extensions(self, ctx, extensions):
+        """Reload extensions concurrently - this extension is always reloaded first"""
+        started = time.perf_counter()
         result = []
-        for ext in target_extensions:
-            try:
-                await self.client.reload_extension(ext)
-                result.append(f'Extension [{ext}] reloaded.')
-            except Exception as e:
-                await self.client.log_error(e, ctx)
-                result.append(f'#ERROR loading [{ext}]')
-                continue
+        if __name__ in extensions:
+            result.append(await self.reload_single_extension(ctx, __name__))
+        result += await asyncio.gather(*(
+            self.reload_single_extension(ctx, ext) for ext in extensions if ext != __name__
+        ))
+        result.append(f'Total: {(time.perf_counter() - started) * 1000:.0f} ms')
         result = '\n'.join(result)
         await ctx.send(f'```css\n{result}```')
 
+    async def reload_single_extension(self, ctx, ext):
+        started = time.perf_counter()
+        try:
+            await self.client.reload_extension(ext)
+        except Exception as e:
+            await self.client.log_error(e, ctx)
+            # discord.py restores the previously loaded module if the reload fails
+            if ext in self.client.extensions:
+                return f'#ERROR loading [{ext}] - previous version restored'
+            return f'#ERROR loading [{ext}] - extension unloaded'
+        return f'Extension [{ext}] reloaded. ({(time.perf_counter() - started) * 1000:.0f} ms)'
+
     # ----------------------------------------------
     # Function to get bot extensions
     # ----------------------------------------------
@@ -174,19 +247,158 @@ class Management(commands.Cog, name='Management'):
         hidden=True,
     )
     async def show_servers(self, ctx, include_txt: bool = False):
-        to_send = '\n'.join(str(guild) for guild in self.client.guilds)
         file = File(
-            fp=BytesIO(to_send.encode()),
-            filename=f'servers_{datetime.now(tz=timezone.utc).isoformat()}.txt'
+            fp=BytesIO(await self.build_server_report()),
+            filename=f'servers_{datetime.now(tz=timezone.utc).isoformat()}.txt.gz'
         ) if include_txt else None
         j = '\n'.join(f'{time} | {guild.name}' for time, guild in self.client.recent_guilds_joined)
         l = '\n'.join(f'{time} | {guild.name}' for time, guild in self.client.recent_guilds_left)
+        total = sum(stats.guilds for stats in self.shard_stats.values())
         await ctx.send(
-            f'**I am active in {len(self.client.guilds)} Servers ' +
+            f'**I am active in {total} Servers ' +
             f'| # of Shards: {len(self.client.shards)}** ' +
             f'```\nJoined recently:\n{j}```\n```\nLeft Recently:\n{l}```',
             file=file
         )
+        # The shard table is a message of its own - it grows with the number of shards
+        shards = fit_lines([
+            f'Shard {shard_id}: {stats.guilds} servers | {stats.members} members | '
+            f'+{stats.joined} -{stats.left}'
+            for shard_id, stats in sorted(self.shard_stats.items())
+        ], MAX_MESSAGE_LENGTH - 7)  # 7 = 2 * 3 Backticks + newline
+        if shards:
+            await ctx.send(f'```\n{shards}```')
+
+    async def build_server_report(self):
+        """Build the gzip compressed list of all servers without stalling the event loop"""
+        guilds = list(self.client.guilds)
+        chunks = []
+        for i in range(0, len(guilds), REPORT_CHUNK_SIZE):
+            chunks.append('\n'.join(
+                f'{guild.id} | {guild.member_count} | {guild}'
+                for guild in guilds[i:i + REPORT_CHUNK_SIZE]
+            ))
+            await asyncio.sleep(0)
+
+        def compress():
+            return gzip.compress('\n'.join(chunks).encode())
+
+        return await asyncio.to_thread(compress)
+
+    # ----------------------------------------------
+    # Commands to manage the blocklist
+    # ----------------------------------------------
+    @commands.group(
+        name='blocklist',
+        hidden=True,
+        invoke_without_command=True,
+        aliases=['bans'],
+    )
+    async def blocklist(self, ctx):
+        """Show all users that are banned from running code"""
+        user_ids = '\n'.join(str(user_id) for user_id in self.client.blocklist)
+        await ctx.send(f'```css\n[Blocked users: {len(self.client.blocklist)}]\n{user_ids}```')
+
+    @blocklist.command(
+        name='add',
+    )
+    async def blocklist_add(self, ctx, user_id: int):
+        """Ban a user from running code"""
+        self.client.blocklist.add(user_id)
+        await ctx.send(f'```css\nUser [{user_id}] blocked.```')
+
+    @blocklist.command(
+        name='remove',
+        aliases=['rm'],
+    )
+    async def blocklist_remove(self, ctx, user_id: int):
+        """Unban a user"""
+        self.client.blocklist.remove(user_id)
+        await ctx.send(f'```css\nUser [{user_id}] unblocked.```')
+
+    # ----------------------------------------------
+    # Command to show the resource usage of users and servers
+    # ----------------------------------------------
+    @commands.command(
+        name='quota',
+        hidden=True,
+    )
+    async def quota(self, ctx, n: int = 10):
+        """Show the top [n] resource consumers since the last restart"""
+        run_cog = self.client.get_cog('CodeExecution')
+        if run_cog is None:
+            await ctx.send('The run extension is not loaded')
+            return
+        response = []
+        for title, ledger in (('Users', run_cog.user_ledger), ('Servers', run_cog.guild_ledger)):
+            response.append(
+                f'[{title}] budget {ledger.capacity} ms, refill {ledger.refill_per_second} ms/s, '
+                f'{ledger.throttled} throttled requests'
+            )
+            response += [
+                f'  {key}: charged {int(charged)} | balance {int(balance)}'
+                for key, charged, balance in ledger.top(n)
+            ]
+        response = '\n'.join(response)
+        await ctx.send(f'```css\n{response[:1900]}```')
+
+    # ----------------------------------------------
+    # Command to register the application commands
+    # ----------------------------------------------
+    @commands.command(
+        name='sync',
+        hidden=True,
+    )
+    async def sync_application_commands(self, ctx, guild_id: int = None):
+        """Sync the application commands globally or only to the server [guild_id]"""
+        if guild_id is None:
+            synced = await self.client.tree.sync()
+        else:
+            guild = Object(id=guild_id)
+            self.client.tree.copy_global_to(guild=guild)
+            synced = await self.client.tree.sync(guild=guild)
+        await ctx.send(
+            f'```css\nSynced {len(synced)} application commands '
+            f'{"globally" if guild_id is None else f"to {guild_id}"}```'
+        )
+
+    # ----------------------------------------------
+    # Command to show the startup report
+    # ----------------------------------------------
+    @commands.command(
+        name='startup',
+        hidden=True,
+    )
+    async def show_startup(self, ctx):
+        """Show how long each phase of the startup took"""
+        await ctx.send(f'```css\n{str(self.client.startup_report)[-1900:]}```')
+
+    # ----------------------------------------------
+    # Command to profile the bot process
+    # ----------------------------------------------
+    @commands.command(
+        name='profile',
+        hidden=True,
+    )
+    async def profile(self, ctx, seconds: float = 10):
+        """Sample all stacks for [seconds] seconds and upload them in collapsed format"""
+        if not 0 < seconds <= MAX_DURATION:
+            raise commands.BadArgument(f'Please specify 0 < seconds <= {MAX_DURATION}')
+        if self.profiler.running:
+            await ctx.send('The profiler is already running')
+            return
+        await ctx.send(f'```css\nProfiling for {seconds} seconds...```')
+        collapsed = await self.profiler.profile(seconds)
+        file = File(
+            fp=BytesIO(collapsed.encode()),
+            filename=f'profile_{datetime.now(tz=timezone.utc).isoformat()}.collapsed.txt'
+        )
+        await ctx.send(
+            f'```css\n{self.profiler.samples} samples | '
+            f'{len(collapsed.splitlines())} distinct stacks | '
+            f'{self.profiler.dropped} samples dropped (memory limit)```',
+            file=file
+        )
 
     # ----------------------------------------------
     # Command to pull the latest changes from github
@@ -199,6 +411,44 @@ class Management(commands.Cog, name='Management'):
         """Commands to run git commands on the local repo"""
         pass
 
+    async def run_git(self, ctx, *args):
+        """Run a git command without blocking the event loop and stream its output
+        into a message. Returns the return code (None on timeout) and the output."""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        command = 'git ' + ' '.join(args)
+        process = await asyncio.create_subprocess_exec(
+            'git', *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT
+        )
+        msg = await ctx.send(f'```git\n$ {command}\n```')
+        output = ''
+        last_edit = loop.time()
+
+        async def read_output():
+            nonlocal output, last_edit
+            while line := await process.stdout.readline():
+                output += line.decode(errors='replace')
+                if loop.time() - last_edit > 1:
+                    last_edit = loop.time()
+                    await msg.edit(content=f'```git\n$ {command}\n{output[-1800:]}\n```')
+            return await process.wait()
+
+        try:
+            returncode = await asyncio.wait_for(read_output(), GIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            returncode = None
+            output += f'\n[killed after {GIT_TIMEOUT} seconds]'
+        duration = loop.time() - started
+        await msg.edit(
+            content=f'```git\n$ {command}\n{output[-1800:]}\n```'
+            f'`exit code {returncode} | {duration:.1f} s`'
+        )
+        return returncode, output
+
     @git.command(
         name='pull',
     )
@@ -209,20 +459,17 @@ class Management(commands.Cog, name='Management'):
         except discord_errors.Forbidden:
             pass
         try:
-            output = subprocess.check_output(
-                ['git', 'pull']).decode()
-            await ctx.send('```git\n' + output + '\n```')
+            returncode, output = await self.run_git(ctx, 'pull')
         except Exception as e:
             return await ctx.send(str(e))
 
-        if noreload is not None:
+        if noreload is not None or returncode != 0:
             return
 
         _cogs = [f'cogs.{i}' for i in self.cog_re.findall(output)]
         active_cogs = [i for i in _cogs if i in self.client.extensions]
         if active_cogs:
-            for cog_name in active_cogs:
-                await ctx.invoke(self.client.get_command('reload'), cog_name)
+            await self.reload_extensions(ctx, active_cogs)
 
     # ----------------------------------------------
     # Command to reset the repo to a previous commit
@@ -239,9 +486,7 @@ class Management(commands.Cog, name='Management'):
         except discord_errors.Forbidden:
             pass
         try:
-            output = subprocess.check_output(
-                ['git', 'reset', '--hard', f'HEAD~{n}']).decode()
-            await ctx.send('```git\n' + output + '\n```')
+            await self.run_git(ctx, 'reset', '--hard', f'HEAD~{n}')
         except Exception as e:
             await ctx.send(str(e))
 
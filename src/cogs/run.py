@@ -3,26 +3,130 @@ It will add the run command for everyone to use
 
 Commands:
     run            Run code using the Piston API
+    rerun          Run the last code again (optionally with new args / stdin)
 
 """
 # pylint: disable=E0402
-import json
+import asyncio
+import random
 import re, sys
-from dataclasses import dataclass
-from discord import Embed, Message, errors as discord_errors
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, replace as dc_replace
+from statistics import median
+from typing import Optional
+from io import BytesIO
+from discord import (
+    Embed, File, Guild, InteractionType, Message, User, errors as discord_errors
+)
+from discord.ui import Button, View
 from discord.ext import commands, tasks
 from discord.utils import escape_mentions
-from aiohttp import ContentTypeError
+from aiohttp import (
+    ClientConnectionError, ClientError, ClientTimeout, ContentTypeError, WSMsgType,
+    WSServerHandshakeError
+)
+from .utils.analytics import get_salt, latency_bin
 from .utils.codeswap import add_boilerplate
-from .utils.errors import PistonInvalidContentType, PistonInvalidStatus, PistonNoOutput
+from .utils.handoff import adopt_state, export_state
+from .utils.invocations import InvocationCache, ParsedRun
+from .utils.iostore import DurableIOStore
+from .utils.latency import MAX_TIMEOUT, LatencyTracker
+from .utils.outage import OutageQueue, QueuedRun
+from .utils.outputstore import OutputStore, paginate_output
+from .utils.quota import BudgetLedger, run_cost
+from .utils.runtimes import MAX_RESOLVED, RuntimeIndex
+from .utils.sampler import TrafficSampler
+from .utils.shadow import ShadowStats, outputs_match
+from .utils.suggest import MAX_CACHED
+from .utils.errors import (
+    PistonError, PistonInvalidContentType, PistonInvalidStatus, PistonNoOutput
+)
 #pylint: disable=E1101
 
 
+RUN_FLAGS = ('--live',)
+LIVE_EDIT_INTERVAL = 1.5  # Minimum seconds between two edits of a live output message
+LIVE_TIMEOUT = 60  # Maximum seconds a live run may take
+LIVE_BUFFER_LIMIT = 65535  # Output beyond this can never be displayed anyway
+MAX_CODEBLOCKS = 5  # Maximum number of codeblocks in one message
+MAX_CONCURRENT_CODEBLOCKS = 3  # Maximum number of codeblocks of one message executed at once
+MAX_HEDGE_RATIO = 0.1  # Maximum fraction of execute requests that may be hedged
+MAX_PENDING_SUGGESTIONS = 1000  # Users whose last language suggestions are remembered
+OUTAGE_PROBE_INTERVAL = 15  # Seconds between two health probes during an outage
+OUTAGE_PROBE_TIMEOUT = 10  # Seconds
+OUTAGE_REPLAY_BATCH = 20  # Maximum number of queued runs replayed per probe interval
+STATE_VERSION = 5  # Increase when the attributes in HANDOFF_ATTRIBUTES change shape
+# Caches and stores handed over to the new instance when the cog is reloaded
+HANDOFF_ATTRIBUTES = (
+    'run_IO_store', 'runtimes', 'howto_embed', 'output_store', 'user_ledger', 'guild_ledger',
+    'run_timings', 'latency', 'hedge_stats', 'suggestion_stats', 'pending_suggestions',
+    'invocations', 'piston_failures', 'outage_since', 'shadow_stats',
+)
+
+
 @dataclass
 class RunIO:
     input: Message
     output: Message
 
+@dataclass
+class QueuedContext:
+    """The parts of commands.Context execute() and format_output() use when a queued
+    run is replayed"""
+    author: User
+    guild: Optional[Guild]
+
+def clean_output(output):
+    # Prevent mentions in the code output
+    output = escape_mentions(output)
+
+    # Prevent code block escaping by adding zero width spaces to backticks
+    return output.replace("`", "`\u200b")
+
+def share_fairly(lengths, budget):
+    """Split a budget between items so that no item gets more than it needs
+    and the rest is split equally between the items that need more"""
+    shares = [0] * len(lengths)
+    remaining = sorted(range(len(lengths)), key=lengths.__getitem__)
+    while remaining:
+        share = max(0, budget) // len(remaining)
+        if lengths[remaining[0]] > share:
+            for i in remaining:
+                shares[i] = share
+            break
+        i = remaining.pop(0)
+        shares[i] = lengths[i]
+        budget -= lengths[i]
+    return shares
+
+def is_outage_error(error):
+    """Errors that mean piston is unavailable (as opposed to a bad request) - transport
+    failures, 5xx / 429 responses and timeouts. Piston kills slow programs itself (after
+    a few seconds), so a request that runs into the timeout of the bot means a hung
+    backend."""
+    if isinstance(error, PistonInvalidStatus):
+        return (error.status or 0) >= 500 or error.status == 429
+    return isinstance(
+        error, (PistonInvalidContentType, asyncio.TimeoutError, ClientConnectionError)
+    )
+
+def may_be_command(content):
+    """Cheap check to skip database lookups for messages that can not be commands"""
+    start = content[:64].lower()
+    return 'run' in start or 'del' in start
+
+def split_run_flags(content):
+    """Remove run flags (e.g. --live) from the first line of a command
+    Returns the cleaned content and the set of flags found (without leading dashes)"""
+    first_line, sep, rest = content.partition('\n')
+    words = first_line.split(' ')
+    flags = {word[2:] for word in words if word in RUN_FLAGS}
+    if not flags:
+        return content, flags
+    first_line = ' '.join(word for word in words if word not in RUN_FLAGS)
+    return first_line + sep + rest, flags
+
 def get_size(obj, seen=None):
     """Recursively finds size of objects"""
     size = sys.getsizeof(obj)
@@ -46,9 +150,25 @@ def get_size(obj, seen=None):
 class Run(commands.Cog, name='CodeExecution'):
     def __init__(self, client):
         self.client = client
-        self.run_IO_store = dict()  # Store the most recent /run message for each user.id
-        self.languages = dict()  # Store the supported languages and aliases
-        self.versions = dict() # Store version for each language
+        self.run_IO_store = OrderedDict()  # Store the most recent /run message for each user.id
+        # Least recently used entries are dropped from memory (they stay in io_db)
+        self.run_IO_store_size = self.client.config.get('run_io_cache_size', 10000)
+        self.io_db = DurableIOStore('../state/run_io.sqlite3')  # Persist run_IO_store
+        self.runtimes = RuntimeIndex([])  # Supported languages, aliases and versions
+        self.howto_embed = None  # Built once per runtime refresh
+        self.output_store = OutputStore(  # Store the full output of truncated runs
+            max_bytes=self.client.config.get('output_store_bytes', 16_000_000)
+        )
+        # Resource budgets in cpu milliseconds - refill rates are per second
+        quota = self.client.config.get('quota', {})
+        self.user_ledger = BudgetLedger(
+            quota.get('user_capacity', 60_000), quota.get('user_refill', 100),
+            quota.get('max_charged', 10000)
+        )
+        self.guild_ledger = BudgetLedger(
+            quota.get('guild_capacity', 600_000), quota.get('guild_refill', 1000),
+            quota.get('max_charged', 10000)
+        )
         self.run_regex_code = re.compile(
             r'(?s)/(?:edit_last_)?run'
             r'(?: +(?P<language>\S*?)\s*|\s*)'
@@ -57,27 +177,389 @@ class Run(commands.Cog, name='CodeExecution'):
             r'```(?:(?P<syntax>\S+)\n\s*|\s*)(?P<source>.*)```'
             r'(?:\n?(?P<stdin>(?:[^\n\r\f\v]\n?)+)+|)'
         )
+        self.run_regex_header = re.compile(
+            r'(?s)/(?:edit_last_)?run'
+            r'(?: +(?P<language>\S*?)\s*|\s*)'
+            r'(?:-> *(?P<output_syntax>\S*)\s*|\s*)'
+            r'(?:\n(?P<args>(?:[^\n\r\f\v]*\n)*?)\s*|\s*)\Z'
+        )
+        self.codeblock_regex = re.compile(r'(?s)(?:(?P<syntax>\S+)\n\s*|\s*)(?P<source>.*)')
+        self.stdin_regex = re.compile(r'(?:\n?(?P<stdin>(?:[^\n\r\f\v]\n?)+)+|)')
         self.run_regex_file = re.compile(
             r'/run(?: *(?P<language>\S*)\s*?|\s*?)?'
             r'(?: *-> *(?P<output>\S*)\s*?|\s*?)?'
             r'(?:\n(?P<args>(?:[^\n\r\f\v]+\n?)*)\s*|\s*)?'
             r'(?:\n*(?P<stdin>(?:[^\n\r\f\v]\n*)+)+|)?'
         )
+        self.background_tasks = set()  # Keep references to tasks that run off the reply path
+        self.run_timings = deque(maxlen=1000)  # (parse, execute) seconds of recent runs
+        self.latency = LatencyTracker()  # Learned execute latency per language
+        self.hedge_stats = dict(requests=0, hedged=0, primary_wins=0, hedge_wins=0)
+        self.suggestion_stats = dict(corrected=0, suggested=0, hits=0, unknown=0)
+        self.pending_suggestions = OrderedDict()  # user_id -> aliases suggested to the user
+        self.invocations = InvocationCache(  # Last parsed run of each user for rerun
+            max_bytes=self.client.config.get('rerun_cache_bytes', 8_000_000)
+        )
+        # Opt-in sampling of invocations for benchmark corpora
+        sampler = self.client.config.get('traffic_sampler', {})
+        self.sampler = sampler.get('enabled', False) and TrafficSampler(
+            '../state/traffic.jsonl',
+            salt=get_salt(self.client.config.get('analytics_salt', '')),
+            is_language=lambda name: name in self.runtimes,
+            rate=sampler.get('rate', 0.01),
+            redact_sources=sampler.get('redact', True),
+            max_bytes=sampler.get('max_bytes', 10_000_000),
+            backups=sampler.get('backups', 3),
+        )
+        # Runs are queued instead of executed after [threshold] consecutive piston failures
+        outage = self.client.config.get('outage', {})
+        self.outage_threshold = outage.get('threshold', 5)
+        self.outage_concurrency = outage.get('replay_concurrency', 3)
+        self.outage_queue = OutageQueue(
+            '../state/outage_queue.sqlite3', max_size=outage.get('queue_size', 500)
+        )
+        self.piston_failures = 0  # Consecutive failed execute requests
+        self.outage_since = None  # unix time the outage mode was entered
+        # Mirror a sampled fraction of execute requests to a shadow backend to compare it
+        shadow = self.client.config.get('shadow', {})
+        self.shadow_url = shadow.get('url')
+        self.shadow_key = shadow.get('key', '')
+        self.shadow_rate = shadow.get('rate', 0.01)
+        self.shadow_concurrency = shadow.get('concurrency', 2)
+        self.shadow_active = 0  # Mirrored requests in flight
+        self.shadow_stats = ShadowStats()
+        # Base urls of the piston backends - the first one is used for all requests,
+        # the second one for hedged requests
+        self.backends = self.client.config.get(
+            'piston_backends', ['https://emkc.org/api/v2/piston']
+        )
+        # Adopt the caches of the previous instance if the cog was reloaded
+        state = adopt_state(self.client, 'CodeExecution', STATE_VERSION)
+        self.runtimes_adopted = state is not None
+        if state is not None:
+            for attribute in HANDOFF_ATTRIBUTES:
+                setattr(self, attribute, state[attribute])
+            # The config may have changed since the stores were created
+            self.output_store.max_bytes = self.client.config.get(
+                'output_store_bytes', 16_000_000
+            )
+            self.invocations.max_bytes = self.client.config.get('rerun_cache_bytes', 8_000_000)
+            for ledger, kind in ((self.user_ledger, 'user'), (self.guild_ledger, 'guild')):
+                ledger.capacity = quota.get(f'{kind}_capacity', ledger.capacity)
+                ledger.refill_per_second = quota.get(f'{kind}_refill', ledger.refill_per_second)
         self.get_available_languages.start()
+        self.prune_ledgers.start()
+        self.flush_io_db.start()
+        self.compact_io_db.start()
+        self.watch_outage.start()
+
+    def cog_unload(self):
+        self.get_available_languages.cancel()
+        self.prune_ledgers.cancel()
+        self.flush_io_db.cancel()
+        self.compact_io_db.cancel()
+        self.watch_outage.cancel()
+        self.io_db.close()
+        self.outage_queue.close()
+        export_state(self.client, 'CodeExecution', STATE_VERSION, {
+            attribute: getattr(self, attribute) for attribute in HANDOFF_ATTRIBUTES
+        })
+        if self.sampler:
+            self.sampler.close()
 
-    @tasks.loop(count=1)
+    @tasks.loop(hours=1)
     async def get_available_languages(self):
+        if self.runtimes_adopted:
+            # Runtimes were handed over by the previous instance - refresh them next time
+            self.runtimes_adopted = False
+            return
+        started = time.perf_counter()
         async with self.client.session.get(
-            'https://emkc.org/api/v2/piston/runtimes'
+            f'{self.backends[0]}/runtimes'
         ) as response:
-            runtimes = await response.json()
-        for runtime in runtimes:
-            language = runtime['language']
-            self.languages[language] = language
-            self.versions[language] = runtime['version']
-            for alias in runtime['aliases']:
-                self.languages[alias] = language
-                self.versions[alias] = runtime['version']
+            runtimes = await response.json(loads=self.client.json.loads)
+        if runtimes != self.runtimes.raw:
+            # Swap in a complete new index - parsing never sees a half built one
+            self.runtimes = RuntimeIndex(runtimes)
+            self.howto_embed = None
+        if not self.client.startup_report.has('runtimes'):
+            self.client.startup_report.record('runtimes', started)
+
+    @tasks.loop(minutes=10)
+    async def prune_ledgers(self):
+        self.user_ledger.prune()
+        self.guild_ledger.prune()
+
+    @tasks.loop(seconds=5)
+    async def flush_io_db(self):
+        await self.io_db.flush()
+
+    @tasks.loop(hours=1)
+    async def compact_io_db(self):
+        await self.io_db.compact()
+
+    def get_structure_sizes(self):
+        """name -> (size, bound or None) of the long lived structures of the cog"""
+        structures = {
+            'run_IO_store': (len(self.run_IO_store), self.run_IO_store_size),
+            'io_db pending': (len(self.io_db.pending), None),
+            'io_db input ids': (len(self.io_db.input_ids or ()), None),
+            'output_store kb': (
+                self.output_store.stored_bytes // 1000, self.output_store.max_bytes // 1000
+            ),
+            'rerun cache': (len(self.invocations), self.invocations.max_entries),
+            'rerun cache kb': (
+                self.invocations.stored_bytes // 1000, self.invocations.max_bytes // 1000
+            ),
+            'outage queue': (len(self.outage_queue), self.outage_queue.max_size),
+            'user ledger': (len(self.user_ledger.buckets), None),
+            'user ledger charged': (
+                len(self.user_ledger.charged), 2 * self.user_ledger.max_charged
+            ),
+            'guild ledger': (len(self.guild_ledger.buckets), None),
+            'guild ledger charged': (
+                len(self.guild_ledger.charged), 2 * self.guild_ledger.max_charged
+            ),
+            'latency bins': (
+                sum(map(len, self.latency.histograms.values())),
+                len(self.latency.histograms) * (latency_bin(MAX_TIMEOUT * 1000) + 1)
+            ),
+            'run timings': (len(self.run_timings), self.run_timings.maxlen),
+            'pending suggestions': (len(self.pending_suggestions), MAX_PENDING_SUGGESTIONS),
+            'suggestion cache': (len(self.runtimes.suggestions.cache), MAX_CACHED),
+            'resolved versions': (len(self.runtimes.resolved), MAX_RESOLVED),
+            'background tasks': (len(self.background_tasks), None),
+        }
+        if self.sampler:
+            structures['sampler queue'] = (
+                self.sampler.queue.qsize(), self.sampler.queue.maxsize
+            )
+        return structures
+
+    def cache_run_io(self, user_id, run_io):
+        self.run_IO_store[user_id] = run_io
+        self.run_IO_store.move_to_end(user_id)
+        while len(self.run_IO_store) > self.run_IO_store_size:
+            self.run_IO_store.popitem(last=False)
+
+    @tasks.loop(seconds=OUTAGE_PROBE_INTERVAL)
+    async def watch_outage(self):
+        if self.outage_since is None and not self.outage_queue:
+            return
+        if not await self.probe_piston():
+            return
+        if self.outage_since is not None:
+            self.outage_since = None
+            self.piston_failures = 0
+        await self.replay_queued_runs()
+
+    @watch_outage.before_loop
+    async def before_watch_outage(self):
+        await self.outage_queue.load()
+        await self.client.wait_until_ready()
+
+    async def probe_piston(self):
+        """Execute a tiny program - /runtimes can answer while the execute path is down"""
+        if not self.runtimes.raw:
+            return False
+        runtime = self.runtimes.raw[0]
+        data = {
+            'language': runtime['language'],
+            'version': runtime['version'],
+            'files': [{'content': ''}],
+            'args': [],
+            'stdin': '',
+            'log': 0
+        }
+        try:
+            async with self.client.session.post(
+                f'{self.backends[0]}/execute',
+                headers={'Authorization': self.client.config["emkc_key"]},
+                json=data,
+                timeout=ClientTimeout(total=OUTAGE_PROBE_TIMEOUT)
+            ) as response:
+                await response.json(loads=self.client.json.loads)
+        except (asyncio.TimeoutError, ClientError, ValueError):
+            return False
+        # Any answer but 5xx / 429 means requests are executed again (as in is_outage_error)
+        return response.status < 500 and response.status != 429
+
+    def record_piston_result(self, error=None):
+        """Count consecutive failed execute requests and enter the outage mode when
+        there are too many"""
+        if error is None:
+            self.piston_failures = 0
+            return
+        if not is_outage_error(error):
+            return
+        self.piston_failures += 1
+        if self.piston_failures >= self.outage_threshold and self.outage_since is None:
+            self.outage_since = time.time()
+            self.run_in_background(self.client.log_error(
+                PistonError(f'Outage mode entered after {self.piston_failures} failures'),
+                'Outage mode'
+            ))
+
+    async def queue_run(self, ctx, ack=None):
+        """Queue a run while piston is unavailable - returns the acknowledgement message
+        that is edited with the output when the run is replayed"""
+        self.invocations.discard(ctx.author.id)
+        if ctx.message.content.count('```') > 2:
+            raise commands.BadArgument(
+                'The code execution service is currently unavailable and runs with '
+                'multiple codeblocks can not be queued - please try again later'
+            )
+        alias, output_syntax, source, args, stdin = await self.get_api_parameters(ctx)
+        language, version, data = self.build_request_data(alias, source, args, stdin)
+        parsed = ParsedRun(language, version, output_syntax, data)
+        self.invocations.put(ctx.author.id, parsed)
+        return await self.enqueue_run(ctx, parsed, ack)
+
+    async def enqueue_run(self, ctx, parsed, ack=None):
+        """Queue an already parsed run - see queue_run"""
+        language, version, output_syntax, data = (
+            parsed.language, parsed.version, parsed.output_syntax, parsed.data
+        )
+        if not self.outage_queue.has_room(ctx.author.id):
+            raise commands.BadArgument(
+                'The code execution service is currently unavailable and too many runs '
+                'are waiting for it - please try again later'
+            )
+        content = (
+            f'{ctx.author.mention} The code execution service is currently unavailable. '
+            f'Your {data["language"]}({version}) code is queued - '
+            'this message will show the output as soon as the service is back.'
+        )
+        if ack is None:
+            ack = await ctx.send(content)
+        else:
+            await ack.edit(content=content, embed=None, view=None)
+        replaced = await self.outage_queue.put(QueuedRun(
+            ctx.author.id, ctx.guild.id if ctx.guild else 0, ack.channel.id, ack.id,
+            language, version, output_syntax or '', self.client.json.dumps(data), time.time()
+        ))
+        if replaced is not None and replaced.ack_id != ack.id:
+            await self.edit_queued_ack(replaced, 'Replaced by your newer queued run.')
+        return ack
+
+    async def edit_queued_ack(self, run, content, view=None):
+        channel = (
+            self.client.get_channel(run.channel_id)
+            or self.client.get_partial_messageable(run.channel_id)
+        )
+        message = channel.get_partial_message(run.ack_id)
+        try:
+            await message.edit(content=content, embed=None, view=view)
+        except (discord_errors.NotFound, discord_errors.Forbidden):
+            return None
+        return message
+
+    async def replay_queued_runs(self):
+        """Execute the oldest queued runs with limited concurrency and edit the outputs
+        into their acknowledgement messages"""
+        semaphore = asyncio.Semaphore(self.outage_concurrency)
+
+        async def replay(run):
+            async with semaphore:
+                if self.outage_since is not None:
+                    return  # piston failed again - keep the run queued
+                await self.replay_queued_run(run)
+
+        runs = await self.outage_queue.oldest(OUTAGE_REPLAY_BATCH)
+        await asyncio.gather(*(replay(run) for run in runs))
+
+    async def replay_queued_run(self, run):
+        data = self.client.json.loads(run.data)
+        mention = f'<@{run.user_id}>'
+        try:
+            author = self.client.get_user(run.user_id) or await self.client.fetch_user(
+                run.user_id
+            )
+            ctx = QueuedContext(author, self.client.get_guild(run.guild_id))
+            r = await self.execute(ctx, run.language, data)
+        except discord_errors.NotFound:
+            await self.outage_queue.remove(run)
+            return
+        except Exception as error:
+            if is_outage_error(error):
+                return  # Stays queued
+            await self.outage_queue.remove(run)
+            await self.edit_queued_ack(
+                run, f'{mention} API Error - Please try again later'
+            )
+            await self.client.log_error(error, 'Outage queue replay')
+            return
+        await self.outage_queue.remove(run)
+        comp_stderr = r['compile']['stderr'] if 'compile' in r else ''
+        run_output, full_output = self.format_output(
+            ctx, f'{data["language"]}({run.version})', run.output_syntax, comp_stderr,
+            r['run']
+        )
+        message = await self.edit_queued_ack(
+            run, run_output, view=self.output_pager_for(full_output)
+        )
+        if message is not None:
+            self.store_full_output(message, run.user_id, full_output)
+
+    def remember_run(self, user_id, run_io):
+        self.cache_run_io(user_id, run_io)
+        self.io_db.put(user_id, run_io.input.channel.id, run_io.input.id, run_io.output.id)
+
+    def forget_run(self, user_id):
+        self.run_IO_store.pop(user_id, None)
+        self.io_db.delete(user_id)
+
+    async def get_run_io(self, user_id):
+        """Get the most recent RunIO of a user - load it from the database if it is not in
+        memory (e.g. after a restart)"""
+        run_io = self.run_IO_store.get(user_id)
+        if run_io is not None:
+            return run_io
+        row = await self.io_db.get(user_id)
+        if row is None:
+            return None
+        channel_id, input_id, output_id = row
+        channel = (
+            self.client.get_channel(channel_id)
+            or self.client.get_partial_messageable(channel_id)
+        )
+        run_io = RunIO(
+            input=channel.get_partial_message(input_id),
+            output=channel.get_partial_message(output_id)
+        )
+        self.cache_run_io(user_id, run_io)
+        return run_io
+
+    def charge_run(self, ctx, cost):
+        self.user_ledger.charge(ctx.author.id, cost)
+        if ctx.guild:
+            self.guild_ledger.charge(ctx.guild.id, cost)
+
+    def get_throttle_time(self, ctx):
+        """Seconds until the author (or the guild) is allowed to run code again"""
+        retry_after = self.user_ledger.retry_after(ctx.author.id)
+        if ctx.guild:
+            retry_after = max(retry_after, self.guild_ledger.retry_after(ctx.guild.id))
+        return retry_after
+
+    def run_in_background(self, coro):
+        """Schedule work that the reply does not depend on (e.g. logging)"""
+        task = asyncio.create_task(self.guard_background_task(coro))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def guard_background_task(self, coro):
+        try:
+            await coro
+        except Exception as e:
+            await self.client.log_error(e, 'Run background task')
+
+    async def trigger_typing(self, ctx):
+        try:
+            await ctx.typing()
+        except discord_errors.Forbidden:
+            pass
 
     async def send_to_log(self, ctx, language, source):
         logging_data = {
@@ -93,7 +575,7 @@ class Run(commands.Cog, name='CodeExecution'):
         async with self.client.session.post(
             'https://emkc.org/api/internal/piston/log',
             headers=headers,
-            data=json.dumps(logging_data)
+            data=self.client.json.dumps(logging_data)
         ) as response:
             if response.status != 200:
                 await self.client.log_error(
@@ -104,6 +586,37 @@ class Run(commands.Cog, name='CodeExecution'):
 
         return True
 
+    def check_language(self, ctx, name, kind='language'):
+        """Return the supported alias[@version] for name - unambiguous typos are corrected,
+        otherwise the closest aliases are suggested in the error"""
+        if name in self.runtimes:
+            suggested = self.pending_suggestions.pop(ctx.author.id, None)
+            if suggested is not None and name.partition('@')[0] in suggested:
+                self.suggestion_stats['hits'] += 1
+            return name
+        alias, at, spec = (name or '').partition('@')
+        correction, suggestions = self.runtimes.suggestions.lookup(alias)
+        if correction is not None:
+            self.suggestion_stats['corrected'] += 1
+            return correction + at + spec
+        if suggestions:
+            self.suggestion_stats['suggested'] += 1
+            # Remember the suggestions to count how often the next run uses one of them
+            self.pending_suggestions[ctx.author.id] = suggestions
+            self.pending_suggestions.move_to_end(ctx.author.id)
+            while len(self.pending_suggestions) > MAX_PENDING_SUGGESTIONS:
+                self.pending_suggestions.popitem(last=False)
+        else:
+            self.suggestion_stats['unknown'] += 1
+        raise commands.BadArgument(
+            f'Unsupported {kind}: **{str(name)[:1000]}**\n'
+            + (
+                f'Did you mean {" / ".join(f"`{alias}`" for alias in suggestions)}?\n'
+                if suggestions else ''
+            )
+            + '[Request a new language](https://github.com/engineer-man/piston/issues)'
+        )
+
     async def get_api_parameters_with_codeblock(self, ctx):
         if ctx.message.content.count('```') != 2:
             raise commands.BadArgument('Invalid command format (missing codeblock?)')
@@ -114,20 +627,47 @@ class Run(commands.Cog, name='CodeExecution'):
             raise commands.BadArgument('Invalid command format')
 
         language, output_syntax, args, syntax, source, stdin = match.groups()
+        defaults = self.client.resolve_settings(ctx.message).settings
 
         if not language:
-            language = syntax
+            language = syntax or defaults.language or None
 
         if language:
             language = language.lower()
 
-        if language not in self.languages:
-            raise commands.BadArgument(
-                f'Unsupported language: **{str(language)[:1000]}**\n'
-                '[Request a new language](https://github.com/engineer-man/piston/issues)'
-            )
+        language = self.check_language(ctx, language)
 
-        return language, output_syntax, source, args, stdin
+        return language, output_syntax or defaults.output_syntax, source, args, stdin
+
+    async def get_api_parameters_with_codeblocks(self, ctx):
+        """Parse a message with multiple codeblocks - each codeblock uses its own syntax as
+        language, args and stdin are shared between all codeblocks"""
+        parts = ctx.message.content.split('```')
+        if len(parts) % 2 == 0:
+            raise commands.BadArgument('Invalid command format (unclosed codeblock?)')
+        codeblocks = parts[1:-1:2]
+        if len(codeblocks) > MAX_CODEBLOCKS:
+            raise commands.BadArgument(f'Too many codeblocks (maximum is {MAX_CODEBLOCKS})')
+        if any(part.strip() for part in parts[2:-1:2]):
+            raise commands.BadArgument('Invalid command format (text between codeblocks)')
+
+        match = self.run_regex_header.search(parts[0])
+
+        if not match:
+            raise commands.BadArgument('Invalid command format')
+
+        language, output_syntax, args = match.groups()
+        stdin = self.stdin_regex.match(parts[-1]).group('stdin')
+        defaults = self.client.resolve_settings(ctx.message).settings
+        output_syntax = output_syntax or defaults.output_syntax
+
+        parameters = []
+        for codeblock in codeblocks:
+            syntax, source = self.codeblock_regex.match(codeblock).groups()
+            alias = self.check_language(ctx, (syntax or language or defaults.language).lower())
+            parameters.append((alias, output_syntax, source, args, stdin))
+
+        return parameters
 
     async def get_api_parameters_with_file(self, ctx):
         if len(ctx.message.attachments) != 1:
@@ -144,26 +684,34 @@ class Run(commands.Cog, name='CodeExecution'):
         if len(filename_split) < 2:
             raise commands.BadArgument('Please provide a source file with a file extension')
 
+        # Download the attachment while the command is parsed
+        download = asyncio.create_task(file.read())
+
         match = self.run_regex_file.search(ctx.message.content)
 
         if not match:
+            download.cancel()
             raise commands.BadArgument('Invalid command format')
 
         language, output_syntax, args, stdin = match.groups()
+        defaults = self.client.resolve_settings(ctx.message).settings
+        output_syntax = output_syntax or defaults.output_syntax
 
         if not language:
-            language = filename_split[-1]
+            language = self.runtimes.extensions.get(filename_split[-1].lower())
 
         if language:
             language = language.lower()
 
-        if language not in self.languages:
-            raise commands.BadArgument(
-                f'Unsupported file extension: **{language}**\n'
-                '[Request a new language](https://github.com/engineer-man/piston/issues)'
+        try:
+            language = self.check_language(
+                ctx, language or filename_split[-1].lower(), 'file extension'
             )
+        except commands.BadArgument:
+            download.cancel()
+            raise
 
-        source = await file.read()
+        source = await download
         try:
             source = source.decode('utf-8')
         except UnicodeDecodeError as e:
@@ -171,17 +719,21 @@ class Run(commands.Cog, name='CodeExecution'):
 
         return language, output_syntax, source, args, stdin
 
-    async def get_run_output(self, ctx):
+    async def get_api_parameters(self, ctx):
         # Get parameters to call api depending on how the command was called (file <> codeblock)
         if ctx.message.attachments:
-            alias, output_syntax, source, args, stdin = await self.get_api_parameters_with_file(ctx)
-        else:
-            alias, output_syntax, source, args, stdin = await self.get_api_parameters_with_codeblock(ctx)
+            return await self.get_api_parameters_with_file(ctx)
+        return await self.get_api_parameters_with_codeblock(ctx)
 
-        # Resolve aliases for language
-        language = self.languages[alias]
+    def build_request_data(self, name, source, args, stdin):
+        # Resolve alias[@version] to language and version
+        alias, language, version = self.runtimes.resolve(name)
 
-        version = self.versions[alias]
+        if version is None:
+            raise commands.BadArgument(
+                f'No {alias} version matches **{name.partition("@")[2][:100]}**\n'
+                f'Available versions: {", ".join(self.runtimes.versions[alias])}'
+            )
 
         # Add boilerplate code to supported languages
         source = add_boilerplate(language, source)
@@ -193,7 +745,6 @@ class Run(commands.Cog, name='CodeExecution'):
         if not source:
             raise commands.BadArgument(f'No source code found')
 
-        # Call piston API
         data = {
             'language': alias,
             'version': version,
@@ -202,42 +753,391 @@ class Run(commands.Cog, name='CodeExecution'):
             'stdin': stdin or "",
             'log': 0
         }
+        return language, version, data
+
+    async def post_execute(self, backend, language, data, timeout):
+        started = time.perf_counter()
         headers = {'Authorization': self.client.config["emkc_key"]}
-        async with self.client.session.post(
-            'https://emkc.org/api/v2/piston/execute',
-            headers=headers,
-            json=data
-        ) as response:
-            try:
-                r = await response.json()
-            except ContentTypeError:
-                raise PistonInvalidContentType('invalid content type')
+        try:
+            async with self.client.session.post(
+                f'{backend}/execute',
+                headers=headers,
+                json=data,
+                timeout=ClientTimeout(total=timeout)
+            ) as response:
+                try:
+                    r = await response.json(loads=self.client.json.loads)
+                except ContentTypeError:
+                    raise PistonInvalidContentType('invalid content type')
+        except asyncio.TimeoutError:
+            # Runs that time out would otherwise be missing from the latency statistics
+            self.latency.observe(language, timeout)
+            raise
         if not response.status == 200:
-            raise PistonInvalidStatus(f'status {response.status}: {r.get("message", "")}')
+            raise PistonInvalidStatus(
+                f'status {response.status}: {r.get("message", "")}', response.status
+            )
+        self.latency.observe(language, time.perf_counter() - started)
+        return r
 
-        comp_stderr = r['compile']['stderr'] if 'compile' in r else ''
-        run = r['run']
+    async def request_execute(self, language, data):
+        """Send an execute request with a deadline learned from the latency of the language.
+        If the request takes longer than the learned p95 latency of the language a second
+        request is sent to the next backend - the first successful response wins."""
+        deadline = self.latency.deadline(language)
+        hedge_delay = self.latency.quantile(language, 95)
+        stats = self.hedge_stats
+        stats['requests'] += 1
+        primary = asyncio.create_task(
+            self.post_execute(self.backends[0], language, data, deadline)
+        )
+        if (
+            len(self.backends) < 2
+            or hedge_delay is None
+            or stats['hedged'] >= stats['requests'] * MAX_HEDGE_RATIO
+        ):
+            return await primary
+
+        done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        stats['hedged'] += 1
+        hedge = asyncio.create_task(
+            self.post_execute(self.backends[1], language, data, deadline)
+        )
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        stats['primary_wins' if task is primary else 'hedge_wins'] += 1
+                        return task.result()
+            # Both requests failed
+            hedge.exception()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def execute(self, ctx, language, data, parse_time=0):
+        """Call the piston API and return its result"""
+        started = time.perf_counter()
+        try:
+            r = await self.request_execute(language, data)
+        except Exception as error:
+            self.record_piston_result(error)
+            raise
+        self.record_piston_result()
+
+        self.charge_run(ctx, run_cost(r))
 
-        if run['output'] is None:
+        if r['run']['output'] is None:
             raise PistonNoOutput('no output')
 
+        timings = (parse_time, time.perf_counter() - started)
+        self.run_timings.append(timings)
+        self.client.dispatch(
+            'code_executed', ctx, language, data['version'], data['files'][0]['content'],
+            r['run']['output'], timings
+        )
+
+        # Logging
+        self.run_in_background(self.send_to_log(ctx, language, data['files'][0]['content']))
+
+        return r
+
+    async def get_run_output(self, ctx):
+        # The cached run is replaced by this one - multiple codeblocks can not be rerun
+        # and runs that fail to parse must not leave the previous run to be rerun
+        self.invocations.discard(ctx.author.id)
+        if not ctx.message.attachments and ctx.message.content.count('```') > 2:
+            return await self.get_multi_run_output(ctx)
+
+        started = time.perf_counter()
+        alias, output_syntax, source, args, stdin = await self.get_api_parameters(ctx)
+        language, version, data = self.build_request_data(alias, source, args, stdin)
+        self.invocations.put(ctx.author.id, ParsedRun(language, version, output_syntax, data))
+        parsed = time.perf_counter()
+
+        r = await self.execute(ctx, language, data, parsed - started)
+        self.mirror_execute(language, data, r, time.perf_counter() - parsed)
+
+        comp_stderr = r['compile']['stderr'] if 'compile' in r else ''
+        return self.format_output(
+            ctx, f'{data["language"]}({version})', output_syntax, comp_stderr, r['run']
+        )
+
+    def mirror_execute(self, language, data, primary, primary_latency):
+        """Send a sampled fraction of execute requests to the shadow backend as well -
+        fire and forget, the reply never waits for it"""
+        if not self.shadow_url or random.random() >= self.shadow_rate:
+            return
+        if self.shadow_active >= self.shadow_concurrency:
+            self.shadow_stats.skipped += 1
+            return
+        # Counted before the task starts, so a burst can not schedule more than the limit
+        self.shadow_active += 1
+        self.run_in_background(self.shadow_execute(language, data, primary, primary_latency))
+
+    async def shadow_execute(self, language, data, primary, primary_latency):
+        """Compare the shadow backend with the primary response - shadow_active was
+        incremented by mirror_execute"""
+        started = time.perf_counter()
+        try:
+            async with self.client.session.post(
+                f'{self.shadow_url}/execute',
+                headers={'Authorization': self.shadow_key} if self.shadow_key else None,
+                json=data,
+                timeout=ClientTimeout(total=MAX_TIMEOUT)
+            ) as response:
+                shadow = await response.json(loads=self.client.json.loads)
+            latency = time.perf_counter() - started
+            if response.status != 200:
+                raise ValueError(f'status {response.status}')
+            match = outputs_match(primary, shadow)
+        except (asyncio.TimeoutError, ClientError, ValueError, KeyError, TypeError):
+            self.shadow_stats.record_error(language)
+            return
+        finally:
+            self.shadow_active -= 1
+        self.shadow_stats.record(language, latency - primary_latency, match)
+
+    async def get_multi_run_output(self, ctx):
+        """Run every codeblock of the message concurrently and merge the outputs
+        into one message"""
+        started = time.perf_counter()
+        blocks = await self.get_api_parameters_with_codeblocks(ctx)
+        parse_time = time.perf_counter() - started
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_CODEBLOCKS)
+
+        async def execute_block(alias, source, args, stdin):
+            language, version, data = self.build_request_data(alias, source, args, stdin)
+            async with semaphore:
+                return f'{data["language"]}({version})', await self.execute(
+                    ctx, language, data, parse_time
+                )
+
+        results = await asyncio.gather(
+            *(execute_block(alias, source, args, stdin)
+              for alias, _, source, args, stdin in blocks),
+            return_exceptions=True
+        )
+
+        output_syntax = blocks[0][1] or ''
+        max_lines = max(1, 30 // len(blocks))
+        headers = []
+        outputs = []
+        for (alias, *_), result in zip(blocks, results):
+            if isinstance(result, commands.BadArgument):
+                headers.append(f'**{alias}** {result}')
+                outputs.append('')
+            elif isinstance(result, (PistonError, asyncio.TimeoutError)):
+                headers.append(f'**{alias}** API Error - Please try again later')
+                outputs.append('')
+            elif isinstance(result, Exception):
+                raise result
+            else:
+                language_info, r = result
+                comp_stderr = r['compile']['stderr'] if 'compile' in r else ''
+                run = r['run']
+                if len(comp_stderr) > 0:
+                    headers.append(f'**{language_info}** compile errors')
+                elif len(run['stdout']) == 0 and len(run['stderr']) > 0:
+                    headers.append(f'**{language_info}** error output only')
+                elif len(run['output']) == 0:
+                    headers.append(f'**{language_info}** ran without output')
+                else:
+                    headers.append(f'**{language_info}**')
+                outputs.append(comp_stderr + run['output'])
+
+        introduction = f'Here are your outputs {ctx.author.mention}\n'
+        len_codeblock = 7  # 3 Backticks + newline + 3 Backticks
+        cleaned = [
+            clean_output('\n'.join(output.split('\n')[:max_lines])).replace('\0', '')
+            for output in outputs
+        ]
+        # Sections are separated by newlines
+        overhead = len(introduction) + len(headers) - 1 + sum(
+            len(header) + (1 + len_codeblock + len(output_syntax) if output else 0)
+            for header, output in zip(headers, cleaned)
+        )
+        shares = share_fairly([len(output) for output in cleaned], 2000 - overhead)
+
+        truncate_indicator = '[...]'
+        truncated = False
+        sections = []
+        for header, output, original, share in zip(headers, cleaned, outputs, shares):
+            if len(original.split('\n')) > max_lines:
+                truncated = True
+            if len(output) > share:
+                truncated = True
+                if share > len(truncate_indicator):
+                    output = output[:share - len(truncate_indicator)] + truncate_indicator
+                else:
+                    output = output[:share]  # Too short for the indicator
+            if output:
+                sections.append(f'{header}\n```{output_syntax}\n{output}```')
+            else:
+                sections.append(header)
+
+        full_output = None
+        if truncated:
+            full_output = (
+                introduction,
+                output_syntax,
+                '\n'.join(
+                    f'=== {header} ===\n{output}' for header, output in zip(headers, outputs)
+                )[:self.output_store.max_output_chars]
+            )
+        return introduction + '\n'.join(sections), full_output
+
+    async def get_live_run_output(self, ctx):
+        """Run code over the piston websocket and edit the output into one message while
+        the program is still running. Returns the output message and the full output."""
+        self.invocations.discard(ctx.author.id)
+        if ctx.message.content.count('```') > 2:
+            raise commands.BadArgument('Live output only supports a single codeblock')
+        alias, output_syntax, source, args, stdin = await self.get_api_parameters(ctx)
+        language, version, data = self.build_request_data(alias, source, args, stdin)
+        self.invocations.put(ctx.author.id, ParsedRun(language, version, output_syntax, data))
+        language_info = f'{data["language"]}({version})'
+
+        msg = await ctx.send(f'Running your {language_info} code {ctx.author.mention} ...')
+        # Register the placeholder right away so it is cleaned up like any other output
+        # if the source message is edited or deleted - even if the run fails
+        self.remember_run(ctx.author.id, RunIO(input=ctx.message, output=msg))
+        try:
+            comp_stderr, run, duration = await self.stream_live_run(
+                ctx, msg, language_info, output_syntax, data
+            )
+        except discord_errors.NotFound:
+            # The placeholder was deleted while the code was running
+            return msg, None
+        except Exception as error:
+            await self.show_live_error(ctx, msg, error)
+            return msg, None
+
+        # The websocket does not report resource usage - charge the wall time instead
+        self.charge_run(ctx, run_cost({'run': {'wall_time': duration * 1000}}))
+        self.client.dispatch(
+            'code_executed', ctx, language, version, data['files'][0]['content'],
+            run['output'], (0, duration)
+        )
+
+        run_output, full_output = self.format_output(
+            ctx, language_info, output_syntax, comp_stderr, run
+        )
+        await msg.edit(content=run_output, view=self.output_pager_for(full_output))
+
         # Logging
-        await self.send_to_log(ctx, language, source)
+        self.run_in_background(self.send_to_log(ctx, language, data['files'][0]['content']))
+
+        return msg, full_output
+
+    async def show_live_error(self, ctx, msg, error):
+        """Edit the placeholder of a failed live run into the error message"""
+        usr = ctx.author.mention
+        if isinstance(error, (PistonError, ClientError)):
+            error_message = f'`{error}` ' if str(error) else ''
+            content = f'{usr} API Error {error_message}- Please try again later'
+        elif isinstance(error, asyncio.TimeoutError):
+            content = f'{usr} API Timeout - Please try again later'
+        else:
+            content = f'{usr} {self.client.error_string}'
+        try:
+            await msg.edit(content=content, view=None)
+        except discord_errors.NotFound:
+            pass
+        await self.client.log_error(error, ctx)
+
+    async def stream_live_run(self, ctx, msg, language_info, output_syntax, data):
+        """Stream the output of a run into msg - returns the compile errors, the run
+        result and the duration of the run in seconds"""
+        comp_stderr = ''
+        run = {'stdout': '', 'stderr': '', 'output': ''}
+        stage = 'run'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + LIVE_TIMEOUT
+        last_edit = loop.time()
+        dirty = False
+
+        headers = {'Authorization': self.client.config["emkc_key"]}
+        try:
+            ws = await self.client.session.ws_connect(
+                self.client.config.get('piston_ws_url', 'wss://emkc.org/api/v2/piston/connect'),
+                headers=headers
+            )
+        except WSServerHandshakeError as e:
+            raise PistonInvalidStatus(f'status {e.status}: websocket handshake failed', e.status)
+
+        started = loop.time()
+        async with ws:
+            # Interactive jobs ignore the stdin of init - it is written to the program as a
+            # data message once the run stage started
+            await ws.send_json(
+                {'type': 'init', **data, 'stdin': ''}, dumps=self.client.json.dumps
+            )
+            while True:
+                if loop.time() > deadline:
+                    raise asyncio.TimeoutError()
+                try:
+                    ws_msg = await ws.receive(timeout=LIVE_EDIT_INTERVAL)
+                except asyncio.TimeoutError:
+                    ws_msg = None
 
-        language_info=f'{alias}({version})'
+                if ws_msg is not None:
+                    if ws_msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED):
+                        break
+                    if ws_msg.type != WSMsgType.TEXT:
+                        raise PistonInvalidContentType('invalid websocket message')
+                    event = self.client.json.loads(ws_msg.data)
+                    if event['type'] == 'error':
+                        raise PistonInvalidStatus(event.get('message', ''))
+                    if event['type'] == 'stage':
+                        stage = event['stage']
+                        if stage == 'run' and data['stdin']:
+                            await ws.send_json(
+                                {'type': 'data', 'stream': 'stdin', 'data': data['stdin']},
+                                dumps=self.client.json.dumps
+                            )
+                    elif event['type'] == 'exit' and event.get('stage', stage) == 'run':
+                        break
+                    elif (
+                        event['type'] == 'data'
+                        and len(comp_stderr) + len(run['output']) < LIVE_BUFFER_LIMIT
+                    ):
+                        if stage == 'compile':
+                            if event['stream'] == 'stderr':
+                                comp_stderr += event['data']
+                        else:
+                            run[event['stream']] += event['data']
+                            run['output'] += event['data']
+                        dirty = True
 
+                # Edit at a bounded rate to stay clear of discord's rate limits
+                if dirty and loop.time() - last_edit >= LIVE_EDIT_INTERVAL:
+                    run_output, _ = self.format_output(
+                        ctx, language_info, output_syntax, comp_stderr, run
+                    )
+                    await msg.edit(content=run_output)
+                    last_edit = loop.time()
+                    dirty = False
+
+        return comp_stderr, run, loop.time() - started
+
+    def format_output(self, ctx, language_info, output_syntax, comp_stderr, run):
+        """Returns the message content and - if the output had to be truncated -
+        the (introduction, output syntax, full output) needed to page through it"""
         # Return early if no output was received
         if len(run['output'] + comp_stderr) == 0:
-            return f'Your {language_info} code ran without output {ctx.author.mention}'
+            return f'Your {language_info} code ran without output {ctx.author.mention}', None
 
         # Limit output to 30 lines maximum
-        output = '\n'.join((comp_stderr + run['output']).split('\n')[:30])
-
-        # Prevent mentions in the code output
-        output = escape_mentions(output)
-
-        # Prevent code block escaping by adding zero width spaces to backticks
-        output = output.replace("`", "`\u200b")
+        lines = (comp_stderr + run['output']).split('\n')
+        truncated = len(lines) > 30
+        output = clean_output('\n'.join(lines[:30]))
 
         # Truncate output to be below 2000 char discord limit.
         if len(comp_stderr) > 0:
@@ -248,26 +1148,68 @@ class Run(commands.Cog, name='CodeExecution'):
             introduction = f'Here is your {language_info} output {ctx.author.mention}\n'
         truncate_indicator = '[...]'
         len_codeblock = 7  # 3 Backticks + newline + 3 Backticks
-        available_chars = 2000-len(introduction)-len_codeblock
+        available_chars = 2000-len(introduction)-len(output_syntax or '')-len_codeblock
         if len(output) > available_chars:
+            truncated = True
             output = output[:available_chars-len(truncate_indicator)] + truncate_indicator
 
+        full_output = None
+        if truncated:
+            full_output = (
+                introduction,
+                output_syntax or '',
+                (comp_stderr + run['output'])[:self.output_store.max_output_chars]
+            )
+
         # Use an empty string if no output language is selected
         return (
             introduction
             + f'```{output_syntax or ""}\n'
             + output.replace('\0', '')
             + '```'
-        )
+        ), full_output
+
+    def paginate(self, introduction, output_syntax, output):
+        len_codeblock = 7  # 3 Backticks + newline + 3 Backticks
+        max_chars = 2000 - len(introduction) - len(output_syntax) - len_codeblock
+        return paginate_output(clean_output(output).replace('\0', ''), max_chars)
+
+    def output_pager(self, page, num_pages):
+        view = View(timeout=None)
+        view.add_item(Button(label='◀', custom_id='run_output:prev', disabled=page <= 0))
+        view.add_item(Button(
+            label=f'{page + 1}/{num_pages}', custom_id='run_output:page', disabled=True
+        ))
+        view.add_item(Button(
+            label='▶', custom_id='run_output:next', disabled=page >= num_pages - 1
+        ))
+        view.add_item(Button(label='Full output', custom_id='run_output:file'))
+        # Button presses are handled in on_interaction so the view does not have to be
+        # kept alive by discord.py for every output message
+        view.stop()
+        return view
+
+    def output_pager_for(self, full_output):
+        if full_output is None:
+            return None
+        return self.output_pager(0, len(self.paginate(*full_output)))
+
+    def store_full_output(self, msg, author_id, full_output):
+        if full_output is None:
+            self.output_store.discard(msg.id)
+        else:
+            self.output_store.put(msg.id, author_id, *full_output)
 
     async def delete_last_output(self, user_id):
-        try:
-            msg_to_delete = self.run_IO_store[user_id].output
-            del self.run_IO_store[user_id]
-            await msg_to_delete.delete()
-        except KeyError:
+        run_io = await self.get_run_io(user_id)
+        if run_io is None:
             # Message does not exist in store dicts
             return
+        msg_to_delete = run_io.output
+        self.forget_run(user_id)
+        self.output_store.discard(msg_to_delete.id)
+        try:
+            await msg_to_delete.delete()
         except discord_errors.NotFound:
             # Message no longer exists in discord (deleted by server admin)
             return
@@ -285,31 +1227,48 @@ class Run(commands.Cog, name='CodeExecution'):
         if self.client.maintenance_mode:
             await ctx.send('Sorry - I am currently undergoing maintenance.')
             return
-        banned_users = [
-            #473160828502409217, # em
-            501851143203454986
-        ]
-        if ctx.author.id in banned_users:
+        if ctx.author.id in self.client.blocklist:
             await ctx.send('You have been banned from using I Run Code.')
             return
-        try:
-            await ctx.typing()
-        except discord_errors.Forbidden:
-            pass
+        retry_after = self.get_throttle_time(ctx)
+        if retry_after:
+            await ctx.send(
+                f'Sorry {ctx.author.mention}, you have used a lot of resources recently. '
+                f'Please try again in {int(retry_after) + 1} seconds.'
+            )
+            return
+        ctx.message.content, flags = split_run_flags(ctx.message.content)
+        if source:
+            source, _ = split_run_flags(source)
         if not source and not ctx.message.attachments:
             await self.send_howto(ctx)
             return
+        if self.sampler:
+            self.sampler.offer('live' if 'live' in flags else 'run', ctx)
+        # Show the typing indicator while the code is parsed and executed
+        typing = asyncio.create_task(self.trigger_typing(ctx))
         try:
-            run_output = await self.get_run_output(ctx)
-            msg = await ctx.send(run_output)
+            if self.outage_since is not None:
+                typing.cancel()
+                msg, full_output = await self.queue_run(ctx), None
+            elif 'live' in flags:
+                msg, full_output = await self.get_live_run_output(ctx)
+            else:
+                run_output, full_output = await self.get_run_output(ctx)
+                typing.cancel()
+                msg = await ctx.send(run_output, view=self.output_pager_for(full_output))
+            self.store_full_output(msg, ctx.author.id, full_output)
         except commands.BadArgument as error:
+            typing.cancel()
             embed = Embed(
                 title='Error',
                 description=str(error),
                 color=0x2ECC71
             )
             msg = await ctx.send(ctx.author.mention, embed=embed)
-        self.run_IO_store[ctx.author.id] = RunIO(input=ctx.message, output=msg)
+        finally:
+            typing.cancel()
+        self.remember_run(ctx.author.id, RunIO(input=ctx.message, output=msg))
 
     @commands.command(hidden=True)
     async def edit_last_run(self, ctx, *, content=None):
@@ -318,18 +1277,31 @@ class Run(commands.Cog, name='CodeExecution'):
             return
         if (not content) or ctx.message.attachments:
             return
-        try:
-            msg_to_edit = self.run_IO_store[ctx.author.id].output
-            run_output = await self.get_run_output(ctx)
-            await msg_to_edit.edit(content=run_output, embed=None)
-        except KeyError:
+        if ctx.author.id in self.client.blocklist or self.get_throttle_time(ctx):
+            return
+        # Edits are always answered with a regular (non live) run
+        ctx.message.content, _ = split_run_flags(ctx.message.content)
+        if self.sampler:
+            self.sampler.offer('edit', ctx)
+        run_io = await self.get_run_io(ctx.author.id)
+        if run_io is None:
             # Message no longer exists in output store
             # (can only happen if smartass user calls this command directly instead of editing)
             return
+        msg_to_edit = run_io.output
+        try:
+            if self.outage_since is not None:
+                await self.queue_run(ctx, ack=msg_to_edit)
+                self.output_store.discard(msg_to_edit.id)
+                return
+            run_output, full_output = await self.get_run_output(ctx)
+            await msg_to_edit.edit(
+                content=run_output, embed=None, view=self.output_pager_for(full_output)
+            )
+            self.store_full_output(msg_to_edit, ctx.author.id, full_output)
         except discord_errors.NotFound:
             # Message no longer exists in discord
-            if ctx.author.id in self.run_IO_store:
-                del self.run_IO_store[ctx.author.id]
+            self.forget_run(ctx.author.id)
             return
         except commands.BadArgument as error:
             # Edited message probably has bad formatting -> replace previous message with error
@@ -339,11 +1311,69 @@ class Run(commands.Cog, name='CodeExecution'):
                 color=0x2ECC71
             )
             try:
-                await msg_to_edit.edit(content=ctx.author.mention, embed=embed)
+                await msg_to_edit.edit(content=ctx.author.mention, embed=embed, view=None)
+                self.output_store.discard(msg_to_edit.id)
             except discord_errors.NotFound:
                 # Message no longer exists in discord
-                del self.run_IO_store[ctx.author.id]
+                self.forget_run(ctx.author.id)
+            return
+
+    @commands.group(invoke_without_command=True)
+    async def rerun(self, ctx):
+        """Run your last code again
+        "./rerun args" / "./rerun stdin" run it with new arguments / standard input"""
+        await self.rerun_last(ctx)
+
+    @rerun.command(name='args')
+    async def rerun_args(self, ctx, *, args=''):
+        """Run your last code again with new command line arguments (1 per line)"""
+        await self.rerun_last(ctx, args=[arg for arg in args.strip().split('\n') if arg])
+
+    @rerun.command(name='stdin')
+    async def rerun_stdin(self, ctx, *, stdin=''):
+        """Run your last code again with new standard input"""
+        await self.rerun_last(ctx, stdin=stdin)
+
+    async def rerun_last(self, ctx, **changes):
+        """Execute the last parsed run of the author again - nothing is downloaded or
+        parsed, [changes] replace the args and / or stdin of the request"""
+        if self.client.maintenance_mode:
+            await ctx.send('Sorry - I am currently undergoing maintenance.')
+            return
+        if ctx.author.id in self.client.blocklist:
+            await ctx.send('You have been banned from using I Run Code.')
+            return
+        retry_after = self.get_throttle_time(ctx)
+        if retry_after:
+            await ctx.send(
+                f'Sorry {ctx.author.mention}, you have used a lot of resources recently. '
+                f'Please try again in {int(retry_after) + 1} seconds.'
+            )
+            return
+        parsed = self.invocations.get(ctx.author.id)
+        if parsed is None:
+            raise commands.BadArgument('Nothing to rerun - please run some code first')
+        if changes:
+            # Following reruns keep the new args / stdin
+            parsed = dc_replace(parsed, data={**parsed.data, **changes})
+            self.invocations.put(ctx.author.id, parsed)
+        if self.outage_since is not None:
+            msg = await self.enqueue_run(ctx, parsed)
+            self.remember_run(ctx.author.id, RunIO(input=ctx.message, output=msg))
             return
+        typing = asyncio.create_task(self.trigger_typing(ctx))
+        try:
+            r = await self.execute(ctx, parsed.language, parsed.data)
+        finally:
+            typing.cancel()
+        comp_stderr = r['compile']['stderr'] if 'compile' in r else ''
+        run_output, full_output = self.format_output(
+            ctx, f'{parsed.data["language"]}({parsed.version})', parsed.output_syntax,
+            comp_stderr, r['run']
+        )
+        msg = await ctx.send(run_output, view=self.output_pager_for(full_output))
+        self.store_full_output(msg, ctx.author.id, full_output)
+        self.remember_run(ctx.author.id, RunIO(input=ctx.message, output=msg))
 
     @commands.command(hidden=True)
     async def size(self, ctx):
@@ -351,7 +1381,49 @@ class Run(commands.Cog, name='CodeExecution'):
             return False
         await ctx.send(
             f'```\nIO Cache {len(self.run_IO_store)} / {get_size(self.run_IO_store) // 1000} kb'
-            f'\nMessage Cache {len(self.client.cached_messages)} / {get_size(self.client.cached_messages) // 1000} kb\n```')
+            f'\nMessage Cache {len(self.client.cached_messages)} / {get_size(self.client.cached_messages) // 1000} kb'
+            f'\n{self.output_store.stats()}'
+            f'\n{self.timing_stats()}'
+            f'\n{self.latency_stats()}'
+            f'\n{self.suggestion_stats_text()}'
+            + (f'\n{self.sampler.summary()}' if self.sampler else '')
+            + '\n```')
+
+    def latency_stats(self):
+        stats = self.hedge_stats
+        lines = [
+            f'Execute requests {stats["requests"]} | hedged {stats["hedged"]} '
+            f'({stats["hedged"] / max(1, stats["requests"]):.1%}) | won by primary '
+            f'{stats["primary_wins"]} / hedge {stats["hedge_wins"]}'
+        ]
+        totals = self.latency.totals
+        for language in sorted(totals, key=totals.get, reverse=True)[:10]:
+            p95 = self.latency.quantile(language, 95)
+            p99 = self.latency.quantile(language, 99)
+            lines.append(
+                f'{language}: {totals[language]} samples | '
+                f'p95 {f"{p95 * 1000:.0f} ms" if p95 else "-"} | '
+                f'p99 {f"{p99 * 1000:.0f} ms" if p99 else "-"} | '
+                f'deadline {self.latency.deadline(language):.1f} s'
+            )
+        return '\n'.join(lines)
+
+    def suggestion_stats_text(self):
+        stats = self.suggestion_stats
+        hit_rate = stats['hits'] / stats['suggested'] * 100 if stats['suggested'] else 0
+        return (
+            f'Language suggestions: corrected {stats["corrected"]} | suggested '
+            f'{stats["suggested"]} (used next: {hit_rate:.0f}%) | unknown {stats["unknown"]}'
+        )
+
+    def timing_stats(self):
+        if not self.run_timings:
+            return 'Run timings: no runs yet'
+        parse, execute = zip(*self.run_timings)
+        return (
+            f'Run timings ({len(self.run_timings)} runs): median parse '
+            f'{median(parse) * 1000:.2f} ms | median execute {median(execute) * 1000:.0f} ms'
+        )
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -359,21 +1431,57 @@ class Run(commands.Cog, name='CodeExecution'):
             return
         if after.author.bot:
             return
-        if before.author.id not in self.run_IO_store:
+        run_io = self.run_IO_store.get(before.author.id)
+        if run_io is None and may_be_command(after.content):
+            run_io = await self.get_run_io(before.author.id)
+        if run_io is None or before.id != run_io.input.id:
             return
-        if before.id != self.run_IO_store[before.author.id].input.id:
-            return
-        prefixes = await self.client.get_prefix(after)
-        if isinstance(prefixes, str):
-            prefixes = [prefixes, ]
-        if any(after.content in (f'{prefix}delete', f'{prefix}del') for prefix in prefixes):
+        resolved = self.client.resolve_settings(after)
+        if resolved.delete_regex.fullmatch(after.content):
             await self.delete_last_output(after.author.id)
             return
-        for prefix in prefixes:
-            if after.content.lower().startswith(f'{prefix}run'):
-                after.content = after.content.replace(f'{prefix}run', f'/edit_last_run', 1)
-                await self.client.process_commands(after)
-                break
+        match = resolved.run_regex.match(after.content)
+        if match:
+            after.content = '/edit_last_run' + after.content[match.end():]
+            await self.client.process_commands(after)
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction):
+        if interaction.type != InteractionType.component:
+            return
+        action = interaction.data.get('custom_id', '')
+        if not action.startswith('run_output:'):
+            return
+        stored = self.output_store.get(interaction.message.id)
+        if stored is None:
+            await interaction.response.send_message(
+                'This output is no longer available - please run your code again.',
+                ephemeral=True
+            )
+            return
+        if action == 'run_output:file':
+            await interaction.response.send_message(
+                file=File(fp=BytesIO(stored.output.encode()), filename='output.txt'),
+                ephemeral=True
+            )
+            return
+        if interaction.user.id != stored.author_id:
+            await interaction.response.send_message(
+                'Only the author of the code can change pages.', ephemeral=True
+            )
+            return
+        pages = self.paginate(stored.introduction, stored.output_syntax, stored.output)
+        step = 1 if action == 'run_output:next' else -1
+        stored.page = max(0, min(stored.page + step, len(pages) - 1))
+        await interaction.response.edit_message(
+            content=(
+                stored.introduction
+                + f'```{stored.output_syntax}\n'
+                + pages[stored.page]
+                + '```'
+            ),
+            view=self.output_pager(stored.page, len(pages))
+        )
 
     @commands.Cog.listener()
     async def on_message_delete(self, message):
@@ -381,21 +1489,56 @@ class Run(commands.Cog, name='CodeExecution'):
             return
         if message.author.bot:
             return
-        if message.author.id not in self.run_IO_store:
-            return
-        if message.id != self.run_IO_store[message.author.id].input.id:
+        run_io = self.run_IO_store.get(message.author.id)
+        if run_io is None and may_be_command(message.content):
+            run_io = await self.get_run_io(message.author.id)
+        if run_io is None or message.id != run_io.input.id:
             return
         await self.delete_last_output(message.author.id)
 
-    async def send_howto(self, ctx):
-        languages = sorted(set(self.languages.values()))
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload):
+        # Edited messages that are not in the message cache (e.g. sent before a restart)
+        # are not passed to on_message_edit
+        if self.client.maintenance_mode or payload.cached_message is not None:
+            return
+        if not self.io_db.may_contain_input(payload.message_id):
+            return
+        if not may_be_command(payload.data.get('content', '')):
+            return
+        user_id = await self.io_db.get_user_by_input(payload.message_id)
+        channel = self.client.get_channel(payload.channel_id)
+        if user_id is None or channel is None:
+            return
+        try:
+            message = await channel.fetch_message(payload.message_id)
+        except (discord_errors.NotFound, discord_errors.Forbidden):
+            return
+        await self.on_message_edit(message, message)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload):
+        # Deleted messages that are not in the message cache are not passed to
+        # on_message_delete (the message cache is small in lean cache mode)
+        if self.client.maintenance_mode or payload.cached_message is not None:
+            return
+        if not self.io_db.may_contain_input(payload.message_id):
+            return
+        user_id = await self.io_db.get_user_by_input(payload.message_id)
+        if user_id is None:
+            return
+        run_io = await self.get_run_io(user_id)
+        if run_io is None or payload.message_id != run_io.input.id:
+            return
+        await self.delete_last_output(user_id)
 
+    def build_howto_embed(self):
         run_instructions = (
             '**Update: Discord changed their client to prevent sending messages**\n'
             '**that are preceeded by a slash (/)**\n'
             '**To run code you can use `"./run"` or `" /run"` until further notice**\n\n'
             '**Here are my supported languages:**\n'
-            + ', '.join(languages) +
+            + ', '.join(self.runtimes.language_names) +
             '\n\n**You can run code like this:**\n'
             './run <language>\ncommand line parameters (optional) - 1 per line\n'
             '\\`\\`\\`\nyour code\n\\`\\`\\`\nstandard input (optional)\n'
@@ -404,12 +1547,16 @@ class Run(commands.Cog, name='CodeExecution'):
             '• https://discord.gg/engineerman for more info\n'
         )
 
-        e = Embed(title='I can execute code right here in Discord! (click here for instructions)',
-                  description=run_instructions,
-                  url='https://github.com/engineer-man/piston-bot',
-                  color=0x2ECC71)
+        return Embed(title='I can execute code right here in Discord! '
+                           '(click here for instructions)',
+                     description=run_instructions,
+                     url='https://github.com/engineer-man/piston-bot',
+                     color=0x2ECC71)
 
-        await ctx.send(embed=e)
+    async def send_howto(self, ctx):
+        if self.howto_embed is None:
+            self.howto_embed = self.build_howto_embed()
+        await ctx.send(embed=self.howto_embed)
 
     @commands.command(name='help')
     async def send_help(self, ctx):
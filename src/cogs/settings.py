@@ -0,0 +1,80 @@
+"""This is a cog for a discord.py bot.
+It will add commands to change the settings of a server
+
+Commands:
+    settings            show the settings of this server
+      - prefix          set an additional command prefix
+      - language        set the language used for codeblocks without a language
+      - syntax          set the default output syntax highlighting
+
+"""
+from discord.ext import commands
+
+
+class Settings(commands.Cog, name='Settings'):
+    def __init__(self, client):
+        self.client = client
+
+    async def cog_check(self, ctx):
+        if ctx.guild is None:
+            raise commands.NoPrivateMessage()
+        return True
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.client.guild_settings.invalidate(guild.id)
+
+    @commands.group(
+        name='settings',
+        invoke_without_command=True,
+    )
+    async def settings(self, ctx):
+        """Show the settings of this server"""
+        settings = self.client.guild_settings.get(ctx.guild.id)
+        await ctx.send(
+            '```css\n'
+            f'[Prefix] {settings.prefix or "-"}\n'
+            f'[Default language] {settings.language or "-"}\n'
+            f'[Default output syntax] {settings.output_syntax or "-"}\n'
+            '```'
+        )
+
+    @settings.command(
+        name='prefix',
+    )
+    @commands.has_guild_permissions(manage_guild=True)
+    async def settings_prefix(self, ctx, prefix: str = ''):
+        """Set an additional command prefix (no prefix to reset)"""
+        if len(prefix) > 10 or '`' in prefix:
+            raise commands.BadArgument('Invalid prefix (maximum length is 10 characters)')
+        self.client.guild_settings.update(ctx.guild.id, prefix=prefix)
+        await ctx.send(f'```css\nPrefix set to [{prefix or "-"}]```')
+
+    @settings.command(
+        name='language',
+        aliases=['lang'],
+    )
+    @commands.has_guild_permissions(manage_guild=True)
+    async def settings_language(self, ctx, language: str = ''):
+        """Set the language for codeblocks without a language (no language to reset)"""
+        language = language.lower()
+        run_cog = self.client.get_cog('CodeExecution')
+        if language and run_cog is not None and language not in run_cog.runtimes:
+            raise commands.BadArgument(f'Unsupported language: **{language[:100]}**')
+        self.client.guild_settings.update(ctx.guild.id, language=language)
+        await ctx.send(f'```css\nDefault language set to [{language or "-"}]```')
+
+    @settings.command(
+        name='syntax',
+    )
+    @commands.has_guild_permissions(manage_guild=True)
+    async def settings_syntax(self, ctx, output_syntax: str = ''):
+        """Set the default output syntax highlighting (no syntax to reset)"""
+        if len(output_syntax) > 20 or '`' in output_syntax:
+            raise commands.BadArgument('Invalid output syntax')
+        self.client.guild_settings.update(ctx.guild.id, output_syntax=output_syntax)
+        await ctx.send(f'```css\nDefault output syntax set to [{output_syntax or "-"}]```')
+
+
+async def setup(client):
+    await client.add_cog(Settings(client))
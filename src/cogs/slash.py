@@ -0,0 +1,180 @@
+"""This is a cog for a discord.py bot.
+It will add application commands to run code without the message content intent
+
+Application commands:
+    /run            open a form for the code and run it
+    Run code        (message context menu) run the code of an existing message
+
+"""
+# pylint: disable=E0402
+import asyncio
+from dataclasses import dataclass, field
+from typing import Optional
+from discord import Embed, Guild, Interaction, Message, TextStyle, app_commands
+from discord.ext import commands
+from discord.ui import Modal, TextInput
+from .run import split_run_flags
+from .utils.errors import PistonError
+
+
+@dataclass
+class InteractionMessage:
+    """Stand-in for ctx.message when code is run through an interaction"""
+    content: str
+    guild: Optional[Guild]
+    attachments: list = field(default_factory=list)
+
+
+class InteractionContext:
+    """The parts of commands.Context the run pipeline uses - replies are sent as
+    followups of the deferred interaction response"""
+    def __init__(self, interaction, message):
+        self.interaction = interaction
+        self.message = message
+        self.author = interaction.user
+        self.guild = interaction.guild
+        self.channel = interaction.channel
+
+    async def send(self, content=None, **kwargs):
+        if kwargs.get('view') is None:
+            kwargs.pop('view', None)  # Webhook messages do not accept view=None
+        return await self.interaction.followup.send(content, wait=True, **kwargs)
+
+    async def typing(self):
+        # The deferred response already shows "I Run Code is thinking..."
+        pass
+
+
+class RunModal(Modal, title='Run code'):
+    language = TextInput(label='Language', required=False, max_length=50)
+    code = TextInput(label='Code', style=TextStyle.paragraph, max_length=4000)
+    args = TextInput(
+        label='Command line arguments (1 per line)', style=TextStyle.paragraph,
+        required=False, max_length=1000
+    )
+    stdin = TextInput(
+        label='Standard input', style=TextStyle.paragraph, required=False, max_length=1000
+    )
+
+    def __init__(self, cog, language=None):
+        super().__init__()
+        self.cog = cog
+        self.language.default = language
+
+    async def on_submit(self, interaction):
+        if '```' in self.code.value:
+            await interaction.response.send_message(
+                'Please enter the code without a codeblock.', ephemeral=True
+            )
+            return
+        language = self.language.value.strip()
+        args = ''.join(f'{arg}\n' for arg in self.args.value.splitlines() if arg.strip())
+        content = (
+            '/run' + (f' {language}' if language else '') + '\n'
+            + args
+            + f'```\n{self.code.value}\n```\n'
+            + self.stdin.value
+        )
+        await self.cog.run_interaction(
+            interaction, InteractionMessage(content, interaction.guild)
+        )
+
+
+class ApplicationCommands(commands.Cog, name='ApplicationCommands'):
+    def __init__(self, client):
+        self.client = client
+        # Context menus can not be defined in a cog with a decorator
+        self.run_code_menu = app_commands.ContextMenu(
+            name='Run code', callback=self.run_code_context_menu
+        )
+        self.client.tree.add_command(self.run_code_menu)
+
+    def cog_unload(self):
+        self.client.tree.remove_command(
+            self.run_code_menu.name, type=self.run_code_menu.type
+        )
+
+    async def run_interaction(self, interaction, message):
+        """Run the code of [message] and answer with a followup of the deferred response"""
+        run_cog = self.client.get_cog('CodeExecution')
+        if self.client.maintenance_mode or run_cog is None:
+            await interaction.response.send_message(
+                'Sorry - I am currently undergoing maintenance.', ephemeral=True
+            )
+            return
+        if interaction.user.id in self.client.blocklist:
+            await interaction.response.send_message(
+                'You have been banned from using I Run Code.', ephemeral=True
+            )
+            return
+        ctx = InteractionContext(interaction, message)
+        retry_after = run_cog.get_throttle_time(ctx)
+        if retry_after:
+            await interaction.response.send_message(
+                'Sorry, you have used a lot of resources recently. '
+                f'Please try again in {int(retry_after) + 1} seconds.',
+                ephemeral=True
+            )
+            return
+        # Piston can take longer than the 3 seconds an interaction has to be answered
+        await interaction.response.defer(thinking=True)
+        usr = ctx.author.mention
+        try:
+            if run_cog.outage_since is not None:
+                await run_cog.queue_run(ctx)
+                return
+            run_output, full_output = await run_cog.get_run_output(ctx)
+        except commands.BadArgument as error:
+            embed = Embed(title='Error', description=str(error), color=0x2ECC71)
+            await ctx.send(usr, embed=embed)
+            return
+        except PistonError as error:
+            error_message = f'`{error}` ' if str(error) else ''
+            await ctx.send(f'{usr} API Error {error_message}- Please try again later')
+            await self.client.log_error(error, 'Application command run')
+            return
+        except asyncio.TimeoutError as error:
+            await ctx.send(f'{usr} API Timeout - Please try again later')
+            await self.client.log_error(error, 'Application command run')
+            return
+        except Exception as error:
+            await ctx.send(f'{usr} {self.client.error_string}')
+            await self.client.log_error(error, 'Application command run')
+            return
+        msg = await ctx.send(run_output, view=run_cog.output_pager_for(full_output))
+        run_cog.store_full_output(msg, ctx.author.id, full_output)
+
+    @app_commands.command(name='run')
+    @app_commands.describe(language='The language of the code (e.g. python or python@3.10)')
+    async def run(self, interaction: Interaction, language: Optional[str] = None):
+        """Run code"""
+        await interaction.response.send_modal(RunModal(self, language))
+
+    @run.autocomplete('language')
+    async def run_language_autocomplete(self, interaction: Interaction, current: str):
+        run_cog = self.client.get_cog('CodeExecution')
+        if run_cog is None:
+            return []
+        current = current.lower()
+        return [
+            app_commands.Choice(name=language, value=language)
+            for language in run_cog.runtimes.language_names
+            if language.startswith(current)
+        ][:25]
+
+    async def run_code_context_menu(self, interaction: Interaction, message: Message):
+        """Run the code of an existing message with the same parser as the run command"""
+        resolved = self.client.resolve_settings(message)
+        match = resolved.run_regex.match(message.content)
+        if match:
+            content = '/run' + message.content[match.end():]
+        else:
+            content = '/run\n' + message.content
+        content, _ = split_run_flags(content)  # --live is not supported here
+        await self.run_interaction(
+            interaction, InteractionMessage(content, message.guild, message.attachments)
+        )
+
+
+async def setup(client):
+    await client.add_cog(ApplicationCommands(client))
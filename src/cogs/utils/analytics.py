@@ -0,0 +1,184 @@
+"""SQLite store for execution analytics
+
+Every execution is appended to a raw table and aggregated into hourly rollups
+at the same time. Rollups keep a log scaled latency histogram per hour, language
+and guild so top-N and percentile queries never have to scan raw rows.
+The database is opened on first use and all database access happens in a worker
+thread - except close(), which writes the remaining rows when the cog is unloaded.
+User ids are stored as salted hashes - without a configured salt a random salt is
+generated once and kept in the state directory.
+"""
+import asyncio
+import math
+import secrets
+import sqlite3
+import threading
+import time
+from os import path, replace
+
+BUCKET_SECONDS = 3600
+BINS_PER_OCTAVE = 4  # Resolution of the latency histogram (~19% per bin)
+
+
+def get_salt(configured, filename='../state/analytics_salt'):
+    """The configured salt or the random salt kept in [filename] (generated on first use)"""
+    if configured:
+        return configured.encode()[:64]
+    if path.exists(filename):
+        with open(filename, 'rb') as saltfile:
+            salt = saltfile.read().strip()
+        if salt:
+            return salt[:64]
+    salt = secrets.token_hex(32).encode()
+    with open(filename + '.tmp', 'wb') as saltfile:
+        saltfile.write(salt)
+    replace(filename + '.tmp', filename)
+    return salt
+
+
+def latency_bin(ms):
+    return int(math.log2(max(ms, 1)) * BINS_PER_OCTAVE)
+
+
+def bin_value(latency_bin):
+    """Representative latency (ms) of a histogram bin"""
+    return 2 ** ((latency_bin + 0.5) / BINS_PER_OCTAVE)
+
+
+def percentile(histogram, q):
+    """Approximate q-th percentile (0-100) of a {bin: count} histogram"""
+    total = sum(histogram.values())
+    threshold = total * q / 100
+    seen = 0
+    for latency_bin in sorted(histogram):
+        seen += histogram[latency_bin]
+        if seen >= threshold:
+            return bin_value(latency_bin)
+    return 0
+
+
+class AnalyticsStore:
+    def __init__(self, filename, retention=30 * 24 * 3600, max_pending=10000):
+        self.retention = retention
+        self.max_pending = max_pending
+        self.pending = []
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.filename = filename
+        self.db = None  # Opened by connection()
+
+    def connection(self):
+        """The database connection - opened on first use. Call it with the lock held."""
+        if self.db is None:
+            self.db = sqlite3.connect(self.filename, check_same_thread=False)
+            with self.db:
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS executions ('
+                    'time REAL, language TEXT, version TEXT, guild_id INTEGER, user_hash TEXT, '
+                    'source_hash TEXT, source_size INTEGER, output_size INTEGER, '
+                    'parse_ms REAL, execute_ms REAL)'
+                )
+                self.db.execute('CREATE INDEX IF NOT EXISTS executions_time ON executions (time)')
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS rollups ('
+                    'bucket INTEGER, language TEXT, guild_id INTEGER, bin INTEGER, '
+                    'count INTEGER, total_ms REAL, '
+                    'PRIMARY KEY (bucket, language, guild_id, bin)) WITHOUT ROWID'
+                )
+                self.db.execute(
+                    'CREATE INDEX IF NOT EXISTS rollups_guild ON rollups (guild_id, bucket)'
+                )
+        return self.db
+
+    def add(self, row):
+        """row: (time, language, version, guild_id, user_hash, source_hash,
+        source_size, output_size, parse_ms, execute_ms)"""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(row)
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, []
+        await asyncio.to_thread(self.write, rows)
+
+    def write(self, rows):
+        rollups = dict()
+        for row in rows:
+            execute_ms = row[9]
+            key = (int(row[0] // BUCKET_SECONDS) * BUCKET_SECONDS, row[1], row[3],
+                   latency_bin(execute_ms))
+            count, total_ms = rollups.get(key, (0, 0))
+            rollups[key] = (count + 1, total_ms + execute_ms)
+        with self.lock, self.connection() as db:
+            db.executemany(
+                'INSERT INTO executions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows
+            )
+            db.executemany(
+                'INSERT INTO rollups VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (bucket, language, guild_id, bin) DO UPDATE SET '
+                'count = count + excluded.count, total_ms = total_ms + excluded.total_ms',
+                [(*key, count, total_ms) for key, (count, total_ms) in rollups.items()]
+            )
+
+    async def expire(self):
+        """Delete raw rows that are older than the retention time (rollups are kept)"""
+        def delete_expired():
+            with self.lock, self.connection() as db:
+                db.execute(
+                    'DELETE FROM executions WHERE time < ?', (time.time() - self.retention,)
+                )
+        await asyncio.to_thread(delete_expired)
+
+    def select(self, sql, parameters):
+        with self.lock:
+            return self.connection().execute(sql, parameters).fetchall()
+
+    def filter_clause(self, days, guild_id):
+        since = int((time.time() - days * 86400) // BUCKET_SECONDS) * BUCKET_SECONDS
+        if guild_id is None:
+            return 'bucket >= ?', (since,)
+        return 'guild_id = ? AND bucket >= ?', (guild_id, since)
+
+    async def top_languages(self, n, days, guild_id=None):
+        """[(language, executions, average ms)] of the n most used languages"""
+        where, parameters = self.filter_clause(days, guild_id)
+        return await asyncio.to_thread(
+            self.select,
+            f'SELECT language, SUM(count), SUM(total_ms) / SUM(count) FROM rollups '
+            f'WHERE {where} GROUP BY language ORDER BY 2 DESC LIMIT ?',
+            (*parameters, n)
+        )
+
+    async def latency_percentiles(self, days, guild_id=None):
+        """{language: (executions, p50 ms, p95 ms, p99 ms)}"""
+        where, parameters = self.filter_clause(days, guild_id)
+        rows = await asyncio.to_thread(
+            self.select,
+            f'SELECT language, bin, SUM(count) FROM rollups '
+            f'WHERE {where} GROUP BY language, bin',
+            parameters
+        )
+        histograms = dict()
+        for language, latency_bin, count in rows:
+            histograms.setdefault(language, dict())[latency_bin] = count
+        return {
+            language: (
+                sum(histogram.values()),
+                percentile(histogram, 50),
+                percentile(histogram, 95),
+                percentile(histogram, 99),
+            )
+            for language, histogram in histograms.items()
+        }
+
+    def close(self):
+        rows, self.pending = self.pending, []
+        if rows:
+            self.write(rows)
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
@@ -0,0 +1,29 @@
+"""Intents and cache settings of the client (full or lean cache mode)
+
+Kept out of bot.py so benchmarks/guild_cache.py can measure both modes without
+starting the bot.
+"""
+from discord import Intents, MemberCacheFlags
+
+
+def get_cache_options(config):
+    """Intents and cache settings of the client
+
+    In lean cache mode only the guild (channels, roles and the bot's own member - needed
+    for permissions) and message events are received. Members are neither cached nor
+    chunked and the message cache is smaller."""
+    if not config.get('lean_cache', False):
+        intents = Intents.default()
+        intents.message_content = True
+        return dict(intents=intents, max_messages=config.get('max_messages', 15000))
+    intents = Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    return dict(
+        intents=intents,
+        member_cache_flags=MemberCacheFlags.none(),
+        chunk_guilds_at_startup=False,
+        max_messages=config.get('max_messages', 2000),
+    )
@@ -8,7 +8,9 @@ class PistonNoOutput(PistonError):
 
 class PistonInvalidStatus(PistonError):
     """Exception raised when the API request returns a non 200 status"""
-    pass
+    def __init__(self, message='', status=None):
+        super().__init__(message)
+        self.status = status
 
 class PistonInvalidContentType(PistonError):
     """Exception raised when the API request returns a non JSON content type"""
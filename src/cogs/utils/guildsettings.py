@@ -0,0 +1,91 @@
+"""Per guild settings (additional prefix, default language and default output syntax)
+
+Settings are persisted to a json file. Resolved settings including the prefixes and
+precompiled command matchers are cached per guild, so resolving the prefix of a
+message is a single dict lookup. The cache entry of a guild is invalidated whenever
+its settings change.
+"""
+import json
+import re
+from dataclasses import asdict, dataclass, replace as dc_replace
+from os import path, replace
+
+DEFAULT_PREFIXES = ('./', '/')
+
+
+@dataclass(frozen=True)
+class GuildSettings:
+    prefix: str = ''
+    language: str = ''
+    output_syntax: str = ''
+
+
+@dataclass(frozen=True)
+class ResolvedSettings:
+    settings: GuildSettings
+    prefixes: tuple
+    run_regex: re.Pattern
+    delete_regex: re.Pattern
+
+
+class GuildSettingsStore:
+    def __init__(self, filename):
+        self.filename = filename
+        self.bot_id = None  # Needed for the mention prefixes - set after login
+        self.settings = dict()  # guild_id -> GuildSettings
+        self.cache = dict()  # guild_id -> ResolvedSettings
+        if path.exists(filename):
+            with open(filename) as settingsfile:
+                self.settings = {
+                    int(guild_id): GuildSettings(**values)
+                    for guild_id, values in json.load(settingsfile).items()
+                }
+
+    def get(self, guild_id):
+        return self.settings.get(guild_id) or GuildSettings()
+
+    def resolve(self, guild_id):
+        """Resolve the settings of a guild (None for DMs)"""
+        resolved = self.cache.get(guild_id)
+        if resolved is None:
+            resolved = self.cache[guild_id] = self.build(self.get(guild_id))
+        return resolved
+
+    def build(self, settings):
+        prefixes = (f'<@{self.bot_id}> ', f'<@!{self.bot_id}> ')
+        if settings.prefix and settings.prefix not in DEFAULT_PREFIXES:
+            prefixes += (settings.prefix,)
+        prefixes += DEFAULT_PREFIXES
+        alternatives = '|'.join(re.escape(prefix) for prefix in prefixes)
+        return ResolvedSettings(
+            settings,
+            prefixes,
+            re.compile(rf'(?i)(?:{alternatives})run'),
+            re.compile(rf'(?:{alternatives})del(?:ete)?'),
+        )
+
+    def update(self, guild_id, **changes):
+        settings = dc_replace(self.get(guild_id), **changes)
+        if settings == GuildSettings():
+            self.settings.pop(guild_id, None)
+        else:
+            self.settings[guild_id] = settings
+        self.invalidate(guild_id)
+        self.save()
+        return settings
+
+    def invalidate(self, guild_id):
+        self.cache.pop(guild_id, None)
+
+    def set_bot_id(self, bot_id):
+        self.bot_id = bot_id
+        self.cache.clear()
+
+    def save(self):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as settingsfile:
+            json.dump(
+                {str(guild_id): asdict(s) for guild_id, s in self.settings.items()},
+                settingsfile
+            )
+        replace(tmp_filename, self.filename)
@@ -0,0 +1,26 @@
+"""State handoff between the outgoing and the incoming instance of a cog
+
+On reload cog_unload of the outgoing instance exports its state together with
+a schema version and __init__ of the incoming instance adopts it. State is only
+adopted if the schema version matches and it was exported recently - a cog
+that is unloaded and loaded again much later starts fresh.
+"""
+import time
+
+MAX_AGE = 300  # Seconds an exported state can be adopted
+
+
+def export_state(client, name, version, state):
+    client.cog_state[name] = (version, time.monotonic(), state)
+
+
+def adopt_state(client, name, version):
+    """Return the state exported by the previous instance of the cog [name] or None if
+    there is none, it is too old or it has a different schema version"""
+    exported = client.cog_state.pop(name, None)
+    if exported is None:
+        return None
+    exported_version, exported_at, state = exported
+    if exported_version != version or time.monotonic() - exported_at > MAX_AGE:
+        return None
+    return state
@@ -0,0 +1,57 @@
+"""Bounded cache of the last parsed /run invocation of each user
+
+The rerun command executes the cached request again (optionally with new arguments
+or standard input) without downloading, decoding or parsing anything. The least
+recently used entries are evicted when the cache holds more than [max_entries]
+invocations or more than [max_bytes] of sources.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ParsedRun:
+    language: str  # Piston language (used for the latency statistics)
+    version: str
+    output_syntax: str
+    data: dict  # The execute request - the source already includes the boilerplate
+
+    @property
+    def size(self):
+        return (
+            sum(len(file['content']) for file in self.data['files'])
+            + len(self.data['stdin'])
+            + sum(len(arg) for arg in self.data['args'] or ())
+        )
+
+
+class InvocationCache:
+    def __init__(self, max_entries=1000, max_bytes=8_000_000):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # user_id -> ParsedRun
+        self.stored_bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, user_id, parsed):
+        self.discard(user_id)
+        if parsed.size > self.max_bytes:
+            return
+        self.entries[user_id] = parsed
+        self.stored_bytes += parsed.size
+        while len(self.entries) > self.max_entries or self.stored_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.stored_bytes -= evicted.size
+
+    def get(self, user_id):
+        parsed = self.entries.get(user_id)
+        if parsed is not None:
+            self.entries.move_to_end(user_id)
+        return parsed
+
+    def discard(self, user_id):
+        parsed = self.entries.pop(user_id, None)
+        if parsed is not None:
+            self.stored_bytes -= parsed.size
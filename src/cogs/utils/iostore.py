@@ -0,0 +1,127 @@
+"""SQLite backed store for the most recent /run input and output message of each user
+
+Writes are collected in memory and written in batches by flush().
+The database is opened on first use and all database access happens in a worker
+thread so the event loop is never blocked - except close(), which writes the
+remaining rows when the cog is unloaded.
+The ids of all stored input messages are kept in a set, so raw message events of
+other messages are answered without a database query. The set is loaded by the first
+compact() (in the worker thread) - until then every id may be stored. Ids of replaced
+entries stay in the set until the next compact().
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+
+
+class DurableIOStore:
+    def __init__(self, filename, ttl=7 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        self.pending = dict()  # user_id -> (channel_id, input_id, output_id, updated) or None
+        self.lock = threading.Lock()
+        self.db = None  # Opened by connection()
+        self.input_ids = None  # Loaded by compact()
+        self.flushing = dict()  # Rows that are being written
+        self.added_input_ids = None  # Input ids put while compact() runs
+
+    def connection(self):
+        """The database connection - opened on first use. Call it with the lock held."""
+        if self.db is None:
+            self.db = sqlite3.connect(self.filename, check_same_thread=False)
+            with self.db:
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS run_io ('
+                    'user_id INTEGER PRIMARY KEY, channel_id INTEGER, input_id INTEGER, '
+                    'output_id INTEGER, updated REAL)'
+                )
+                self.db.execute('CREATE INDEX IF NOT EXISTS run_io_input ON run_io (input_id)')
+        return self.db
+
+    def put(self, user_id, channel_id, input_id, output_id):
+        self.pending[user_id] = (channel_id, input_id, output_id, time.time())
+        if self.input_ids is not None:
+            self.input_ids.add(input_id)
+        if self.added_input_ids is not None:
+            self.added_input_ids.add(input_id)
+
+    def delete(self, user_id):
+        self.pending[user_id] = None
+
+    async def get(self, user_id):
+        """Returns (channel_id, input_id, output_id) of a user or None"""
+        if user_id in self.pending:
+            row = self.pending[user_id]
+            return row and row[:3]
+        return await asyncio.to_thread(
+            self.query,
+            'SELECT channel_id, input_id, output_id FROM run_io WHERE user_id = ?',
+            user_id
+        )
+
+    def may_contain_input(self, input_id):
+        """False if input_id is certainly not the most recent /run message of any user"""
+        return self.input_ids is None or input_id in self.input_ids
+
+    async def get_user_by_input(self, input_id):
+        """Returns the id of the user whose most recent /run message is input_id or None"""
+        for user_id, row in self.pending.items():
+            if row and row[1] == input_id:
+                return user_id
+        row = await asyncio.to_thread(
+            self.query, 'SELECT user_id FROM run_io WHERE input_id = ?', input_id
+        )
+        if row is None or row[0] in self.pending:
+            return None
+        return row[0]
+
+    def query(self, sql, *parameters):
+        with self.lock:
+            return self.connection().execute(sql, parameters).fetchone()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        rows, self.pending = self.pending, dict()
+        self.flushing = rows
+        try:
+            await asyncio.to_thread(self.write, rows)
+        finally:
+            self.flushing = dict()
+
+    def write(self, rows):
+        with self.lock, self.connection() as db:
+            db.executemany(
+                'INSERT OR REPLACE INTO run_io VALUES (?, ?, ?, ?, ?)',
+                [(user_id, *row) for user_id, row in rows.items() if row is not None]
+            )
+            db.executemany(
+                'DELETE FROM run_io WHERE user_id = ?',
+                [(user_id,) for user_id, row in rows.items() if row is None]
+            )
+
+    async def compact(self):
+        """Delete all entries that are older than the ttl and (re)build the set of input ids"""
+        def delete_expired():
+            with self.lock, self.connection() as db:
+                db.execute('DELETE FROM run_io WHERE updated < ?', (time.time() - self.ttl,))
+                return {row[0] for row in db.execute('SELECT input_id FROM run_io')}
+        self.added_input_ids = set()
+        try:
+            stored = await asyncio.to_thread(delete_expired)
+        finally:
+            added, self.added_input_ids = self.added_input_ids, None
+        unwritten = {
+            row[1] for rows in (self.pending, self.flushing) for row in rows.values() if row
+        }
+        self.input_ids = stored | added | unwritten
+
+    def close(self):
+        rows, self.pending = self.pending, dict()
+        if rows:
+            self.write(rows)
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
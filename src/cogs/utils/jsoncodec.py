@@ -0,0 +1,32 @@
+"""JSON codecs for the requests to piston and emkc
+
+get_codec('orjson') returns the orjson based codec if orjson is installed and
+falls back to the stdlib json module otherwise. Both codecs dump to str so
+they can be used as json_serialize of an aiohttp ClientSession.
+orjson is an optional requirement (requirements-speedups.txt). Once it is installed
+discord.py also decodes gateway payloads with it, whatever codec is configured here.
+"""
+import json
+from dataclasses import dataclass
+from typing import Callable
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+@dataclass(frozen=True)
+class JSONCodec:
+    name: str
+    dumps: Callable
+    loads: Callable
+
+
+STDLIB_CODEC = JSONCodec('json', json.dumps, json.loads)
+
+
+def get_codec(name):
+    if name == 'orjson' and orjson is not None:
+        return JSONCodec('orjson', lambda obj: orjson.dumps(obj).decode(), orjson.loads)
+    return STDLIB_CODEC
@@ -0,0 +1,50 @@
+"""Per language latency histograms used for adaptive timeouts and hedged requests
+
+Histograms use the same log scaled bins as the analytics store. Once a histogram
+holds more than MAX_SAMPLES samples all counts are halved, so old traffic fades
+out and the histogram follows the current latency of a language. Requests that
+time out are observed with the timeout as their latency, so slow runs are not
+missing from the statistics.
+
+Once a language has MIN_SAMPLES samples its deadline is TIMEOUT_FACTOR * p99, clamped
+to MIN_TIMEOUT - MAX_TIMEOUT. The floor lies above the time piston gives a program to
+run, so only hung requests and unusually slow compiles are cut off.
+"""
+from .analytics import latency_bin, percentile
+
+MIN_SAMPLES = 20  # Samples needed before the learned latency of a language is used
+MAX_SAMPLES = 2000
+MIN_TIMEOUT = 8  # Seconds - floor of the learned deadline
+MAX_TIMEOUT = 15  # Seconds - hard timeout of every execute request
+TIMEOUT_FACTOR = 3  # Deadline = TIMEOUT_FACTOR * p99 (clamped to MIN/MAX_TIMEOUT)
+
+
+class LatencyTracker:
+    def __init__(self):
+        self.histograms = dict()  # language -> {bin: count}
+        self.totals = dict()  # language -> number of samples in the histogram
+
+    def observe(self, language, seconds):
+        histogram = self.histograms.setdefault(language, dict())
+        key = latency_bin(seconds * 1000)
+        histogram[key] = histogram.get(key, 0) + 1
+        self.totals[language] = self.totals.get(language, 0) + 1
+        if self.totals[language] > MAX_SAMPLES:
+            for key in list(histogram):
+                histogram[key] //= 2
+                if not histogram[key]:
+                    del histogram[key]
+            self.totals[language] = sum(histogram.values())
+
+    def quantile(self, language, q):
+        """Learned q-th percentile latency in seconds (None if there are not enough samples)"""
+        if self.totals.get(language, 0) < MIN_SAMPLES:
+            return None
+        return percentile(self.histograms[language], q) / 1000
+
+    def deadline(self, language):
+        """Timeout in seconds of an execute request of the language"""
+        p99 = self.quantile(language, 99)
+        if p99 is None:
+            return MAX_TIMEOUT
+        return min(MAX_TIMEOUT, max(MIN_TIMEOUT, p99 * TIMEOUT_FACTOR))
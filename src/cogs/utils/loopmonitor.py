@@ -0,0 +1,163 @@
+"""Event loop lag monitor and slow callback detector
+
+A heartbeat callback runs on the event loop every `threshold / 4` seconds. Every
+`interval` seconds the largest scheduling lag of the heartbeats is recorded together
+with the gateway latency of every shard.
+A watchdog thread checks the heartbeat just as often. If the loop is blocked for
+longer than `threshold` seconds the watchdog captures the stack of the event loop
+thread and the name of the task that is currently running. The heartbeat period is
+well below the threshold, so every block longer than the threshold is recorded: if
+the blocking callback returns before the watchdog looks, the next heartbeat records
+the stall (without a stack). Durations are accurate to one heartbeat period.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from statistics import StatisticsError, correlation
+
+MISSED_STACK = '(The callback returned before the watchdog could capture its stack)'
+MAX_SHARD_LINES = 10  # Shards with the highest gateway latency shown in the summary
+
+
+@dataclass
+class Stall:
+    date: datetime
+    duration: float
+    task_name: str
+    stack: str
+    gateway_latencies: dict  # shard id -> gateway latency
+
+    def slowest_shard(self):
+        """(shard id, latency) of the shard with the highest gateway latency or None"""
+        if not self.gateway_latencies:
+            return None
+        return max(self.gateway_latencies.items(), key=lambda item: item[1])
+
+
+class LoopMonitor:
+    def __init__(self, client, interval=0.5, threshold=0.25, max_samples=1200, max_stalls=50):
+        self.client = client
+        self.interval = interval
+        self.threshold = threshold
+        self.period = threshold / 4  # Heartbeat period
+        # (monotonic time, largest lag, {shard id: gateway latency})
+        self.samples = deque(maxlen=max_samples)
+        self.stalls = deque(maxlen=max_stalls)
+        self.lock = threading.Lock()  # Stalls are recorded by the loop and the watchdog
+        self.stalled_heartbeat = None  # Heartbeat before the last recorded stall
+        self.heartbeat = time.monotonic()
+        self.window_start = self.heartbeat
+        self.window_lag = 0.0
+        self.loop = None
+        self.loop_thread_id = None
+        self.handle = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+        self.heartbeat = self.window_start = time.monotonic()
+        self.handle = self.loop.call_later(
+            self.period, self.beat, self.loop.time() + self.period
+        )
+        threading.Thread(target=self.watch, name='LoopMonitorWatchdog', daemon=True).start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.handle is not None:
+            self.handle.cancel()
+
+    def gateway_latencies(self):
+        """shard id -> gateway latency - shards without a heartbeat ACK yet are left out"""
+        return {
+            shard_id: latency for shard_id, latency in self.client.latencies
+            if latency == latency  # latency is nan before the first ACK
+        }
+
+    def beat(self, due):
+        now = time.monotonic()
+        previous = self.heartbeat
+        self.heartbeat = now
+        if now - previous >= self.threshold:
+            self.record_stall(previous, now - previous)
+        self.window_lag = max(self.window_lag, self.loop.time() - due)
+        if now - self.window_start >= self.interval:
+            self.samples.append((now, self.window_lag, self.gateway_latencies()))
+            self.window_start = now
+            self.window_lag = 0.0
+        self.handle = self.loop.call_later(
+            self.period, self.beat, self.loop.time() + self.period
+        )
+
+    def record_stall(self, heartbeat, duration, capture_stack=False):
+        """Record the stall that started after [heartbeat] or update its duration"""
+        with self.lock:
+            if self.stalled_heartbeat == heartbeat:
+                # Still the same stall - only update its duration
+                self.stalls[-1].duration = max(self.stalls[-1].duration, duration)
+                return
+            stack, task_name = MISSED_STACK, '-'
+            if capture_stack:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                task = asyncio.current_task(self.loop)
+                stack = ''.join(traceback.format_stack(frame)) if frame else ''
+                task_name = task.get_name() if task else '-'
+            self.stalled_heartbeat = heartbeat
+            self.stalls.append(Stall(
+                datetime.now(tz=timezone.utc), duration, task_name, stack,
+                self.gateway_latencies(),
+            ))
+
+    def watch(self):
+        while not self.stopped.wait(self.period):
+            heartbeat = self.heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked >= self.threshold:
+                self.record_stall(heartbeat, blocked, capture_stack=True)
+
+    def summary(self, seconds=300):
+        """Lag statistics of the last [seconds] seconds"""
+        since = time.monotonic() - seconds
+        samples = [sample for sample in self.samples if sample[0] >= since]
+        if not samples:
+            return 'No lag samples yet'
+        lags = sorted(lag for _, lag, _ in samples)
+        p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))]
+        lines = [
+            f'Loop lag ({len(samples)} samples / {seconds} s): '
+            f'median {lags[len(lags) // 2] * 1000:.1f} ms | p99 {p99 * 1000:.1f} ms | '
+            f'max {lags[-1] * 1000:.1f} ms'
+        ]
+        # Correlation of the lag with the gateway latency of each shard
+        shards = dict()  # shard id -> ([lag, ...], [latency, ...])
+        for _, lag, latencies in samples:
+            for shard_id, latency in latencies.items():
+                shard_lags, shard_latencies = shards.setdefault(shard_id, ([], []))
+                shard_lags.append(lag)
+                shard_latencies.append(latency)
+        correlations = dict()
+        for shard_id, (shard_lags, shard_latencies) in shards.items():
+            try:
+                correlations[shard_id] = correlation(shard_lags, shard_latencies)
+            except StatisticsError:
+                pass
+        current = self.gateway_latencies()
+        for shard_id in sorted(
+            shards, key=lambda shard_id: max(shards[shard_id][1]), reverse=True
+        )[:MAX_SHARD_LINES]:
+            corr = correlations.get(shard_id)
+            lines.append(
+                f'Shard {shard_id} gateway latency: '
+                f'current {current.get(shard_id, 0) * 1000:.0f} ms | '
+                f'max {max(shards[shard_id][1]) * 1000:.0f} ms | '
+                f'correlation with lag {"-" if corr is None else f"{corr:.2f}"}'
+            )
+        if len(shards) > MAX_SHARD_LINES:
+            lines.append(f'({len(shards) - MAX_SHARD_LINES} shards with lower latencies)')
+        lines.append(f'Stalls > {self.threshold * 1000:.0f} ms: {len(self.stalls)} stored')
+        return '\n'.join(lines)
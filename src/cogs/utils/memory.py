@@ -0,0 +1,97 @@
+"""Memory usage of the bot process
+
+MemoryWatchdog keeps a history of the RSS of the process and of the sizes of the
+long lived structures of the bot (caches, stores, logs) and reports every bound
+that is exceeded - the RSS limit, the RSS growth within a time window or the
+maximum size of a structure. Each exceeded bound is reported once until it is
+back within its limit.
+"""
+import os
+import resource
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+class MemoryBoundExceeded(Exception):
+    """Exception logged when the process or one of its structures grows too big"""
+    pass
+
+
+def get_rss():
+    """Current resident set size of the process in bytes
+    (peak resident set size where /proc is not available)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryWatchdog:
+    def __init__(self, max_rss=None, max_growth=None, window=3600, max_samples=1440):
+        self.max_rss = max_rss  # bytes (None = no limit)
+        self.max_growth = max_growth  # bytes of RSS growth per window (None = no limit)
+        self.window = window  # seconds
+        self.samples = deque(maxlen=max_samples)  # (monotonic time, rss, {name: size})
+        self.exceeded = set()  # Names of the bounds that are currently exceeded
+        self.violations = deque(maxlen=50)  # (datetime, message)
+
+    def growth(self):
+        """RSS growth in bytes within the window (None if the history is too short)"""
+        if not self.samples:
+            return None
+        now, rss, _ = self.samples[-1]
+        baseline = None  # RSS of the newest sample that is at least [window] seconds old
+        for sampled, old_rss, _ in self.samples:
+            if now - sampled < self.window:
+                break
+            baseline = old_rss
+        return None if baseline is None else rss - baseline
+
+    def sample(self, structures):
+        """Record a sample - structures maps name -> (size, bound or None).
+        Returns the messages of all bounds that are newly exceeded."""
+        rss = get_rss()
+        self.samples.append((time.monotonic(), rss, {
+            name: size for name, (size, _) in structures.items()
+        }))
+        checks = {
+            name: (size, bound, f'{name} has {size} entries (bound {bound})')
+            for name, (size, bound) in structures.items()
+        }
+        checks['rss'] = (rss, self.max_rss, f'RSS is {rss / 2**20:.0f} MB '
+                         f'(bound {(self.max_rss or 0) / 2**20:.0f} MB)')
+        growth = self.growth()
+        checks['rss growth'] = (growth, self.max_growth, f'RSS grew {(growth or 0) / 2**20:.0f} '
+                                f'MB in {self.window} s (bound '
+                                f'{(self.max_growth or 0) / 2**20:.0f} MB)')
+        messages = []
+        for name, (value, bound, message) in checks.items():
+            if value is None or bound is None or value <= bound:
+                self.exceeded.discard(name)
+            elif name not in self.exceeded:
+                self.exceeded.add(name)
+                self.violations.append((datetime.now(tz=timezone.utc), message))
+                messages.append(message)
+        return messages
+
+    def summary(self, structures):
+        if not self.samples:
+            return 'No memory samples yet'
+        rss = self.samples[-1][1]
+        growth = self.growth()
+        lines = [
+            f'RSS {rss / 2**20:.0f} MB | limit '
+            + (f'{self.max_rss / 2**20:.0f} MB' if self.max_rss else '-')
+            + ' | growth in the last '
+            + f'{self.window} s '
+            + (f'{growth / 2**20:+.1f} MB' if growth is not None else '-')
+        ]
+        for name, (size, bound) in structures.items():
+            flag = ' [exceeded]' if name in self.exceeded else ''
+            lines.append(f'{name:<24} {size:>9} / {bound if bound is not None else "-"}{flag}')
+        lines.append(f'Bounds exceeded since start: {len(self.violations)} stored')
+        return '\n'.join(lines)
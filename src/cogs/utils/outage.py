@@ -0,0 +1,105 @@
+"""Durable queue for runs that arrive while piston is unavailable
+
+Each user has at most one queued run (a new run replaces the old one), and the
+queue holds at most [max_size] runs. Runs are kept in SQLite so they survive
+a restart. The database is opened on first use and all database access happens in
+a worker thread so the event loop is never blocked. Runs queued before a restart
+are counted once load() ran.
+"""
+import asyncio
+import sqlite3
+import threading
+from dataclasses import astuple, dataclass
+
+
+@dataclass(frozen=True)
+class QueuedRun:
+    user_id: int
+    guild_id: int  # 0 in DMs
+    channel_id: int
+    ack_id: int  # The acknowledgement message that is edited with the output
+    language: str
+    version: str
+    output_syntax: str
+    data: str  # The execute request as json
+    queued: float  # unix time
+
+
+class OutageQueue:
+    def __init__(self, filename, max_size=500):
+        self.filename = filename
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.db = None  # Opened by connection()
+        self.user_ids = set()  # Users with a queued run
+
+    def connection(self):
+        """The database connection - opened on first use. Call it with the lock held."""
+        if self.db is None:
+            self.db = sqlite3.connect(self.filename, check_same_thread=False)
+            with self.db:
+                self.db.execute('PRAGMA journal_mode=WAL')
+                self.db.execute(
+                    'CREATE TABLE IF NOT EXISTS queued_runs ('
+                    'user_id INTEGER PRIMARY KEY, guild_id INTEGER, channel_id INTEGER, '
+                    'ack_id INTEGER, language TEXT, version TEXT, output_syntax TEXT, '
+                    'data TEXT, queued REAL)'
+                )
+        return self.db
+
+    async def load(self):
+        """Count the runs that were queued before a restart"""
+        def select():
+            with self.lock:
+                return {
+                    row[0] for row in self.connection().execute('SELECT user_id FROM queued_runs')
+                }
+        self.user_ids |= await asyncio.to_thread(select)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def has_room(self, user_id):
+        return user_id in self.user_ids or len(self.user_ids) < self.max_size
+
+    async def put(self, run):
+        """Queue a run - returns the run of the same user it replaced (or None)"""
+        def replace_run():
+            with self.lock, self.connection() as db:
+                row = db.execute(
+                    'SELECT * FROM queued_runs WHERE user_id = ?', (run.user_id,)
+                ).fetchone()
+                db.execute(
+                    'INSERT OR REPLACE INTO queued_runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    astuple(run)
+                )
+            return row and QueuedRun(*row)
+        self.user_ids.add(run.user_id)
+        return await asyncio.to_thread(replace_run)
+
+    async def oldest(self, n):
+        def select():
+            with self.lock:
+                return self.connection().execute(
+                    'SELECT * FROM queued_runs ORDER BY queued LIMIT ?', (n,)
+                ).fetchall()
+        return [QueuedRun(*row) for row in await asyncio.to_thread(select)]
+
+    async def remove(self, run):
+        """Remove a run unless it was replaced by a newer run of the same user"""
+        def delete():
+            with self.lock, self.connection() as db:
+                db.execute(
+                    'DELETE FROM queued_runs WHERE user_id = ? AND queued = ?',
+                    (run.user_id, run.queued)
+                )
+                return db.execute(
+                    'SELECT 1 FROM queued_runs WHERE user_id = ?', (run.user_id,)
+                ).fetchone()
+        if not await asyncio.to_thread(delete):
+            self.user_ids.discard(run.user_id)
+
+    def close(self):
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
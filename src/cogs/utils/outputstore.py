@@ -0,0 +1,87 @@
+"""Bounded in-memory store for the full output of runs
+
+Outputs are kept zlib compressed and keyed by the id of the output message.
+The least recently used outputs are evicted once the store exceeds its byte budget.
+"""
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class StoredOutput:
+    author_id: int
+    introduction: str
+    output_syntax: str
+    data: bytes
+    size: int
+    page: int = 0
+
+    @property
+    def output(self):
+        return zlib.decompress(self.data).decode()
+
+
+class OutputStore:
+    def __init__(self, max_bytes=16_000_000, max_output_chars=262_144):
+        self.max_bytes = max_bytes
+        self.max_output_chars = max_output_chars
+        self.entries = OrderedDict()  # message_id -> StoredOutput
+        self.stored_bytes = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, message_id):
+        return message_id in self.entries
+
+    def put(self, message_id, author_id, introduction, output_syntax, output):
+        output = output[:self.max_output_chars]
+        data = zlib.compress(output.encode(), 6)
+        self.discard(message_id)
+        self.entries[message_id] = StoredOutput(
+            author_id, introduction, output_syntax, data, len(output)
+        )
+        self.stored_bytes += len(data)
+        while self.stored_bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.stored_bytes -= len(evicted.data)
+            self.evictions += 1
+
+    def get(self, message_id):
+        entry = self.entries.get(message_id)
+        if entry is not None:
+            self.entries.move_to_end(message_id)
+        return entry
+
+    def discard(self, message_id):
+        entry = self.entries.pop(message_id, None)
+        if entry is not None:
+            self.stored_bytes -= len(entry.data)
+
+    def stats(self):
+        raw = sum(entry.size for entry in self.entries.values())
+        return (
+            f'Output Store {len(self.entries)} / {self.stored_bytes // 1000} kb '
+            f'(raw {raw // 1000} kb, limit {self.max_bytes // 1000} kb, '
+            f'{self.evictions} evicted)'
+        )
+
+
+def paginate_output(output, max_chars, max_lines=30):
+    """Split output into pages of at most max_lines lines and max_chars characters"""
+    pages = []
+    lines = []
+    length = 0
+    for line in output.split('\n'):
+        chunks = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or ['']
+        for chunk in chunks:
+            if lines and (len(lines) >= max_lines or length + len(chunk) > max_chars):
+                pages.append('\n'.join(lines))
+                lines, length = [], 0
+            lines.append(chunk)
+            length += len(chunk) + 1
+    if lines:
+        pages.append('\n'.join(lines))
+    return pages
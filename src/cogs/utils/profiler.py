@@ -0,0 +1,80 @@
+"""Low overhead sampling profiler for the whole bot process
+
+A background thread samples the stacks of all threads at a fixed interval.
+Samples of the event loop thread are prefixed with the name of the running
+asyncio task. The result is in the collapsed stack format used by flamegraph.pl
+and speedscope: "thread;task;outer_frame;...;inner_frame count" per line.
+
+The memory used by the collected stacks is capped at MAX_STACK_BYTES: every new
+distinct stack is charged with its size plus the overhead of its counter entry.
+Samples of new stacks beyond the cap are counted as dropped.
+"""
+import asyncio
+import sys
+import threading
+import time
+from collections import Counter
+
+MAX_DURATION = 60  # Seconds
+MAX_STACK_BYTES = 8_000_000  # Memory cap for the collected stacks
+ENTRY_OVERHEAD = 100  # Bytes of a counter entry besides its key (slot, hash and count)
+MAX_DEPTH = 100  # Frames deeper than this are cut off
+
+
+def format_frame(frame):
+    code = frame.f_code
+    filename = code.co_filename.rsplit('/', 1)[-1]
+    return f'{code.co_name} ({filename}:{frame.f_lineno})'.replace(';', ',')
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.running = False
+        self.samples = 0
+        self.dropped = 0
+
+    def sample(self, duration, loop, loop_thread_id):
+        """Sample all threads for [duration] seconds (blocking - run it in a thread)"""
+        own_id = threading.get_ident()
+        stacks = Counter()
+        self.samples = self.dropped = 0
+        stack_bytes = 0
+        end = time.monotonic() + min(duration, MAX_DURATION)
+        while time.monotonic() < end:
+            thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                frames = []
+                while frame is not None and len(frames) < MAX_DEPTH:
+                    frames.append(format_frame(frame))
+                    frame = frame.f_back
+                root = [thread_names.get(thread_id, str(thread_id)).replace(';', ',')]
+                if thread_id == loop_thread_id:
+                    task = asyncio.current_task(loop)
+                    root.append(f'task:{task.get_name()}' if task else 'task:-')
+                key = ';'.join(root + frames[::-1])
+                if key in stacks:
+                    stacks[key] += 1
+                elif stack_bytes + sys.getsizeof(key) + ENTRY_OVERHEAD <= MAX_STACK_BYTES:
+                    stack_bytes += sys.getsizeof(key) + ENTRY_OVERHEAD
+                    stacks[key] = 1
+                else:
+                    self.dropped += 1
+                self.samples += 1
+            time.sleep(self.interval)
+        return stacks
+
+    async def profile(self, duration):
+        """Profile the process for [duration] seconds and return the collapsed stacks"""
+        if self.running:
+            raise RuntimeError('The profiler is already running')
+        self.running = True
+        try:
+            stacks = await asyncio.to_thread(
+                self.sample, duration, asyncio.get_running_loop(), threading.get_ident()
+            )
+        finally:
+            self.running = False
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common())
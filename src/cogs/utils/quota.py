@@ -0,0 +1,126 @@
+"""Resource budgets and the persistent blocklist for code execution
+
+The BudgetLedger keeps a token bucket per key (user or guild). Every run is charged
+with the cost piston reported for it and the buckets refill over time.
+A key whose balance dropped below zero is throttled until it recovered.
+The charged totals shown by top() are kept for the [max_charged] keys that were
+charged the most - totals of smaller keys are dropped when there are too many.
+"""
+import heapq
+import json
+import time
+from os import path, replace
+
+BASE_RUN_COST = 50  # Cost charged for every run on top of the reported resources
+DEFAULT_RUN_COST = 1000  # Cost of a run if piston did not report any resource usage
+
+
+def run_cost(result):
+    """Cost of a run in cpu milliseconds (and equivalents) from a piston execute result"""
+    cost = BASE_RUN_COST
+    reported = False
+    for stage in ('compile', 'run'):
+        data = result.get(stage) or {}
+        cpu_time = data.get('cpu_time')
+        wall_time = data.get('wall_time')
+        memory = data.get('memory')
+        if cpu_time is not None:
+            cost += cpu_time
+            reported = True
+        if wall_time is not None:
+            cost += wall_time / 10
+            reported = True
+        if memory is not None:
+            cost += memory / 1_000_000  # 1 per MB
+            reported = True
+    return cost if reported else DEFAULT_RUN_COST
+
+
+class BudgetLedger:
+    def __init__(self, capacity, refill_per_second, max_charged=10000):
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_charged = max_charged
+        self.buckets = dict()  # key -> [balance, timestamp of last update]
+        self.charged = dict()  # key -> total cost charged since start (biggest keys only)
+        self.throttled = 0
+
+    def _balance(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        balance, updated = bucket
+        return min(self.capacity, balance + (now - updated) * self.refill_per_second)
+
+    def charge(self, key, cost):
+        now = time.monotonic()
+        self.buckets[key] = [self._balance(key, now) - cost, now]
+        self.charged[key] = self.charged.get(key, 0) + cost
+        if len(self.charged) > 2 * self.max_charged:
+            self.trim_charged()
+
+    def trim_charged(self):
+        """Keep the totals of the [max_charged] keys that were charged the most"""
+        if len(self.charged) > self.max_charged:
+            self.charged = dict(heapq.nlargest(
+                self.max_charged, self.charged.items(), key=lambda item: item[1]
+            ))
+
+    def retry_after(self, key):
+        """Seconds until key is allowed to run again (0 if it is allowed now)"""
+        if key not in self.buckets:
+            return 0
+        balance = self._balance(key, time.monotonic())
+        if balance >= 0:
+            return 0
+        self.throttled += 1
+        return -balance / self.refill_per_second
+
+    def prune(self):
+        """Forget all buckets that refilled completely and the charged totals of all but
+        the [max_charged] biggest keys"""
+        now = time.monotonic()
+        for key in [k for k in self.buckets if self._balance(k, now) >= self.capacity]:
+            del self.buckets[key]
+        self.trim_charged()
+
+    def top(self, n=10):
+        now = time.monotonic()
+        return [
+            (key, self.charged[key], self._balance(key, now))
+            for key in heapq.nlargest(n, self.charged, key=self.charged.get)
+        ]
+
+
+class Blocklist:
+    def __init__(self, filename, initial=()):
+        self.filename = filename
+        if path.exists(filename):
+            with open(filename) as blockfile:
+                self.user_ids = set(json.load(blockfile))
+        else:
+            self.user_ids = set(initial)
+            self.save()
+
+    def __contains__(self, user_id):
+        return user_id in self.user_ids
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __iter__(self):
+        return iter(sorted(self.user_ids))
+
+    def add(self, user_id):
+        self.user_ids.add(user_id)
+        self.save()
+
+    def remove(self, user_id):
+        self.user_ids.discard(user_id)
+        self.save()
+
+    def save(self):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'w') as blockfile:
+            json.dump(sorted(self.user_ids), blockfile)
+        replace(tmp_filename, self.filename)
@@ -0,0 +1,105 @@
+"""Immutable index of the runtimes offered by piston
+
+The index is built once per runtime refresh. It maps every language name and alias
+to its language and to all versions available for it (newest first) and maps file
+extensions to aliases. Version specs like "3.10", "^3.9" or ">=3.8" are resolved
+once per (alias, spec) and cached. Unsupported names are looked up in a suggestion
+index over all aliases and file extensions.
+"""
+import re
+from types import MappingProxyType
+from .suggest import SuggestionIndex
+
+# File extensions that are not piston aliases themselves -> piston alias
+EXTENSIONS = {
+    'cc': 'c++', 'cpp': 'c++', 'cxx': 'c++', 'h': 'c', 'hpp': 'c++', 'cs': 'csharp',
+    'fs': 'fsharp', 'kt': 'kotlin', 'rb': 'ruby', 'rs': 'rust', 'hs': 'haskell',
+    'jl': 'julia', 'ex': 'elixir', 'exs': 'elixir', 'erl': 'erlang', 'clj': 'clojure',
+    'ml': 'ocaml', 'r': 'rscript', 'cr': 'crystal', 'f90': 'fortran', 'asm': 'nasm',
+    'ps1': 'powershell', 'pl': 'perl', 'pas': 'pascal', 'rkt': 'racket',
+    'lisp': 'commonlisp', 'cob': 'cobol', 'mjs': 'javascript', 'sh': 'bash',
+}
+
+SPEC_REGEX = re.compile(
+    r'(?P<operator>\^|~|>=|<=|>|<|=)?\s*v?(?P<version>\d+(?:\.\d+)*)(?:\.[x*])?'
+)
+MAX_RESOLVED = 4096  # Maximum number of cached version resolutions
+
+
+def parse_version(version):
+    return tuple(int(part) for part in re.findall(r'\d+', version))
+
+
+def version_matches(version, operator, wanted):
+    if operator in (None, '='):
+        return version[:len(wanted)] == wanted
+    if operator == '^':
+        return version[:1] == wanted[:1] and version >= wanted
+    if operator == '~':
+        return version[:2] == wanted[:2] and version >= wanted
+    if operator == '>=':
+        return version >= wanted
+    if operator == '>':
+        return version[:len(wanted)] > wanted
+    if operator == '<=':
+        return version[:len(wanted)] <= wanted
+    return version < wanted
+
+
+class RuntimeIndex:
+    def __init__(self, runtimes):
+        self.raw = runtimes
+        languages = dict()  # alias -> language
+        versions = dict()  # alias -> [version, ...]
+        for runtime in runtimes:
+            language = runtime['language']
+            for alias in [language] + runtime['aliases']:
+                languages.setdefault(alias, language)
+                if runtime['version'] not in versions.setdefault(alias, []):
+                    versions[alias].append(runtime['version'])
+        self.languages = MappingProxyType(languages)
+        self.versions = MappingProxyType({
+            alias: tuple(sorted(alias_versions, key=parse_version, reverse=True))
+            for alias, alias_versions in versions.items()
+        })
+        self.extensions = MappingProxyType({
+            **{ext: alias for ext, alias in EXTENSIONS.items() if alias in languages},
+            **{alias: alias for alias in languages},
+        })
+        self.language_names = tuple(sorted(set(languages.values())))
+        self.suggestions = SuggestionIndex(self.extensions)
+        self.resolved = dict()  # (alias, spec) -> version
+
+    def __contains__(self, name):
+        """name is an alias optionally followed by @version"""
+        return name is not None and name.partition('@')[0] in self.languages
+
+    def __len__(self):
+        return len(self.language_names)
+
+    def resolve(self, name):
+        """Resolve alias[@spec] to (alias, language, version) - version is None if no
+        version matches the spec"""
+        alias, _, spec = name.partition('@')
+        key = (alias, spec)
+        version = self.resolved.get(key)
+        if version is None:
+            version = self.resolve_version(alias, spec)
+            if len(self.resolved) < MAX_RESOLVED:
+                self.resolved[key] = version
+        return alias, self.languages[alias], version
+
+    def resolve_version(self, alias, spec):
+        versions = self.versions[alias]
+        if not spec or spec == 'latest':
+            return versions[0]
+        if spec in versions:
+            return spec
+        match = SPEC_REGEX.fullmatch(spec.strip())
+        if not match:
+            return None
+        wanted = parse_version(match.group('version'))
+        for version in versions:
+            if version_matches(parse_version(version), match.group('operator'), wanted):
+                return version
+        return None
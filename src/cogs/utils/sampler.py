@@ -0,0 +1,158 @@
+"""Opt-in sampler of /run invocations for benchmark corpora
+
+A small random fraction of invocations is written to a rotating JSONL file by a
+background thread. User, guild and channel ids are hashed with a secret salt and
+everything but the command line and the codeblock languages can be redacted to
+token shapes (letters -> "a", digits -> "0"), which keeps lengths, whitespace,
+punctuation and the codeblock structure intact.
+
+Every line is one record that can be fed back into the run parser:
+    {"v": 1, "time": unix time, "kind": "run" | "live" | "edit",
+     "user": hash, "guild": hash or null, "channel": hash,
+     "content": message content as seen by the parser ("/run ..."),
+     "redacted": bool, "attachments": [{"extension": str, "size": int}]}
+
+The time spent on the event loop is capped at [budget] (fraction of wall time).
+Records that do not fit into the queue or the budget are counted and dropped.
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+
+RECORD_VERSION = 1
+BUDGET_WINDOW = 60  # Seconds
+LETTERS = re.compile(r'[^\W\d_]')
+DIGITS = re.compile(r'\d')
+SYNTAX_LINE = re.compile(r'\S+')
+
+
+def token_shape(text):
+    return DIGITS.sub('0', LETTERS.sub('a', text))
+
+
+def redact(content, is_language):
+    """Token shapes of everything but the command line and the codeblock languages - the
+    first line of a codeblock is only kept if it is a language (is_language(name) is true)
+    followed by a newline, otherwise it may be code"""
+    parts = content.split('```')
+    for i, part in enumerate(parts):
+        head, sep, rest = part.partition('\n')
+        is_codeblock = i % 2 == 1 and i < len(parts) - 1
+        if i == 0 or (
+            is_codeblock and sep and SYNTAX_LINE.fullmatch(head) and is_language(head.lower())
+        ):
+            parts[i] = head + sep + token_shape(rest)
+        else:
+            parts[i] = token_shape(part)
+    return '```'.join(parts)
+
+
+class TrafficSampler:
+    def __init__(self, filename, salt, is_language, rate=0.01, redact_sources=True,
+                 max_bytes=10_000_000, backups=3, max_queue=1000, budget=0.001):
+        self.filename = filename
+        self.is_language = is_language  # name -> whether codeblocks may keep it as syntax
+        self.salt = salt[:64]
+        self.rate = rate
+        self.redact_sources = redact_sources
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.budget = budget
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = dict(sampled=0, written=0, queue_full=0, over_budget=0)
+        self.spent = 0.0  # Seconds spent on the event loop in the current budget window
+        self.window_start = time.monotonic()
+        self.thread = threading.Thread(target=self.write_records, name='TrafficSampler',
+                                       daemon=True)
+        self.thread.start()
+
+    def hash(self, value):
+        return hashlib.blake2b(str(value).encode(), key=self.salt, digest_size=16).hexdigest()
+
+    def within_budget(self):
+        now = time.monotonic()
+        if now - self.window_start >= BUDGET_WINDOW:
+            self.window_start = now
+            self.spent = 0.0
+        return self.spent <= self.budget * BUDGET_WINDOW
+
+    def offer(self, kind, ctx):
+        """Sample the invocation in ctx with probability [rate]"""
+        if random.random() >= self.rate:
+            return
+        if not self.within_budget():
+            self.stats['over_budget'] += 1
+            return
+        started = time.perf_counter()
+        message = ctx.message
+        content = message.content
+        record = {
+            'v': RECORD_VERSION,
+            'time': round(time.time(), 3),
+            'kind': kind,
+            'user': self.hash(ctx.author.id),
+            'guild': self.hash(ctx.guild.id) if ctx.guild else None,
+            'channel': self.hash(ctx.channel.id),
+            'content': redact(content, self.is_language) if self.redact_sources else content,
+            'redacted': self.redact_sources,
+            'attachments': [
+                {'extension': file.filename.rpartition('.')[2].lower(), 'size': file.size}
+                for file in message.attachments
+            ],
+        }
+        try:
+            self.queue.put_nowait(record)
+            self.stats['sampled'] += 1
+        except queue.Full:
+            self.stats['queue_full'] += 1
+        self.spent += time.perf_counter() - started
+
+    def rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f'{self.filename}.{i}'):
+                os.replace(f'{self.filename}.{i}', f'{self.filename}.{i + 1}')
+        if os.path.exists(self.filename):
+            os.replace(self.filename, f'{self.filename}.1')
+
+    def write_records(self):
+        file = open(self.filename, 'a', encoding='utf-8')
+        try:
+            size = file.tell()
+            while True:
+                record = self.queue.get()
+                if record is None:
+                    break
+                line = json.dumps(record, ensure_ascii=False) + '\n'
+                if size and size + len(line) > self.max_bytes:
+                    file.close()
+                    self.rotate()
+                    file = open(self.filename, 'a', encoding='utf-8')
+                    size = 0
+                file.write(line)
+                size += len(line)
+                self.stats['written'] += 1
+                if self.queue.empty():
+                    file.flush()
+        finally:
+            file.close()
+
+    def close(self):
+        """Write all queued records and stop the writer thread"""
+        try:
+            self.queue.put(None, timeout=1)
+        except queue.Full:
+            return
+        self.thread.join(timeout=2)
+
+    def summary(self):
+        stats = self.stats
+        return (
+            f'Traffic sampler: rate {self.rate:.2%} | sampled {stats["sampled"]} | '
+            f'written {stats["written"]} | dropped {stats["queue_full"]} (queue full) / '
+            f'{stats["over_budget"]} (over budget)'
+        )
@@ -0,0 +1,78 @@
+"""Statistics of execute requests mirrored to a shadow piston backend
+
+For every mirrored request the latency delta (shadow - primary) and whether both
+backends produced the same result are recorded per language. Only the newest
+MAX_DELTAS deltas of a language are kept for the percentiles.
+"""
+from collections import deque
+from dataclasses import dataclass, field
+
+MAX_DELTAS = 500
+
+
+def outputs_match(primary, shadow):
+    """Both responses have the same output, exit code and compile errors"""
+    def result(response):
+        compile_stage = response.get('compile') or {}
+        return (
+            compile_stage.get('code'),
+            compile_stage.get('stderr'),
+            response['run']['output'],
+            response['run']['code'],
+        )
+    return result(primary) == result(shadow)
+
+
+def quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+@dataclass
+class LanguageShadowStats:
+    mirrored: int = 0
+    errors: int = 0
+    mismatches: int = 0
+    deltas: deque = field(default_factory=lambda: deque(maxlen=MAX_DELTAS))  # seconds
+
+
+class ShadowStats:
+    def __init__(self):
+        self.languages = dict()  # language -> LanguageShadowStats
+        self.skipped = 0  # Sampled requests not mirrored because of the concurrency cap
+
+    def language(self, language):
+        return self.languages.setdefault(language, LanguageShadowStats())
+
+    def record(self, language, delta, match):
+        stats = self.language(language)
+        stats.mirrored += 1
+        stats.deltas.append(delta)
+        if not match:
+            stats.mismatches += 1
+
+    def record_error(self, language):
+        stats = self.language(language)
+        stats.mirrored += 1
+        stats.errors += 1
+
+    def report(self, n=15):
+        """The [n] languages with the most mirrored requests"""
+        rows = sorted(self.languages.items(), key=lambda item: item[1].mirrored, reverse=True)
+        lines = []
+        for language, stats in rows[:n]:
+            compared = stats.mirrored - stats.errors
+            mismatch_rate = stats.mismatches / compared * 100 if compared else 0
+            if stats.deltas:
+                deltas = (
+                    f'delta p50 {quantile(stats.deltas, 50) * 1000:>+6.0f} | '
+                    f'p95 {quantile(stats.deltas, 95) * 1000:>+6.0f} ms'
+                )
+            else:
+                deltas = 'no latency samples'
+            lines.append(
+                f'{language:<12} {stats.mirrored:>6} mirrored | {stats.errors:>4} errors | '
+                f'{mismatch_rate:>5.1f}% mismatch | {deltas}'
+            )
+        lines.append(f'Skipped (concurrency cap): {self.skipped}')
+        return '\n'.join(lines)
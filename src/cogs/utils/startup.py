@@ -0,0 +1,44 @@
+"""Timing of the startup phases of the bot
+
+All phases are recorded relative to the start of the process (the first
+line of bot.py) so every phase (e.g. the load of a single cog) shows up with
+its real start and end time.
+"""
+import time
+from contextlib import contextmanager
+
+
+class StartupReport:
+    def __init__(self, started):
+        self.started = started
+        self.phases = []  # (name, start offset, duration) in seconds
+        self.notes = []  # Free text lines shown below the phases (e.g. memory usage)
+
+    def record(self, name, start, end=None):
+        end = time.perf_counter() if end is None else end
+        self.phases.append((name, start - self.started, end - start))
+
+    def note(self, text):
+        self.notes.append(text)
+
+    def has(self, name):
+        return any(phase[0] == name for phase in self.phases)
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def __str__(self):
+        lines = [
+            f'{name:<30} start {offset * 1000:>8.0f} ms | took {duration * 1000:>8.0f} ms'
+            for name, offset, duration in sorted(self.phases, key=lambda phase: phase[1])
+        ]
+        if self.phases:
+            total = max(offset + duration for _, offset, duration in self.phases)
+            lines.append(f'{"total":<30} {total * 1000:>23.0f} ms')
+        lines.extend(self.notes)
+        return '\n'.join(lines)
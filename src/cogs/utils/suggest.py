@@ -0,0 +1,107 @@
+"""Suggestions for unsupported language names
+
+Names are normalized ("C#" -> "csharp", "node.js" -> "nodejs") and indexed by
+their bigrams. A lookup only computes the edit distance to the names that share
+the most bigrams with the query, so it takes microseconds even with hundreds
+of aliases. Results are cached until the index is rebuilt.
+"""
+import re
+from collections import Counter
+
+MAX_CANDIDATES = 10  # Names compared by edit distance per lookup
+MAX_SUGGESTIONS = 3
+MAX_CACHED = 4096  # Maximum number of cached lookups
+
+
+def normalize(name):
+    name = name.lower().replace('#', 'sharp').replace('++', 'pp')
+    return re.sub(r'[^a-z0-9]', '', name)
+
+
+def bigrams(name):
+    padded = f'^{name}$'
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance that counts a transposition of two letters as one edit
+    (limit + 1 as soon as the distance is known to be greater than limit)"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def max_distance(name):
+    """Maximum edit distance for a suggestion - short names allow fewer typos"""
+    return 1 if len(name) <= 4 else 2 if len(name) <= 8 else 3
+
+
+def max_correction_distance(name):
+    """Maximum edit distance for an automatic correction"""
+    return 0 if len(name) <= 3 else 1 if len(name) <= 8 else 2
+
+
+class SuggestionIndex:
+    def __init__(self, names):
+        """names maps every name that may be typed (aliases, file extensions) to the
+        alias it stands for"""
+        self.targets = dict()  # normalized name -> alias
+        for name, alias in names.items():
+            self.targets.setdefault(normalize(name), alias)
+        self.index = dict()  # bigram -> [normalized name, ...]
+        for name in self.targets:
+            for gram in bigrams(name):
+                self.index.setdefault(gram, []).append(name)
+        self.cache = dict()  # normalized query -> (correction, suggestions)
+
+    def lookup(self, query):
+        """Returns (correction, suggestions) for an unsupported name. correction is the
+        alias the query unambiguously stands for (or None), suggestions are the closest
+        aliases (best first)."""
+        key = normalize(query)
+        result = self.cache.get(key)
+        if result is None:
+            result = self.find(key)
+            if len(self.cache) < MAX_CACHED:
+                self.cache[key] = result
+        return result
+
+    def find(self, key):
+        if not key:
+            return None, ()
+        if key in self.targets:
+            return self.targets[key], (self.targets[key],)
+        shared = Counter()
+        for gram in bigrams(key):
+            shared.update(self.index.get(gram, ()))
+        limit = max_distance(key)
+        scored = sorted(
+            (distance, -count, name)
+            for name, count in shared.most_common(MAX_CANDIDATES)
+            for distance in (edit_distance(key, name, limit),)
+            if distance <= limit
+        )
+        suggestions = []
+        for _, _, name in scored:
+            if self.targets[name] not in suggestions:
+                suggestions.append(self.targets[name])
+        best = {self.targets[name] for distance, _, name in scored if distance == scored[0][0]}
+        correction = None
+        if scored and scored[0][0] <= max_correction_distance(key) and len(best) == 1:
+            correction = suggestions[0]
+        return correction, tuple(suggestions[:MAX_SUGGESTIONS])
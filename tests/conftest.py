@@ -0,0 +1,30 @@
+import asyncio
+
+import pytest
+from stubs import FakeClient, StubSession, bot_directory, import_src, start_run_cog
+
+import_src()
+
+
+@pytest.fixture
+def bot_dir(tmp_path):
+    """Working directory of the bot with an empty state directory"""
+    with bot_directory(str(tmp_path)):
+        yield tmp_path
+
+
+@pytest.fixture
+def run_cog(bot_dir):
+    """run_cog(test, client=None) awaits test(client, cog) with a started run cog (on a
+    FakeClient with the default StubSession unless [client] is given) and returns the
+    result - the cog is unloaded afterwards"""
+    def run(test, client=None):
+        async def main():
+            started_client = client or FakeClient(StubSession())
+            cog = await start_run_cog(started_client)
+            try:
+                return await test(started_client, cog)
+            finally:
+                cog.cog_unload()
+        return asyncio.run(main())
+    return run
@@ -0,0 +1,391 @@
+"""Stub piston API and fake discord objects for the tests and benchmarks
+
+The run cog is driven without discord or network access: StubSession answers the
+requests to piston and emkc (optionally after a simulated latency), StubWebSocket plays
+piston's interactive /connect job for live runs and FakeClient, FakeContext and
+FakeMessage provide the attributes the cog uses. start_piston_bot creates the real
+PistonBot of bot.py without a gateway connection for tests that need the whole bot.
+"""
+import ast
+import asyncio
+import itertools
+import json
+import sys
+from contextlib import contextmanager
+from dataclasses import dataclass
+from os import chdir, getcwd, makedirs, path
+from types import SimpleNamespace
+
+SRC = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'src')
+
+RUNTIMES = [
+    {'language': 'python', 'version': '3.10.0', 'aliases': ['py', 'py3', 'python3']},
+    {'language': 'python', 'version': '2.7.18', 'aliases': ['py2', 'python2']},
+    {'language': 'javascript', 'version': '18.15.0', 'aliases': ['node-js', 'js']},
+    {'language': 'rust', 'version': '1.68.2', 'aliases': ['rs']},
+    {'language': 'bash', 'version': '5.2.0', 'aliases': ['sh']},
+]
+
+_ids = itertools.count(10**17)
+
+
+def import_src(src=SRC):
+    """Make the bot's packages (cogs) importable - call it before creating a FakeClient"""
+    if src not in sys.path:
+        sys.path.insert(0, src)
+
+
+@contextmanager
+def bot_directory(root):
+    """Run with <root>/src as working directory - the cogs keep their state in ../state"""
+    makedirs(path.join(root, 'src'), exist_ok=True)
+    makedirs(path.join(root, 'state'), exist_ok=True)
+    cwd = getcwd()
+    chdir(path.join(root, 'src'))
+    try:
+        yield
+    finally:
+        chdir(cwd)
+
+
+@dataclass
+class Latency:
+    """Simulated latencies in seconds"""
+    execute: float = 0
+    log: float = 0
+    typing: float = 0
+    send: float = 0
+    download: float = 0
+
+
+def echo_output(data):
+    """Default program output: the source code itself"""
+    return data['files'][0]['content']
+
+
+async def echo_program(init, stdin):
+    """Default live program: prints its source code and exits"""
+    yield 0, {'type': 'stage', 'stage': 'run'}
+    yield 0, {'type': 'data', 'stream': 'stdout', 'data': init['files'][0]['content']}
+    yield 0, {'type': 'exit', 'stage': 'run', 'code': 0, 'signal': None}
+
+
+class StubResponse:
+    def __init__(self, status, body, latency=0):
+        self.status = status
+        self.body = body
+        self.latency = latency
+
+    async def __aenter__(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def json(self, loads=json.loads, **kwargs):
+        return loads(json.dumps(self.body))
+
+
+class StubWebSocket:
+    """Piston's interactive /connect job. [program] is an async generator function
+    (init message, stdin queue) that yields (seconds to wait, event) for the events
+    piston sends - stdin receives the data of the stdin messages of the bot."""
+    def __init__(self, program):
+        self.program = program
+        self.sent = []  # Messages sent by the bot
+        self.stdin = asyncio.Queue()
+        self.events = asyncio.Queue()
+        self.task = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.task is not None:
+            self.task.cancel()
+        return False
+
+    async def send_json(self, data, dumps=json.dumps):
+        message = json.loads(dumps(data))
+        self.sent.append(message)
+        if message['type'] == 'init':
+            self.task = asyncio.create_task(self.run(message))
+        elif message['type'] == 'data' and message['stream'] == 'stdin':
+            self.stdin.put_nowait(message['data'])
+
+    async def run(self, init):
+        from aiohttp import WSMessage, WSMsgType
+        await self.events.put(WSMessage(WSMsgType.TEXT, json.dumps({
+            'type': 'runtime', 'language': init['language'], 'version': init['version']
+        }), None))
+        async for delay, event in self.program(init, self.stdin):
+            if delay:
+                await asyncio.sleep(delay)
+            await self.events.put(WSMessage(WSMsgType.TEXT, json.dumps(event), None))
+        await self.events.put(WSMessage(WSMsgType.CLOSED, None, None))
+
+    async def receive(self, timeout=None):
+        return await asyncio.wait_for(self.events.get(), timeout)
+
+
+class StubSession:
+    """Answers GET /runtimes, POST /execute and the emkc log requests like piston"""
+    def __init__(self, latency=None, output=echo_output, runtimes=RUNTIMES,
+                 program=echo_program):
+        self.latency = latency or Latency()
+        self.output = output  # data -> output of the program (or an Exception to raise)
+        self.program = program  # Live program - see StubWebSocket
+        self.runtimes = runtimes
+        self.status = 200
+        self.requests = dict(runtimes=0, execute=0, log=0)
+        self.websockets = []
+
+    def get(self, url, **kwargs):
+        self.requests['runtimes'] += 1
+        return StubResponse(self.status, self.runtimes)
+
+    def post(self, url, headers=None, json=None, data=None, timeout=None, **kwargs):
+        if url.endswith('/log'):
+            self.requests['log'] += 1
+            return StubResponse(200, {}, self.latency.log)
+        self.requests['execute'] += 1
+        if self.status != 200:
+            return StubResponse(self.status, {'message': 'stub error'}, self.latency.execute)
+        output = self.output(json)
+        if isinstance(output, Exception):
+            raise output
+        return StubResponse(200, {
+            'language': json['language'],
+            'version': json['version'],
+            'run': {
+                'stdout': output, 'stderr': '', 'output': output, 'code': 0, 'signal': None,
+                'cpu_time': 5, 'wall_time': 20, 'memory': 1_000_000,
+            },
+        }, self.latency.execute)
+
+    async def ws_connect(self, url, headers=None, **kwargs):
+        ws = StubWebSocket(self.program)
+        self.websockets.append(ws)
+        return ws
+
+
+class FakeMessage:
+    def __init__(self, content='', author=None, guild=None, channel=None, attachments=()):
+        self.id = next(_ids)
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.attachments = list(attachments)
+        self.embed = None
+        self.view = None
+        self.deleted = False
+        self.edits = []  # Contents of all edits
+
+    async def edit(self, content=None, embed=None, view=None, **kwargs):
+        if self.deleted:
+            raise_not_found()
+        self.edits.append(content)
+        self.content = content
+        self.embed = embed
+        self.view = view
+        return self
+
+    async def delete(self):
+        if self.deleted:
+            raise_not_found()
+        self.deleted = True
+
+
+def raise_not_found():
+    from discord import errors as discord_errors
+
+    class Response:
+        status = 404
+        reason = 'Not Found'
+    raise discord_errors.NotFound(Response(), 'Unknown Message')
+
+
+class FakeChannel:
+    def __init__(self, channel_id=None):
+        self.id = channel_id or next(_ids)
+        self.messages = dict()  # message id -> FakeMessage
+
+    def get_partial_message(self, message_id):
+        return self.messages.setdefault(message_id, FakeMessage(channel=self))
+
+    def permissions_for(self, member):
+        return SimpleNamespace(send_messages=True, embed_links=True)
+
+
+class FakeAttachment:
+    def __init__(self, filename, content, latency=0):
+        self.filename = filename
+        self.content = content.encode()
+        self.size = len(self.content)
+        self.latency = latency
+
+    async def read(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.content
+
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id}'
+        self.discriminator = '0'
+        self.mention = f'<@{user_id}>'
+        self.bot = False
+
+
+class FakeGuild:
+    def __init__(self, guild_id, shard_id=0, member_count=100):
+        self.id = guild_id
+        self.name = f'guild{guild_id}'
+        self.shard_id = shard_id
+        self.member_count = member_count
+        self.me = None
+
+
+class FakeContext:
+    """The parts of commands.Context the run cog uses"""
+    def __init__(self, client, user_id, content, guild_id=None, attachments=()):
+        self.client = client
+        self.author = FakeUser(user_id)
+        self.guild = FakeGuild(guild_id) if guild_id else None
+        self.channel = client.get_channel(guild_id or user_id)
+        self.message = FakeMessage(content, self.author, self.guild, self.channel, attachments)
+        self.channel.messages[self.message.id] = self.message
+        self.sent = []  # Messages sent in reply
+
+    async def send(self, content=None, embed=None, view=None, **kwargs):
+        if self.client.session.latency.send:
+            await asyncio.sleep(self.client.session.latency.send)
+        msg = FakeMessage(content, guild=self.guild, channel=self.channel)
+        msg.embed = embed
+        msg.view = view
+        self.channel.messages[msg.id] = msg
+        self.sent.append(msg)
+        return msg
+
+    async def typing(self):
+        if self.client.session.latency.typing:
+            await asyncio.sleep(self.client.session.latency.typing)
+
+
+class FakeStartupReport:
+    def record(self, name, start, end=None):
+        pass
+
+    def has(self, name):
+        return True
+
+
+class FakeDiscord:
+    """Channels, guilds and users of a client without a gateway connection"""
+    channels: dict  # channel id -> FakeChannel
+
+    async def wait_until_ready(self):
+        pass
+
+    def get_channel(self, channel_id):
+        return self.channels.setdefault(channel_id, FakeChannel(channel_id))
+
+    def get_partial_messageable(self, channel_id):
+        return self.get_channel(channel_id)
+
+    def get_guild(self, guild_id):
+        return FakeGuild(guild_id) if guild_id else None
+
+    def get_user(self, user_id):
+        return FakeUser(user_id)
+
+    async def fetch_user(self, user_id):
+        return FakeUser(user_id)
+
+
+class FakeClient(FakeDiscord):
+    """The parts of the bot the run cog uses"""
+    def __init__(self, session=None, config=None):
+        self.session = session or StubSession()
+        self.latency = self.session.latency
+        self.config = {'emkc_key': '', 'admins': [], **(config or {})}
+        self.json = SimpleNamespace(name='json', dumps=json.dumps, loads=json.loads)
+        self.guild_settings = None
+        self.startup_report = FakeStartupReport()
+        self.cog_state = dict()
+        self.blocklist = set()
+        self.cached_messages = []
+        self.maintenance_mode = False
+        self.error_string = 'Sorry, something went wrong. We will look into it.'
+        self.errors = []  # (error, source) passed to log_error
+        self.channels = dict()
+        self.cogs = dict()
+
+    def resolve_settings(self, msg):
+        if self.guild_settings is None:
+            from cogs.utils.guildsettings import GuildSettingsStore
+            self.guild_settings = GuildSettingsStore('../state/guild_settings.json')
+            self.guild_settings.set_bot_id(1)
+        return self.guild_settings.resolve(msg.guild.id if msg.guild else None)
+
+    async def log_error(self, error, error_source=None):
+        self.errors.append((error, error_source))
+
+    def dispatch(self, event, *args):
+        pass
+
+    async def add_cog(self, cog):
+        self.cogs[cog.qualified_name] = cog
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+
+def piston_bot_class(src=SRC):
+    """The PistonBot class of bot.py - the module level code after the class (which
+    creates the client and connects to discord) is not executed"""
+    filename = path.join(src, 'bot.py')
+    with open(filename) as source:
+        module = ast.parse(source.read(), filename)
+    body = []
+    for node in module.body:
+        body.append(node)
+        if isinstance(node, ast.ClassDef) and node.name == 'PistonBot':
+            break
+    namespace = {'__name__': 'bot', '__file__': filename}
+    exec(compile(ast.Module(body, type_ignores=[]), filename, 'exec'), namespace)
+    return namespace['PistonBot']
+
+
+async def start_piston_bot(session=None):
+    """PistonBot with the config in ../state/config.json, [session] as its http session
+    and the fake channels, guilds and users. Cogs are added with
+    `await client.add_cog(...)`, events go through client.dispatch."""
+    class OfflinePistonBot(FakeDiscord, piston_bot_class()):
+        def __init__(self):
+            super().__init__(command_prefix='/')
+            self.session = session or StubSession()
+            self.channels = dict()
+
+    client = OfflinePistonBot()
+    client.remove_command('help')  # Like bot.py - a cog has its own help command
+    client.guild_settings.set_bot_id(1)
+    await client._async_setup_hook()  # What login does first - binds the client to the loop
+    return client
+
+
+async def start_run_cog(client):
+    """Create the run cog and wait until it loaded the runtimes"""
+    from cogs.run import Run
+    cog = Run(client)
+    await client.add_cog(cog)
+    for _ in range(100):
+        if getattr(cog, 'runtimes', None) or getattr(cog, 'languages', None):
+            break
+        await asyncio.sleep(0)
+    return cog
@@ -0,0 +1,21 @@
+import asyncio
+
+from cogs.utils.iostore import DurableIOStore
+
+
+def test_input_ids_are_loaded_in_the_background(bot_dir):
+    async def run():
+        store = DurableIOStore('../state/run_io.sqlite3')
+        store.put(1, 10, 100, 1000)
+        store.close()
+
+        store = DurableIOStore('../state/run_io.sqlite3')
+        opened = store.db is not None  # Nothing is read on the event loop
+        unknown = store.may_contain_input(200)  # Not loaded yet - may be stored
+        store.put(2, 10, 101, 1001)
+        await store.compact()
+        try:
+            return opened, unknown, [store.may_contain_input(i) for i in (100, 101, 200)]
+        finally:
+            store.close()
+    assert asyncio.run(run()) == (False, True, [True, True, False])
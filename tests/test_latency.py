@@ -0,0 +1,47 @@
+from cogs.utils.latency import MAX_TIMEOUT, MIN_SAMPLES, MIN_TIMEOUT, LatencyTracker
+from stubs import FakeClient, StubSession
+
+DATA = {'language': 'py', 'version': '3.10.0', 'files': [{'content': 'print(1)'}],
+        'args': [], 'stdin': '', 'log': 0}
+
+
+def tracker_with(language, seconds, samples=MIN_SAMPLES):
+    tracker = LatencyTracker()
+    for _ in range(samples):
+        tracker.observe(language, seconds)
+    return tracker
+
+
+def test_deadline_is_the_hard_timeout_until_enough_samples():
+    assert tracker_with('python', 0.2, MIN_SAMPLES - 1).deadline('python') == MAX_TIMEOUT
+
+
+def test_deadline_is_clamped_to_the_floor_and_the_hard_timeout():
+    assert tracker_with('python', 0.2).deadline('python') == MIN_TIMEOUT
+    assert tracker_with('rust', 10).deadline('rust') == MAX_TIMEOUT
+
+
+def test_deadline_follows_the_p99():
+    deadline = tracker_with('rust', 4).deadline('rust')
+    assert 3 * 4 * 0.8 < deadline < 3 * 4 * 1.2  # Histogram bins are ~19% wide
+
+
+class RecordingSession(StubSession):
+    def __init__(self):
+        super().__init__()
+        self.timeouts = []
+
+    def post(self, url, timeout=None, **kwargs):
+        self.timeouts.append(timeout.total)
+        return super().post(url, timeout=timeout, **kwargs)
+
+
+def test_requests_use_the_learned_deadline(run_cog):
+    async def test(client, cog):
+        for _ in range(MIN_SAMPLES):
+            await cog.request_execute('python', DATA)
+        await cog.request_execute('python', DATA)
+        return client.session.timeouts
+    timeouts = run_cog(test, FakeClient(RecordingSession()))
+    assert timeouts[0] == MAX_TIMEOUT
+    assert timeouts[-1] == MIN_TIMEOUT
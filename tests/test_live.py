@@ -0,0 +1,86 @@
+import asyncio
+
+import cogs.run
+from stubs import FakeClient, FakeContext, StubSession
+
+SOURCE = '/run py\n```py\nprint(input())\n```\nhello'
+EDIT_INTERVAL = 0.05
+
+
+def live_run(run_cog, program, content=SOURCE):
+    """Live run of [content] against [program] - returns the placeholder, the websocket
+    and the cog"""
+    async def test(client, cog):
+        ctx = FakeContext(client, 1, content, guild_id=1)
+        msg, _ = await cog.get_live_run_output(ctx)
+        return msg, client.session.websockets[-1], cog
+    return run_cog(test, FakeClient(StubSession(program=program)))
+
+
+async def stdin_echo(init, stdin):
+    yield 0, {'type': 'stage', 'stage': 'run'}
+    line = await stdin.get()
+    yield 0, {'type': 'data', 'stream': 'stdout', 'data': line}
+    yield 0, {'type': 'exit', 'stage': 'run', 'code': 0, 'signal': None}
+
+
+def test_stdin_is_written_to_the_running_program(run_cog):
+    msg, ws, _ = live_run(run_cog, stdin_echo)
+    init = ws.sent[0]
+    assert init['type'] == 'init' and init['stdin'] == ''
+    assert {'type': 'data', 'stream': 'stdin', 'data': 'hello'} in ws.sent
+    assert 'hello' in msg.content
+
+
+def streaming(chunks, interval, chunk):
+    async def program(init, stdin):
+        yield 0, {'type': 'stage', 'stage': 'run'}
+        for _ in range(chunks):
+            yield interval, {'type': 'data', 'stream': 'stdout', 'data': chunk}
+        yield 0, {'type': 'exit', 'stage': 'run', 'code': 0, 'signal': None}
+    return program
+
+
+def test_edits_are_rate_limited(run_cog, monkeypatch):
+    monkeypatch.setattr(cogs.run, 'LIVE_EDIT_INTERVAL', EDIT_INTERVAL)
+    # 40 chunks within ~0.4 s - at most one edit per interval plus the final one
+    msg, _, _ = live_run(run_cog, streaming(40, 0.01, 'line\n'))
+    assert 2 <= len(msg.edits) <= 0.4 / EDIT_INTERVAL + 3
+    assert msg.content.count('line') == 30  # Every line arrived, 30 are shown
+
+
+def test_every_edit_fits_into_a_message(run_cog, monkeypatch):
+    monkeypatch.setattr(cogs.run, 'LIVE_EDIT_INTERVAL', EDIT_INTERVAL)
+    msg, _, _ = live_run(
+        run_cog, streaming(20, 0.01, 'x' * 150 + '\n'),
+        content='/run py -> javascript\n```py\nprint()\n```'
+    )
+    assert msg.edits
+    for content in msg.edits:
+        assert len(content) <= 2000
+        assert content.split('```')[1].count('\n') <= 30
+
+
+async def failing(init, stdin):
+    yield 0, {'type': 'stage', 'stage': 'run'}
+    yield 0, {'type': 'error', 'message': 'boom'}
+
+
+def test_errors_replace_the_placeholder(run_cog):
+    msg, _, cog = live_run(run_cog, failing)
+    assert 'API Error `boom`' in msg.content
+    # The placeholder is still cleaned up with the source message
+    assert cog.run_IO_store[1].output is msg
+
+
+async def hanging(init, stdin):
+    yield 0, {'type': 'stage', 'stage': 'run'}
+    await asyncio.sleep(10)
+    yield 0, {'type': 'exit', 'stage': 'run', 'code': 0, 'signal': None}
+
+
+def test_timeouts_replace_the_placeholder(run_cog, monkeypatch):
+    monkeypatch.setattr(cogs.run, 'LIVE_EDIT_INTERVAL', EDIT_INTERVAL)
+    monkeypatch.setattr(cogs.run, 'LIVE_TIMEOUT', 0.2)
+    msg, _, _ = live_run(run_cog, hanging)
+    assert 'API Timeout' in msg.content
@@ -0,0 +1,42 @@
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+from cogs.utils.loopmonitor import LoopMonitor
+
+THRESHOLD = 0.1
+
+
+def monitor_blocks(durations):
+    """Block the event loop for each of [durations] at a random phase of the heartbeat
+    and return the recorded stalls and lag samples"""
+    async def run():
+        client = SimpleNamespace(latencies=[(0, 0.05), (1, float('nan')), (2, 0.2)])
+        monitor = LoopMonitor(client, interval=0.05, threshold=THRESHOLD)
+        monitor.start()
+        try:
+            rng = random.Random(1)
+            for duration in durations:
+                await asyncio.sleep(THRESHOLD + rng.uniform(0, THRESHOLD))
+                time.sleep(duration)
+            await asyncio.sleep(THRESHOLD)
+        finally:
+            monitor.stop()
+        return list(monitor.stalls), monitor
+    return asyncio.run(run())
+
+
+def test_every_block_longer_than_the_threshold_is_recorded():
+    stalls, _ = monitor_blocks([THRESHOLD * 1.2] * 20)
+    assert len(stalls) == 20
+    for stall in stalls:
+        assert THRESHOLD * 1.2 <= stall.duration <= THRESHOLD * 1.2 + THRESHOLD / 2
+        assert stall.slowest_shard() == (2, 0.2)
+
+
+def test_short_blocks_are_not_recorded():
+    stalls, monitor = monitor_blocks([THRESHOLD * 0.3] * 10)
+    assert stalls == []
+    assert monitor.samples and set(monitor.samples[-1][2]) == {0, 2}
+    assert 'Shard 2 gateway latency' in monitor.summary()
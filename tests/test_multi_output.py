@@ -0,0 +1,49 @@
+import pytest
+from stubs import FakeClient, FakeContext, StubSession
+
+
+def multi_run(run_cog, blocks, output_syntax='py', output=None, mention=None):
+    content = f'/run -> {output_syntax}\n' + ''.join(
+        f'```py\nprint({i})\n```' for i in range(blocks)
+    )
+
+    async def test(client, cog):
+        ctx = FakeContext(client, 1, content, guild_id=1)
+        if mention is not None:
+            ctx.author.mention = mention
+        return await cog.get_multi_run_output(ctx)
+    return run_cog(test, FakeClient(StubSession(output=output)))
+
+
+@pytest.mark.parametrize('blocks', [2, 3, 4, 5])
+@pytest.mark.parametrize('output_syntax', ['', 'py', 'javascript'])
+def test_long_outputs_fit_into_one_message(run_cog, blocks, output_syntax):
+    reply, full_output = multi_run(
+        run_cog, blocks, output_syntax, output=lambda data: 'a' * 3000
+    )
+    assert len(reply) <= 2000
+    assert reply.count('[...]') == blocks
+    assert full_output is not None
+
+
+def test_short_outputs_are_not_truncated(run_cog):
+    reply, full_output = multi_run(
+        run_cog, 2, output=lambda data: data['files'][0]['content']
+    )
+    assert '[...]' not in reply
+    assert full_output is None
+
+
+def test_mixed_outputs_fit_into_one_message(run_cog):
+    def output(data):
+        source = data['files'][0]['content']
+        return source if '0' in source else ('b`@' * 1500 + '\n') * 3
+    reply, _ = multi_run(run_cog, 5, output=output)
+    assert len(reply) <= 2000
+    assert 'print(0)' in reply
+
+
+def test_indicator_is_dropped_when_the_share_can_not_hold_it(run_cog):
+    reply, _ = multi_run(run_cog, 5, output=lambda data: 'a' * 3000, mention='m' * 1880)
+    assert len(reply) <= 2000
+    assert '[...]' not in reply
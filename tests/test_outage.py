@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+import pytest
+from aiohttp import ClientConnectorError, ConnectionTimeoutError
+from cogs.run import is_outage_error
+from cogs.utils.errors import PistonInvalidContentType, PistonInvalidStatus
+from stubs import FakeClient, FakeContext, StubSession
+
+SINGLE = '/run py\n```py\nprint("queued")\n```'
+
+
+@pytest.mark.parametrize('error, expected', [
+    (ConnectionTimeoutError(), True),
+    (ClientConnectorError(None, OSError('refused')), True),
+    (PistonInvalidContentType('invalid content type'), True),
+    (PistonInvalidStatus('status 502', 502), True),
+    (PistonInvalidStatus('status 429', 429), True),
+    (PistonInvalidStatus('status 400', 400), False),
+    # Piston kills slow programs itself - the timeout of the bot means a hung backend
+    (asyncio.TimeoutError(), True),
+])
+def test_outage_errors(error, expected):
+    assert is_outage_error(error) == expected
+
+
+def test_probe_executes_code(run_cog):
+    async def test(client, cog):
+        results = [await cog.probe_piston()]
+        client.session.status = 503
+        results.append(await cog.probe_piston())
+        return results, client.session.requests['execute']
+    assert run_cog(test) == ([True, False], 2)
+
+
+def test_rerun_is_queued_during_outages(run_cog):
+    async def test(client, cog):
+        await cog.get_run_output(FakeContext(client, 1, SINGLE, guild_id=1))
+        executed = client.session.requests['execute']
+        cog.watch_outage.cancel()  # Keep the probe from ending the outage
+        cog.outage_since = time.time()
+        ctx = FakeContext(client, 1, '/rerun', guild_id=1)
+        await cog.rerun_last(ctx, stdin='x')
+        queued = await cog.outage_queue.oldest(10)
+        return client.session.requests['execute'] - executed, ctx.sent, queued
+    executed, sent, queued = run_cog(test)
+    assert executed == 0
+    assert 'queued' in sent[-1].content
+    assert [run.user_id for run in queued] == [1]
+
+
+def test_hanging_backend_enters_outage_mode(run_cog):
+    async def test(client, cog):
+        for _ in range(cog.outage_threshold):
+            with pytest.raises(asyncio.TimeoutError):
+                await cog.get_run_output(FakeContext(client, 1, SINGLE, guild_id=1))
+        return cog.outage_since
+    client = FakeClient(StubSession(output=lambda data: asyncio.TimeoutError()))
+    assert run_cog(test, client) is not None
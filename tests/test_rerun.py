@@ -0,0 +1,29 @@
+import pytest
+from discord.ext import commands
+from stubs import FakeContext
+
+SINGLE = '/run py\n```py\nprint("single")\n```'
+MULTI = '/run\n```py\nprint(1)\n```\n```py\nprint(2)\n```'
+INVALID = '/run cobol\n```\nDISPLAY "x"\n```'
+
+
+def rerun_after(run_cog, *contents):
+    """Run [contents] one after another and return the cached run of the user"""
+    async def test(client, cog):
+        for content in contents:
+            try:
+                await cog.get_run_output(FakeContext(client, 1, content, guild_id=1))
+            except commands.BadArgument:
+                pass
+        return cog.invocations.get(1)
+    return run_cog(test)
+
+
+def test_single_codeblock_is_cached(run_cog):
+    parsed = rerun_after(run_cog, SINGLE)
+    assert parsed.data['files'][0]['content'].strip() == 'print("single")'
+
+
+@pytest.mark.parametrize('content', [MULTI, INVALID])
+def test_later_runs_replace_the_cached_run(run_cog, content):
+    assert rerun_after(run_cog, SINGLE, content) is None
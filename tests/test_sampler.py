@@ -0,0 +1,21 @@
+"""Redaction of sampled invocations"""
+import pytest
+
+from cogs.utils.sampler import redact
+
+LANGUAGES = {'py', 'python', 'js'}
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('/run py\n```py\nprint("a1")\n```', '/run py\n```py\naaaaa("a0")\n```'),
+    ('/run\n```JS\nx = 1\n```\nstdin 2', '/run\n```JS\na = 0\n```\naaaaa 0'),
+    # Without a newline the first line of a codeblock is code
+    ("/run py\n```print('hunter2')```", "/run py\n```aaaaa('aaaaaa0')```"),
+    ("/run py ```x='s3cr3t'```", "/run py ```a='a0aa0a'```"),
+    ('/run py\n```py print(1)\n```', '/run py\n```aa aaaaa(0)\n```'),
+    # Unknown syntax lines may be code too
+    ('/run py\n```s3cr3t\nx\n```', '/run py\n```a0aa0a\na\n```'),
+    ('/run\n```py\nx\n```\n```hunter2', '/run\n```py\na\n```\n```aaaaaa0'),
+])
+def test_redact_keeps_only_languages(content, expected):
+    assert redact(content, LANGUAGES.__contains__) == expected
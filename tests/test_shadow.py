@@ -0,0 +1,27 @@
+import asyncio
+
+from stubs import FakeClient, Latency, StubSession
+
+DATA = {'language': 'py', 'version': '3.10.0', 'files': [{'content': 'print(1)'}],
+        'args': [], 'stdin': '', 'log': 0}
+
+
+def test_burst_of_mirrors_respects_the_concurrency_cap(run_cog):
+    async def test(client, cog):
+        session = client.session
+        executed = session.requests['execute']
+        primary = await cog.request_execute('python', DATA)
+        for _ in range(10):  # Nothing runs between the calls
+            cog.mirror_execute('python', DATA, primary, 0.01)
+        active = cog.shadow_active
+        await asyncio.gather(*cog.background_tasks)
+        return (
+            active, cog.shadow_stats.skipped, cog.shadow_active,
+            session.requests['execute'] - executed
+        )
+    active, skipped, finished, executed = run_cog(test, FakeClient(
+        StubSession(Latency(execute=0.01)),
+        config={'shadow': {'url': 'http://shadow', 'rate': 1.0, 'concurrency': 2}}
+    ))
+    assert (active, skipped, finished) == (2, 8, 0)
+    assert executed == 3
@@ -0,0 +1,264 @@
+"""Soak test of the bot: many users run code against the stub piston, commands fail,
+servers join and leave and messages fill the message cache of a PistonBot with the
+run, error handler and management cogs. No long lived structure of the bot (nor the
+traced memory or the RSS) may keep growing.
+
+Time is compressed by default (ROUND_SECONDS of simulated time per round). A long run
+in real time sleeps ROUND_SECONDS between the rounds instead. Either way the rounds
+have to span at least twice the ttl of the IO store (7 days) - before that the stores
+without a size bound still grow:
+
+    SOAK_ROUNDS=1000 SOAK_ROUND_SECONDS=60 SOAK_REAL_TIME=1 python -m pytest tests/test_soak.py
+    python tests/test_soak.py --rounds 1000 --round-seconds 60 --real-time
+"""
+import argparse
+import asyncio
+import gc
+import json
+import random
+import tempfile
+import tracemalloc
+from contextlib import ExitStack
+from os import environ
+from unittest.mock import patch
+
+from stubs import (
+    FakeAttachment, FakeContext, FakeGuild, StubSession, bot_directory, import_src,
+    start_piston_bot, start_run_cog,
+)
+
+import_src()
+# pylint: disable=C0413
+import cogs.run
+import cogs.utils.iostore
+import cogs.utils.quota
+from cogs.error_handler import ErrorHandler
+from cogs.management import Management
+from cogs.utils.errors import PistonInvalidStatus
+from cogs.utils.memory import get_rss
+from discord.ext import commands
+
+ROUNDS = int(environ.get('SOAK_ROUNDS', 80))
+RUNS_PER_ROUND = int(environ.get('SOAK_RUNS_PER_ROUND', 40))
+# Time per round - with the default the IO store ttl ends after 28 rounds
+ROUND_SECONDS = float(environ.get('SOAK_ROUND_SECONDS', 6 * 3600))
+REAL_TIME = environ.get('SOAK_REAL_TIME', '') not in ('', '0')
+MESSAGES_PER_ROUND = 100  # MESSAGE_CREATE events per round
+RSS_SLACK = 32 * 2**20  # Allowed RSS growth in the second half of the rounds
+TYPOS = ['pyhton', 'pythn', 'javscript', 'rsut', 'bsh', 'cobol', 'pyton3', 'jvascript']
+CONFIG = {
+    'bot_key': '',
+    'emkc_key': '',
+    'admins': [],
+    'max_errors': 20,
+    'max_messages': 500,
+    'run_io_cache_size': 300,
+    'output_store_bytes': 200_000,
+    'rerun_cache_bytes': 200_000,
+    'quota': {'max_charged': 500},
+    'analytics_salt': 'soak',
+    'traffic_sampler': {'enabled': True, 'rate': 1.0, 'max_bytes': 100_000},
+}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+def program_output(data):
+    source = data['files'][0]['content']
+    if 'fail' in source:
+        # Not an outage - the error is logged and the runs go on
+        return PistonInvalidStatus('status 400', 400)
+    if 'long' in source:
+        # Barely compressible, so the output store fills up
+        output = random.Random(source).randbytes(3000).hex()
+        return '\n'.join(output[i:i + 100] for i in range(0, len(output), 100))
+    return source
+
+
+def make_context(client, i, user_id):
+    guild_id = 1 + user_id % 7
+    kind = i % 8
+    if kind == 0:
+        content = f'/run py\n```py\nprint({i})\n```'
+    elif kind == 1:
+        content = f'/run {TYPOS[i % len(TYPOS)]}\n```\nprint({i})\n```'
+    elif kind == 2:
+        content = '/run\n' + ''.join(f'```py\nprint({i}, {j})\n```' for j in range(3))
+    elif kind == 3:
+        content = f'/run py\n```py\nprint("long", {i})\n```'
+    elif kind == 4:
+        return FakeContext(client, user_id, '/run', guild_id, [
+            FakeAttachment('main.rs', f'fn main() {{ println!("{i}"); }}')
+        ])
+    elif kind == 5:
+        content = f'/run py\n```py\nprint("fail", {i})\n```'
+    else:
+        content = f'/run python@3\narg{i}\n```py\nprint({i})\n```\nstdin {i}'
+    return FakeContext(client, user_id, content, guild_id)
+
+
+def message_payload(message_id, channel_id):
+    """MESSAGE_CREATE of another bot in a DM channel (ignored by process_commands)"""
+    return {
+        'id': str(message_id), 'channel_id': str(channel_id),
+        'author': {
+            'id': str(channel_id), 'username': 'other bot', 'discriminator': '0',
+            'global_name': None, 'avatar': None, 'bot': True,
+        },
+        'content': 'some message content ' * 4, 'timestamp': '2024-01-01T00:00:00+00:00',
+        'edited_timestamp': None, 'tts': False, 'mention_everyone': False, 'mentions': [],
+        'mention_roles': [], 'attachments': [], 'embeds': [], 'pinned': False, 'type': 0,
+    }
+
+
+async def invoke(client, ctx, command):
+    """Await the [command] coroutine - errors reach on_command_error like in discord.py"""
+    try:
+        await command
+    except commands.CommandError as error:
+        client.dispatch('command_error', ctx, error)
+    except Exception as error:
+        client.dispatch('command_error', ctx, commands.CommandInvokeError(error))
+
+
+async def soak(rounds, runs_per_round, round_seconds, clock=None, on_round=None):
+    """Returns the structure sizes, the traced memory and the RSS after each round.
+    Without [clock] the rounds are [round_seconds] apart in real time."""
+    with open('../state/config.json', 'w') as config:
+        json.dump(CONFIG, config)
+    client = await start_piston_bot(StubSession(output=program_output))
+    await client.add_cog(ErrorHandler(client))
+    await client.add_cog(Management(client))
+    cog = await start_run_cog(client)
+    cog.invocations.max_entries = 200
+    error_handler = client.get_cog('ErrorHandler')
+    history, memory, rss = [], [], []
+    try:
+        for round_number in range(rounds):
+            for i in range(runs_per_round):
+                user_id = round_number * runs_per_round + i + 1  # Every run is a new user
+                ctx = make_context(client, i, user_id)
+                guild_id = ctx.guild.id
+                await invoke(client, ctx, cog.run.callback(cog, ctx, source=ctx.message.content))
+                if i % 5 == 0:
+                    edit = FakeContext(
+                        client, user_id, f'/run py\n```py\nprint({i} + 1)\n```', guild_id
+                    )
+                    await invoke(client, edit, cog.edit_last_run.callback(
+                        cog, edit, content=edit.message.content[4:]
+                    ))
+                if i % 7 == 0 and cog.invocations.get(user_id) is not None:
+                    rerun = FakeContext(client, user_id, '/rerun', guild_id)
+                    await invoke(client, rerun, cog.rerun_last(rerun, stdin='x'))
+                if i % 9 == 0:
+                    await cog.delete_last_output(user_id)
+                if i % 4 == 0:
+                    guild = FakeGuild(user_id + 1000, shard_id=i % 3)
+                    client.dispatch('guild_join', guild)
+                    if i % 8 == 0:
+                        client.dispatch('guild_remove', guild)
+            for i in range(MESSAGES_PER_ROUND):
+                message_id = round_number * MESSAGES_PER_ROUND + i + 1
+                client._connection.parse_message_create(message_payload(message_id, i + 1))
+            if clock is not None:
+                clock.now += round_seconds
+                await asyncio.sleep(0.01)  # Let the dispatched events finish
+            else:
+                await asyncio.sleep(round_seconds)
+            client.channels.clear()  # Only the fake channels would keep every message
+            # The work of the background loops
+            cog.user_ledger.prune()
+            cog.guild_ledger.prune()
+            await cog.io_db.flush()
+            await cog.io_db.compact()
+            history.append(error_handler.get_structure_sizes())
+            gc.collect()  # Only count what is retained, not cycles that wait for the gc
+            memory.append(tracemalloc.get_traced_memory()[0])
+            rss.append(get_rss())
+            if on_round is not None:
+                on_round(round_number, history[-1], memory[-1], rss[-1])
+    finally:
+        for name in list(client.cogs):
+            await client.remove_cog(name)
+    return history, memory, rss
+
+
+def run_soak(rounds=ROUNDS, runs_per_round=RUNS_PER_ROUND, round_seconds=ROUND_SECONDS,
+             real_time=REAL_TIME, on_round=None):
+    clock = None if real_time else FakeClock()
+    with ExitStack() as stack:
+        stack.enter_context(patch.object(cogs.run, 'MAX_PENDING_SUGGESTIONS', 100))
+        if clock is not None:
+            stack.enter_context(patch.object(cogs.utils.quota, 'time', clock))
+            stack.enter_context(patch.object(cogs.utils.iostore, 'time', clock))
+        tracemalloc.start()
+        try:
+            return asyncio.run(soak(rounds, runs_per_round, round_seconds, clock, on_round))
+        finally:
+            tracemalloc.stop()
+
+
+def check(history, memory, rss):
+    half = len(history) // 2
+    for name in history[0]:
+        sizes = [structures[name][0] for structures in history]
+        bound = history[-1][name][1]
+        if bound is not None:
+            assert max(sizes) <= bound, f'{name} exceeded its bound {bound}: {sizes}'
+        else:
+            assert sizes[-1] <= max(sizes[:half]), f'{name} kept growing: {sizes}'
+    # The bounded structures of the bot were filled up
+    for name in ('last_errors', 'recent_guilds_joined', 'recent_guilds_left', 'message cache'):
+        size, bound = history[-1][name]
+        assert size == bound, f'{name} was not filled up: {size} / {bound}'
+    assert memory[-1] <= max(memory[:half]) * 1.1 + 256 * 1024, (
+        f'Traced memory kept growing: {[size // 1024 for size in memory]} kb'
+    )
+    assert rss[-1] <= max(rss[:half]) + RSS_SLACK, (
+        f'RSS kept growing: {[size // 2**20 for size in rss]} MB'
+    )
+
+
+def test_long_lived_structures_stop_growing(bot_dir):
+    check(*run_soak())
+
+
+def print_round(round_number, structures, traced, rss):
+    sizes = ' | '.join(
+        f'{name} {size}' for name, (size, _) in structures.items()
+        if name in ('last_errors', 'message cache', 'run_IO_store')
+    )
+    print(
+        f'round {round_number + 1} | RSS {rss / 2**20:.1f} MB | '
+        f'traced {traced / 2**20:.1f} MB | {sizes}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rounds', type=int, default=ROUNDS)
+    parser.add_argument('--runs', type=int, default=RUNS_PER_ROUND, help='runs per round')
+    parser.add_argument('--round-seconds', type=float, default=ROUND_SECONDS,
+                        help='(simulated) seconds per round')
+    parser.add_argument('--real-time', action='store_true', default=REAL_TIME,
+                        help='sleep --round-seconds between the rounds')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as root, bot_directory(root):
+        results = run_soak(
+            args.rounds, args.runs, args.round_seconds, args.real_time, print_round
+        )
+    check(*results)
+    print('No structure kept growing')
+
+
+if __name__ == '__main__':
+    main()